@@ -0,0 +1,128 @@
+"""
+app.py — builds the bot, the dispatcher and the services around them.
+
+Shared by main.py (one process, polling or webhook) and by the shard
+workers in sharding.py, so every process is wired the same way.
+"""
+import asyncio
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+from loguru import logger
+
+from config import (
+    BOT_TOKEN, FSM_STORAGE, FSM_TTL, FSM_WRITE_BEHIND, FSM_FLUSH_INTERVAL, FSM_CACHE_MAX, FSM_IDLE_TIMEOUT,
+    UPDATE_CONCURRENCY, UPDATE_DEADLINE, CALLBACK_ACK_GRACE, WORKERS, WEBHOOK_DRAIN_TIMEOUT,
+    OUTBOX_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_GROUP_PER_MINUTE,
+)
+from database import init_db, close_db
+from database.invalidation import start_listener, stop_listener, invalidation_stats
+from database.fsm_storage import PgStorage
+from utils.session_expiry import IdleExpiryStorage
+from utils.outbox import Outbox
+from handlers import main_router
+from middlewares import (
+    RoleMiddleware, DbSessionMiddleware, SessionExpiryMiddleware,
+    ChatIsolation, DeadlineMiddleware, CallbackAckMiddleware,
+)
+from middlewares.role_middleware import cache_stats
+from services.tool_service import catalog_stats
+
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+
+def create_bot() -> Bot:
+    if not BOT_TOKEN:
+        raise ValueError("BOT_TOKEN is not set in .env file!")
+    return Bot(
+        token=BOT_TOKEN,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+
+
+def create_dispatcher(shard_worker: bool = False) -> Dispatcher:
+    """
+    shard_worker: built by a sharding.py worker, the only process that ever
+    sees its chats — FSM storage may then cache and batch (FSM_WRITE_BEHIND).
+    """
+    if FSM_WRITE_BEHIND and not shard_worker:
+        logger.warning("FSM_WRITE_BEHIND needs WORKERS > 1 — writing FSM state through")
+    if FSM_STORAGE == "postgres":
+        storage = PgStorage(FSM_TTL, write_behind=FSM_WRITE_BEHIND and shard_worker,
+                            flush_interval=FSM_FLUSH_INTERVAL, cache_max=FSM_CACHE_MAX)
+    else:
+        storage = MemoryStorage()
+    isolation = ChatIsolation(UPDATE_CONCURRENCY)
+    # The sweep clears a chat under the same lock its updates run under
+    sessions = (IdleExpiryStorage(storage, FSM_IDLE_TIMEOUT, isolation=isolation)
+                if FSM_IDLE_TIMEOUT > 0 else None)
+    dp = Dispatcher(storage=sessions or storage, events_isolation=isolation)
+    # Handlers that send several messages take `outbox` and queue them there
+    dp["outbox"] = Outbox(OUTBOX_RATE / WORKERS, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST,
+                          OUTBOX_GROUP_PER_MINUTE)
+
+    # Middleware
+    dp.update.outer_middleware(DbSessionMiddleware())
+    if UPDATE_DEADLINE > 0:
+        # Inside the unit of work — a timeout never cancels its commit
+        dp.update.outer_middleware(DeadlineMiddleware(UPDATE_DEADLINE))
+    ack = dp["callback_ack"] = CallbackAckMiddleware(CALLBACK_ACK_GRACE)
+    dp.callback_query.middleware(ack)
+    dp.startup.register(ack.install)
+    dp.message.middleware(RoleMiddleware())
+    dp.callback_query.middleware(RoleMiddleware())
+    if sessions:
+        dp.message.middleware(SessionExpiryMiddleware(sessions))
+        dp.callback_query.middleware(SessionExpiryMiddleware(sessions))
+
+    # Routers
+    dp.include_router(main_router)
+    return dp
+
+
+async def start_services(migrate: bool = True) -> None:
+    """Database pool (+ migrations) and the cache invalidation listener."""
+    await init_db(migrate=migrate)
+    await start_listener()
+    logger.info("✅ Database ready")
+
+
+async def stop_services(dp: Dispatcher) -> None:
+    """Call before closing the bot session — queued messages still go out."""
+    await dp["outbox"].close(WEBHOOK_DRAIN_TIMEOUT)
+    await stop_listener()
+    await dp.storage.close()   # flushes pending FSM writes — needs the pool
+    await close_db()
+    _log_stats(dp)
+
+
+def _log_stats(dp: Dispatcher) -> None:
+    isolation = dp.fsm.events_isolation
+    if isinstance(isolation, ChatIsolation):
+        logger.info(f"Update execution: {isolation.stats()}")
+    storage = dp.storage
+    logger.info(f"User cache: {cache_stats()}")
+    logger.info(f"Tool catalog cache: {catalog_stats()}")
+    logger.info(f"Cache invalidation: {invalidation_stats()}")
+    logger.info(f"Outbox: {dp['outbox'].stats()}")
+    logger.info(f"Callback answers: {dp['callback_ack'].stats()}")
+    if isinstance(storage, IdleExpiryStorage):
+        logger.info(f"FSM sessions: {storage.stats()}")
+        storage = storage.inner
+    if isinstance(storage, PgStorage):
+        logger.info(f"FSM storage: {storage.stats()}")
+
+
+async def wait_for_stop_signal() -> None:
+    """Return on SIGINT/SIGTERM (servers that don't install their own handlers)."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    await stop.wait()
@@ -0,0 +1,72 @@
+"""
+benchmarks/keyboards.py
+
+CPU cost of building the hot keyboards from scratch vs serving the memoized
+markup, per call. No database or network needed.
+
+    python -m benchmarks.keyboards
+    python -m benchmarks.keyboards --tools 300 --number 2000
+"""
+import argparse
+import timeit
+
+from utils import keyboards as kb
+from utils.callback_data import RentalsPage, ToolPurpose
+
+
+def _tools(n: int) -> list[dict]:
+    return [{"id": i, "name": f"Asbob {i:03d}", "quantity": i % 7, "daily_price": 15000.0}
+            for i in range(1, n + 1)]
+
+
+def _rentals(n: int) -> list[dict]:
+    return [{"id": i, "customer_name": f"Mijoz {i}", "customer_phone": f"+99890{i:07d}"}
+            for i in range(1, n + 1)]
+
+
+def _cases(n_tools: int):
+    tools = _tools(n_tools)
+    selected = [1, 2, 3]
+    version = (1, 0, 0)
+    rentals = _rentals(10)
+    nav = kb.pagination_row(RentalsPage, 2, 95, 11, 20, True, True)
+    uncached_menu = kb.user_main_menu.__wrapped__
+    return [
+        ("user_main_menu",
+         uncached_menu,
+         kb.user_main_menu),
+        (f"rental_tools_selection ({n_tools} tools)",
+         lambda: kb.rental_tools_selection_keyboard(tools, selected),
+         lambda: kb.rental_tools_selection_keyboard(tools, selected, version=version)),
+        (f"tools_list ({n_tools} tools)",
+         lambda: kb.tools_list_keyboard(tools, ToolPurpose.edit),
+         lambda: kb.tools_list_keyboard(tools, ToolPurpose.edit, version=version)),
+        ("rental_list (10 rows + nav)",
+         lambda: kb._rental_list_keyboard(rentals, nav),
+         lambda: kb.rental_list_keyboard(rentals, nav)),
+    ]
+
+
+def _per_call(fn, number: int) -> float:
+    """Best of 3, in µs; slow builds get fewer calls so a run stays short."""
+    timer = timeit.Timer(fn)
+    runs = min(number, timer.autorange()[0])
+    return min(timer.repeat(repeat=3, number=runs)) / runs * 1e6
+
+
+def main(n_tools: int, number: int) -> None:
+    print(f"{'keyboard':40} {'build µs':>10} {'memo µs':>10} {'saved':>8}")
+    for label, build, memo in _cases(n_tools):
+        memo()  # warm the memo
+        t_build = _per_call(build, number)
+        t_memo = _per_call(memo, number)
+        print(f"{label:40} {t_build:10.1f} {t_memo:10.1f} {t_build / t_memo:7.0f}×")
+    print(f"\nmemo: {kb.keyboard_cache_stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--tools", type=int, default=300, help="catalog size")
+    parser.add_argument("--number", type=int, default=2000, help="max calls per timing run")
+    args = parser.parse_args()
+    main(args.tools, args.number)
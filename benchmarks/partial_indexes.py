@@ -0,0 +1,154 @@
+"""
+benchmarks/partial_indexes.py
+
+Shows how the v0007 partial indexes change the plans of the hot queries.
+Seeds a throwaway schema with a realistic skew (≈95% closed rentals,
+≈92% paid-off debts, most items returned), then runs EXPLAIN ANALYZE on
+each query before and after applying the migration.
+
+    python -m benchmarks.partial_indexes                # DATABASE_URL from .env
+    python -m benchmarks.partial_indexes --scale 5 --keep
+
+Nothing outside the `bench_partial` schema is touched.
+"""
+import argparse
+import asyncio
+import json
+
+import asyncpg
+
+from config import DATABASE_URL
+from database.migrations import (
+    v0001_initial, v0002_lookup_indexes, v0003_keyset_indexes, v0007_partial_indexes,
+)
+
+SCHEMA = "bench_partial"
+
+# (label, sql, args) — args use the shop seeded with the most rows (user_id = 1)
+QUERIES = [
+    ("active rentals page",
+     "SELECT * FROM rentals WHERE user_id=$1 AND status='active' "
+     "ORDER BY rental_date DESC, id DESC LIMIT 11", (1,)),
+    ("count active rentals",
+     "SELECT COUNT(*) FROM rentals WHERE user_id=$1 AND status='active'", (1,)),
+    ("open debts page",
+     "SELECT * FROM debts WHERE user_id=$1 AND amount > 0 "
+     "ORDER BY created_at DESC, id DESC LIMIT 11", (1,)),
+    ("total debt",
+     "SELECT COALESCE(SUM(amount), 0) FROM debts WHERE user_id=$1 AND amount > 0", (1,)),
+    ("open debt of rental",
+     "SELECT id, amount FROM debts WHERE user_id=$1 AND rental_id=$2 AND amount > 0", (1, 7)),
+    ("unreturned items",
+     "SELECT ri.*, t.name AS tool_name FROM rental_items ri JOIN tools t ON t.id = ri.tool_id "
+     "WHERE ri.rental_id=$1 AND (ri.quantity - ri.returned_quantity) > 0", (7,)),
+    ("tool in use (delete_tool)",
+     "SELECT COUNT(*) FROM rental_items ri JOIN rentals r ON r.id = ri.rental_id "
+     "WHERE ri.tool_id=$1 AND r.status='active' AND (ri.quantity - ri.returned_quantity) > 0", (3,)),
+]
+
+
+async def _seed(conn: asyncpg.Connection, scale: int) -> None:
+    rentals, debts = 200_000 * scale, 100_000 * scale
+    for sql in v0001_initial.STATEMENTS + v0002_lookup_indexes.STATEMENTS \
+            + v0003_keyset_indexes.STATEMENTS:
+        await conn.execute(sql)
+    await conn.execute("""
+        INSERT INTO users (telegram_id, full_name, shop_name, address, phone, is_active)
+        SELECT g, 'Owner ' || g, 'Shop ' || g, 'Addr', '+99890' || lpad(g::text, 7, '0'), TRUE
+        FROM generate_series(1, 50) g
+    """)
+    await conn.execute("""
+        INSERT INTO tools (user_id, name, quantity, daily_price)
+        SELECT 1 + g % 50, 'Tool ' || g, 100, 10000 FROM generate_series(1, 5000) g
+    """)
+    # Half of all rows belong to shop 1 — the "largest shop" case
+    await conn.execute(f"""
+        INSERT INTO rentals (user_id, customer_name, customer_address, customer_phone,
+                             status, rental_date)
+        SELECT CASE WHEN g % 2 = 0 THEN 1 ELSE 1 + g % 50 END,
+               'Customer ' || g, 'Addr', '+99891' || lpad((g % 9999999)::text, 7, '0'),
+               CASE WHEN random() < 0.05 THEN 'active' ELSE 'closed' END,
+               NOW() - (g || ' minutes')::interval
+        FROM generate_series(1, {rentals}) g
+    """)
+    await conn.execute("""
+        INSERT INTO rental_items (rental_id, tool_id, quantity, daily_price, returned_quantity)
+        SELECT r.id, 1 + (r.id * 7 + k) % 5000, 4, 10000,
+               CASE WHEN r.status = 'active' THEN 0 ELSE 4 END
+        FROM rentals r, generate_series(1, 3) k
+    """)
+    await conn.execute(f"""
+        INSERT INTO debts (user_id, customer_name, customer_phone, amount, rental_id, created_at)
+        SELECT CASE WHEN g % 2 = 0 THEN 1 ELSE 1 + g % 50 END,
+               'Customer ' || g, '+99891' || lpad(g::text, 7, '0'),
+               CASE WHEN random() < 0.08 THEN 50000 ELSE 0 END,
+               1 + g % {rentals}, NOW() - (g || ' minutes')::interval
+        FROM generate_series(1, {debts}) g
+    """)
+    await conn.execute("ANALYZE")
+
+
+def _plan_summary(node: dict) -> str:
+    """Compact 'Node[index]' chain of the plan tree, outermost first."""
+    parts = []
+
+    def walk(n):
+        label = n["Node Type"]
+        if "Index Name" in n:
+            label += f"[{n['Index Name']}]"
+        parts.append(label)
+        for child in n.get("Plans", []):
+            walk(child)
+
+    walk(node)
+    return " → ".join(parts)
+
+
+async def _explain(conn: asyncpg.Connection) -> dict[str, tuple[str, float, int]]:
+    out = {}
+    for label, sql, args in QUERIES:
+        raw = await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", *args)
+        plan = json.loads(raw)[0]
+        root = plan["Plan"]
+        buffers = root.get("Shared Hit Blocks", 0) + root.get("Shared Read Blocks", 0)
+        out[label] = (_plan_summary(root), plan["Execution Time"], buffers)
+    return out
+
+
+def _report(before: dict, after: dict) -> None:
+    for label, _, _ in QUERIES:
+        b_plan, b_ms, b_buf = before[label]
+        a_plan, a_ms, a_buf = after[label]
+        print(f"\n■ {label}")
+        print(f"  before: {b_ms:9.2f} ms  {b_buf:7d} buffers  {b_plan}")
+        print(f"  after:  {a_ms:9.2f} ms  {a_buf:7d} buffers  {a_plan}")
+
+
+async def main(dsn: str, scale: int, keep: bool) -> None:
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+        await conn.execute(f"SET search_path TO {SCHEMA}")
+        print(f"Seeding {SCHEMA} (scale={scale}) …")
+        await _seed(conn, scale)
+
+        before = await _explain(conn)
+        for sql in v0007_partial_indexes.STATEMENTS:
+            await conn.execute(sql)
+        await conn.execute("ANALYZE")
+        after = await _explain(conn)
+        _report(before, after)
+    finally:
+        if not keep:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--scale", type=int, default=1, help="×200k rentals, ×100k debts")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded schema")
+    args = parser.parse_args()
+    asyncio.run(main(args.dsn, args.scale, args.keep))
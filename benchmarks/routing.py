@@ -0,0 +1,109 @@
+"""
+benchmarks/routing.py
+
+Per-update cost of finding the handler for a text message or an inline
+button tap: walking the router tree (every Button / state / payload filter
+in order) vs the button and callback tables in handlers/buttons.py and
+handlers/callbacks.py. Handler bodies and the DB middlewares are left out —
+only the dispatcher, the FSM middleware and the filters run.
+
+    python -m benchmarks.routing
+    python -m benchmarks.routing --number 2000
+"""
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+
+from handlers import main_router, states
+from handlers.buttons import _handlers
+from utils.callback_data import (
+    PackedCallbackData, UsersPage, ToolsPage, RentalDetail, ReturnItem, DebtView,
+    SubAccountDelete,
+)
+from utils.texts import (
+    BTN_USER_LIST, BTN_TOOLS, BTN_RENTAL_LIST, BTN_DEBT_LIST, BTN_SUB_ACCOUNTS,
+)
+
+CHAT_ID = 1001
+
+# (label, text or callback payload, FSM state the chat is in)
+CASES = [
+    ("button, 2nd router", BTN_USER_LIST, None),
+    ("button, 3rd router", BTN_TOOLS, None),
+    ("button, 4th router", BTN_RENTAL_LIST, None),
+    ("button, 5th router", BTN_DEBT_LIST, None),
+    ("button, last router", BTN_SUB_ACCOUNTS, None),
+    ("free text, debt search", "Alisher", states.SearchDebtFSM.query.state),
+    ("free text, no handler", "salom", None),
+    ("callback, 2nd router", UsersPage(forward=True, page=2, total=95, anchor=10), None),
+    ("callback, 3rd router", ToolsPage(forward=True, page=2, total=95, anchor=10), None),
+    ("callback, 4th router", RentalDetail(id=4821), None),
+    ("callback, 4th router, FSM", ReturnItem(id=4821), states.ReturnRentalFSM.select_item.state),
+    ("callback, 5th router", DebtView(id=4821), None),
+    ("callback, last router", SubAccountDelete(id=17), None),
+]
+
+
+async def _noop(*args, **kwargs):
+    return None
+
+
+def _update(n: int, payload: str | PackedCallbackData) -> Update:
+    user = {"id": CHAT_ID, "is_bot": False, "first_name": "Bench"}
+    message = {
+        "message_id": n, "date": 0, "text": payload if isinstance(payload, str) else "...",
+        "chat": {"id": CHAT_ID, "type": "private"}, "from": user,
+    }
+    if isinstance(payload, str):
+        return Update.model_validate({"update_id": n, "message": message})
+    return Update.model_validate({"update_id": n, "callback_query": {
+        "id": str(n), "from": user, "chat_instance": "1",
+        "message": message, "data": payload.pack(),
+    }})
+
+
+async def _per_update(dp: Dispatcher, bot: Bot, payload, number: int) -> float:
+    """Best of 3, in µs."""
+    updates = [_update(n, payload) for n in range(number)]
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for update in updates:
+            await dp.feed_update(bot, update)
+        best = min(best, time.perf_counter() - started)
+    return best / number * 1e6
+
+
+async def main(number: int) -> None:
+    tables = main_router.sub_routers[:2]   # buttons, callbacks
+    for event in ("message", "callback_query"):
+        for _, handler in _handlers(main_router, event):
+            if not handler.callback.__name__.startswith("dispatch_"):
+                handler.callback = _noop   # keeps its signature-based kwargs filtering
+
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(main_router)
+    bot = Bot("42:BENCHMARK")
+    key = StorageKey(bot_id=bot.id, chat_id=CHAT_ID, user_id=CHAT_ID)
+
+    print(f"{'update':28} {'tree µs':>9} {'table µs':>9} {'saved':>7}")
+    for label, payload, state in CASES:
+        await dp.storage.set_state(key, state)
+        del main_router.sub_routers[:2]
+        t_tree = await _per_update(dp, bot, payload, number)
+        main_router.sub_routers[:0] = tables
+        t_table = await _per_update(dp, bot, payload, number)
+        print(f"{label:28} {t_tree:9.1f} {t_table:9.1f} {t_tree / t_table:6.1f}×")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--number", type=int, default=500, help="updates per timing run")
+    args = parser.parse_args()
+    asyncio.run(main(args.number))
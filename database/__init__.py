@@ -1,3 +1,3 @@
-from .db import get_db, init_db, close_db
+from .db import get_db, get_ro_db, init_db, migrate_db, close_db, UnitOfWork
 
-__all__ = ["get_db", "init_db", "close_db"]
+__all__ = ["get_db", "get_ro_db", "init_db", "migrate_db", "close_db", "UnitOfWork"]
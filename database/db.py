@@ -8,24 +8,34 @@ The API is identical to before:
     async with get_db() as conn:
         row = await conn.fetchrow("SELECT * FROM users WHERE id = $1", user_id)
 
+Plain reads should use get_ro_db() instead — same usage, but no
+BEGIN/COMMIT around the query.
+
 NOTE: asyncpg uses $1, $2 ... placeholders (not ?).
 All queries in services already use $1/$2 because we updated them below.
 """
 from __future__ import annotations
 
+import asyncio
 import asyncpg
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 from loguru import logger
 
 from config import DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX
+from .migrations import migrate as apply_migrations
 
 # ── Single global pool ────────────────────────────────────────────────────────
 _pool: asyncpg.Pool | None = None
 
 
-async def init_db() -> None:
-    """Create pool + create all tables + indexes. Call once at startup."""
+async def init_db(migrate: bool = True) -> None:
+    """
+    Create pool + apply pending schema migrations. Call once at startup.
+
+    Shard workers pass migrate=False: the front process has already run
+    migrate_db() before spawning them.
+    """
     global _pool
 
     _pool = await asyncpg.create_pool(
@@ -36,9 +46,20 @@ async def init_db() -> None:
     )
     logger.info(f"✅ PostgreSQL pool ready (min={DB_POOL_MIN} max={DB_POOL_MAX})")
 
-    async with _pool.acquire() as conn:
-        await _create_tables(conn)
-    logger.info("✅ Tables ready")
+    if migrate:
+        async with _pool.acquire() as conn:
+            version = await apply_migrations(conn)
+        logger.info(f"✅ Schema ready (version {version})")
+
+
+async def migrate_db() -> None:
+    """Apply pending schema migrations over a one-off connection, no pool."""
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        version = await apply_migrations(conn)
+    finally:
+        await conn.close()
+    logger.info(f"✅ Schema ready (version {version})")
 
 
 async def close_db() -> None:
@@ -49,12 +70,24 @@ async def close_db() -> None:
 
 
 @asynccontextmanager
-async def get_db() -> AsyncGenerator[asyncpg.Connection, None]:
+async def get_db(conn: asyncpg.Connection | None = None,
+                 savepoint: bool = False) -> AsyncGenerator[asyncpg.Connection, None]:
     """
     Drop-in replacement for the old aiosqlite get_db().
     Yields a connection from the pool inside a transaction.
     Rolls back automatically on exception.
+
+    If `conn` is given (e.g. from the per-update UnitOfWork) it is reused
+    as-is and the caller's transaction applies. Functions that swallow DB
+    errors pass savepoint=True so a failure only rolls back their own part.
     """
+    if conn is not None:
+        if savepoint:
+            async with conn.transaction():
+                yield conn
+        else:
+            yield conn
+        return
     if _pool is None:
         raise RuntimeError("DB not initialized — call init_db() first")
     async with _pool.acquire() as conn:
@@ -62,96 +95,101 @@ async def get_db() -> AsyncGenerator[asyncpg.Connection, None]:
             yield conn
 
 
-# ── Schema ────────────────────────────────────────────────────────────────────
-
-async def _create_tables(conn: asyncpg.Connection) -> None:
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id          BIGSERIAL PRIMARY KEY,
-            telegram_id BIGINT    UNIQUE NOT NULL,
-            full_name   TEXT      NOT NULL,
-            shop_name   TEXT      NOT NULL,
-            address     TEXT      NOT NULL,
-            phone       TEXT      NOT NULL,
-            is_active   BOOLEAN   NOT NULL DEFAULT FALSE,
-            created_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        )
-    """)
-
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS tools (
-            id          BIGSERIAL PRIMARY KEY,
-            user_id     BIGINT    NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            name        TEXT      NOT NULL,
-            quantity    INTEGER   NOT NULL DEFAULT 0 CHECK (quantity >= 0),
-            daily_price NUMERIC(14,2) NOT NULL DEFAULT 0,
-            created_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-            UNIQUE (user_id, name)
-        )
-    """)
-
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS rentals (
-            id               BIGSERIAL PRIMARY KEY,
-            user_id          BIGINT   NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            customer_name    TEXT     NOT NULL,
-            customer_address TEXT     NOT NULL,
-            customer_phone   TEXT     NOT NULL,
-            status           TEXT     NOT NULL DEFAULT 'active',
-            rental_date      TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        )
-    """)
-
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS rental_items (
-            id                BIGSERIAL PRIMARY KEY,
-            rental_id         BIGINT   NOT NULL REFERENCES rentals(id) ON DELETE CASCADE,
-            tool_id           BIGINT   NOT NULL REFERENCES tools(id),
-            quantity          INTEGER  NOT NULL,
-            daily_price       NUMERIC(14,2) NOT NULL,
-            returned_quantity INTEGER  NOT NULL DEFAULT 0
-        )
-    """)
-
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS payments (
-            id           BIGSERIAL PRIMARY KEY,
-            rental_id    BIGINT   REFERENCES rentals(id),
-            user_id      BIGINT   NOT NULL REFERENCES users(id),
-            amount       NUMERIC(14,2) NOT NULL,
-            payment_date TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        )
-    """)
-
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS debts (
-            id             BIGSERIAL PRIMARY KEY,
-            user_id        BIGINT   NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            customer_name  TEXT     NOT NULL,
-            customer_phone TEXT     NOT NULL,
-            amount         NUMERIC(14,2) NOT NULL DEFAULT 0,
-            rental_id      BIGINT   REFERENCES rentals(id),
-            created_at     TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        )
-    """)
-
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS user_sub_accounts (
-            id          BIGSERIAL PRIMARY KEY,
-            user_id     BIGINT    NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            telegram_id BIGINT    NOT NULL UNIQUE,
-            added_at    TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        )
-    """)
-
-    # Indexes for fast lookups
-    for sql in [
-        "CREATE INDEX IF NOT EXISTS idx_users_tgid    ON users(telegram_id)",
-        "CREATE INDEX IF NOT EXISTS idx_sub_accounts  ON user_sub_accounts(telegram_id)",
-        "CREATE INDEX IF NOT EXISTS idx_tools_user    ON tools(user_id)",
-        "CREATE INDEX IF NOT EXISTS idx_rentals_user  ON rentals(user_id, status)",
-        "CREATE INDEX IF NOT EXISTS idx_ritems_rental ON rental_items(rental_id)",
-        "CREATE INDEX IF NOT EXISTS idx_payments_rent ON payments(rental_id)",
-        "CREATE INDEX IF NOT EXISTS idx_debts_user    ON debts(user_id)",
-    ]:
-        await conn.execute(sql)
+@asynccontextmanager
+async def get_ro_db(conn: asyncpg.Connection | None = None,
+                    snapshot: bool = False) -> AsyncGenerator[asyncpg.Connection, None]:
+    """
+    Read-only counterpart of get_db().
+    Yields a pooled connection WITHOUT wrapping it in a transaction, so a
+    single SELECT costs one round trip instead of BEGIN + query + COMMIT.
+
+    Pass snapshot=True when several reads must see the same data — they
+    then run inside one REPEATABLE READ, READ ONLY transaction.
+    A given `conn` is reused as-is.
+    """
+    if conn is not None:
+        yield conn
+        return
+    if _pool is None:
+        raise RuntimeError("DB not initialized — call init_db() first")
+    async with _pool.acquire() as conn:
+        if snapshot:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                yield conn
+        else:
+            yield conn
+
+
+# ── Unit of work ──────────────────────────────────────────────────────────────
+
+class UnitOfWork:
+    """
+    One pooled connection + one transaction for a whole Telegram update.
+
+    Nothing is acquired until a handler calls connection(), so updates that
+    never touch the database cost nothing. DbSessionMiddleware commits after
+    the handler returns and rolls back if it raised.
+
+        conn = await uow.connection()
+        cost = await calculate_return_cost(rental_id, returns, conn=conn)
+        await process_return(rental_id, returns, conn=conn)
+        await uow.commit()          # release before talking to Telegram
+    """
+
+    def __init__(self) -> None:
+        self._conn: asyncpg.Connection | None = None
+        self._tx = None
+
+    @property
+    def active(self) -> bool:
+        return self._conn is not None
+
+    async def connection(self) -> asyncpg.Connection:
+        if self._conn is None:
+            if _pool is None:
+                raise RuntimeError("DB not initialized — call init_db() first")
+            conn = await _pool.acquire()
+            try:
+                tx = conn.transaction()
+                await tx.start()
+            except BaseException:
+                await _pool.release(conn)
+                raise
+            self._conn, self._tx = conn, tx
+        return self._conn
+
+    async def commit(self) -> None:
+        """
+        Commit and give the connection back. A later connection() starts anew.
+
+        Cancelling the caller (e.g. the update deadline) doesn't abort a COMMIT
+        in flight — it finishes first, so its outcome is always known.
+        """
+        if self._conn is None:
+            return
+        finishing = asyncio.ensure_future(self._commit())
+        try:
+            await asyncio.shield(finishing)
+        except asyncio.CancelledError:
+            await asyncio.wait([finishing])
+            if finishing.exception() is not None:
+                logger.error(f"Commit failed while the update was cancelled: {finishing.exception()}")
+            raise
+
+    async def _commit(self) -> None:
+        try:
+            await self._tx.commit()
+        finally:
+            await self._release()
+
+    async def rollback(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            await self._tx.rollback()
+        finally:
+            await self._release()
+
+    async def _release(self) -> None:
+        conn, self._conn, self._tx = self._conn, None, None
+        await _pool.release(conn)
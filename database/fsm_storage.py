@@ -0,0 +1,230 @@
+"""
+database/fsm_storage.py
+
+aiogram FSM storage on the existing asyncpg pool — survives restarts and can
+be shared by several bot processes without Redis.
+
+By default every call goes to the table: a read is one SELECT, a write one
+upsert that touches only its own column, so any number of processes can
+share the table and a crash loses nothing.
+
+With write_behind=True reads are served from an in-process hot cache and
+set_state/set_data/update_data only mark the key dirty; a background task
+flushes every dirty key in ONE statement each flush_interval seconds. So
+the several writes a single update makes reach the database as one upsert,
+and busy periods batch many chats into it — but a crash loses the last
+interval's steps, and the cache is only right while this process is the
+only one handling the chat. app.create_dispatcher() turns it on for the
+chat-sharded workers of sharding.py only.
+
+Keys whose state and data are both empty are deleted instead of stored.
+Rows idle for FSM_TTL seconds are treated as absent and swept periodically.
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime
+import decimal
+import json
+import time
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from loguru import logger
+
+from utils.cache import TTLCache, MISSING
+from .db import get_db, get_ro_db
+
+_SWEEP_INTERVAL = 300
+
+# Write-through upserts: the other column survives unless its row is stale
+_SET_STATE = """
+    INSERT INTO fsm_storage AS f (key, state, data, updated_at)
+    VALUES ($1, $2, '{}', NOW())
+    ON CONFLICT (key) DO UPDATE
+    SET state = EXCLUDED.state,
+        data = CASE WHEN f.updated_at > NOW() - make_interval(secs => $3)
+                    THEN f.data ELSE '{}' END,
+        updated_at = NOW()
+    RETURNING state IS NULL AND data = '{}' AS empty"""
+_SET_DATA = """
+    INSERT INTO fsm_storage AS f (key, state, data, updated_at)
+    VALUES ($1, NULL, $2::jsonb, NOW())
+    ON CONFLICT (key) DO UPDATE
+    SET data = EXCLUDED.data,
+        state = CASE WHEN f.updated_at > NOW() - make_interval(secs => $3)
+                     THEN f.state END,
+        updated_at = NOW()
+    RETURNING state IS NULL AND data = '{}' AS empty"""
+
+
+def _json_default(value: Any) -> Any:
+    # daily_price etc. come straight from NUMERIC columns
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"FSM data value of type {type(value).__name__} is not JSON serializable")
+
+
+class PgStorage(BaseStorage):
+    def __init__(self, ttl: float, write_behind: bool = False,
+                 flush_interval: float = 0.5, cache_max: int = 10000):
+        self.ttl = ttl
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self._keys = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache = TTLCache(cache_max, ttl)
+        # key → (state, data) not yet written; always newer than _cache
+        self._dirty: dict[str, tuple[str | None, dict]] = {}
+        self._flusher: asyncio.Task | None = None
+        self._next_sweep = 0.0
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    # ── BaseStorage ───────────────────────────────────────────────────────────
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self._keys.build(key)
+        state = state.state if isinstance(state, State) else state
+        if not self.write_behind:
+            return await self._store(k, _SET_STATE, state)
+        _, data = await self._load(k)
+        self._write(k, state, data)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._load(self._keys.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        k = self._keys.build(key)
+        if not self.write_behind:
+            return await self._store(
+                k, _SET_DATA, json.dumps(data, default=_json_default, ensure_ascii=False))
+        state, _ = await self._load(k)
+        self._write(k, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._load(self._keys.build(key))
+        return data.copy()
+
+    async def close(self) -> None:
+        """Stop the flusher and write whatever is still pending."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    # ── internals ─────────────────────────────────────────────────────────────
+
+    async def _select(self, k: str) -> tuple[str | None, dict]:
+        async with get_ro_db() as conn:
+            row = await conn.fetchrow(
+                """SELECT state, data FROM fsm_storage
+                   WHERE key = $1 AND updated_at > NOW() - make_interval(secs => $2)""",
+                k, self.ttl
+            )
+        return (row["state"], json.loads(row["data"])) if row else (None, {})
+
+    async def _store(self, k: str, upsert: str, value: Any) -> None:
+        """Write-through: one column of one row, deleted once both are empty."""
+        self._start_flusher()
+        async with get_db() as conn:
+            if await conn.fetchval(upsert, k, value, self.ttl):
+                await conn.execute(
+                    "DELETE FROM fsm_storage WHERE key = $1 AND state IS NULL AND data = '{}'", k)
+
+    async def _load(self, k: str) -> tuple[str | None, dict]:
+        if not self.write_behind:
+            return await self._select(k)
+        record = self._dirty.get(k)
+        if record is not None:
+            return record
+        record = self._cache.get(k)
+        if record is not MISSING:
+            return record
+        record = await self._select(k)
+        # A write may have landed while we were waiting on the SELECT
+        if k in self._dirty:
+            return self._dirty[k]
+        self._cache.set(k, record)
+        return record
+
+    def _write(self, k: str, state: str | None, data: dict) -> None:
+        record = (state, data)
+        self._dirty[k] = record
+        self._cache.set(k, record)
+        self._start_flusher()
+
+    def _start_flusher(self) -> None:
+        """Background flushes (write-behind) and the idle-row sweep (both modes)."""
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_forever(), name="fsm-flush")
+
+    async def _flush_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval if self.write_behind else _SWEEP_INTERVAL)
+            try:
+                await self.flush()
+                if time.monotonic() >= self._next_sweep:
+                    self._next_sweep = time.monotonic() + _SWEEP_INTERVAL
+                    await self._sweep()
+            except Exception as e:
+                logger.error(f"FSM storage flush failed, will retry: {e}")
+
+    async def flush(self) -> None:
+        """Write every dirty key in one statement."""
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        upsert_keys, states, payloads, deletes = [], [], [], []
+        for k, (state, data) in batch.items():
+            if state is None and not data:
+                deletes.append(k)
+            else:
+                upsert_keys.append(k)
+                states.append(state)
+                payloads.append(json.dumps(data, default=_json_default, ensure_ascii=False))
+        try:
+            async with get_db() as conn:
+                await conn.execute(
+                    """WITH gone AS (
+                           DELETE FROM fsm_storage WHERE key = ANY($4::text[])
+                       )
+                       INSERT INTO fsm_storage (key, state, data, updated_at)
+                       SELECT k, s, d::jsonb, NOW()
+                       FROM unnest($1::text[], $2::text[], $3::text[]) AS x(k, s, d)
+                       ON CONFLICT (key) DO UPDATE
+                       SET state = EXCLUDED.state, data = EXCLUDED.data,
+                           updated_at = EXCLUDED.updated_at""",
+                    upsert_keys, states, payloads, deletes
+                )
+        except BaseException:
+            # Put back what wasn't overwritten meanwhile so nothing is lost
+            for k, record in batch.items():
+                self._dirty.setdefault(k, record)
+            raise
+        self.flushes += 1
+        self.rows_flushed += len(batch)
+
+    async def _sweep(self) -> None:
+        async with get_db() as conn:
+            await conn.execute(
+                "DELETE FROM fsm_storage WHERE updated_at < NOW() - make_interval(secs => $1)",
+                self.ttl
+            )
+
+    def stats(self) -> dict[str, Any]:
+        if not self.write_behind:
+            return {"write_behind": False}
+        return {
+            **self._cache.stats(),
+            "dirty": len(self._dirty),
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+        }
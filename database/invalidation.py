@@ -0,0 +1,118 @@
+"""
+database/invalidation.py
+
+Cross-process cache invalidation over PostgreSQL LISTEN/NOTIFY.
+
+Writers call publish() inside their transaction; PostgreSQL delivers the
+message only on COMMIT, so no process evicts before the new row is visible
+(and a rolled-back write sends nothing). Every bot process keeps one
+dedicated listener connection and hands each message to the callbacks
+registered with subscribe().
+
+Payload is "<topic>:<key>", e.g. "user:42" or "tg:804705356". The writing
+process gets its own messages too — that evicts whatever a concurrent
+update may have re-cached between the local invalidation and the commit.
+
+If the listener connection drops, messages may have been lost, so every
+subscriber is called with key=None ("drop everything") on disconnect and
+again once the listener is back.
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Callable
+
+import asyncpg
+from loguru import logger
+
+from config import DATABASE_URL
+
+CHANNEL = "cache_invalidation"
+_HEALTHCHECK_INTERVAL = 30
+
+_subscribers: dict[str, list[Callable[[str | None], None]]] = {}
+_task: asyncio.Task | None = None
+_stats = {"received": 0, "reconnects": 0}
+
+
+def subscribe(topic: str, callback: Callable[[str | None], None]) -> None:
+    """callback(key) evicts one key; callback(None) must drop everything."""
+    _subscribers.setdefault(topic, []).append(callback)
+
+
+async def publish(conn: asyncpg.Connection, topic: str, key) -> None:
+    await conn.execute("SELECT pg_notify($1, $2)", CHANNEL, f"{topic}:{key}")
+
+
+def invalidation_stats() -> dict:
+    return dict(_stats)
+
+
+def _dispatch(topic: str, key: str | None) -> None:
+    for callback in _subscribers.get(topic, ()):
+        try:
+            callback(key)
+        except Exception as e:
+            logger.error(f"Cache invalidation {topic}:{key} failed: {e}")
+
+
+def _flush_all() -> None:
+    for topic in _subscribers:
+        _dispatch(topic, None)
+
+
+def _on_notify(conn, pid, channel, payload: str) -> None:
+    _stats["received"] += 1
+    topic, _, key = payload.partition(":")
+    _dispatch(topic, key)
+
+
+async def _listen_forever() -> None:
+    delay, connected_before = 1, False
+    while True:
+        try:
+            conn = await asyncpg.connect(DATABASE_URL)
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.warning(f"Invalidation listener: connect failed ({e}), retry in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+            continue
+
+        lost = asyncio.Event()
+        conn.add_termination_listener(lambda c: lost.set())
+        try:
+            await conn.add_listener(CHANNEL, _on_notify)
+            if connected_before:
+                _stats["reconnects"] += 1
+                _flush_all()
+                logger.info("Invalidation listener reconnected, caches flushed")
+            connected_before, delay = True, 1
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), _HEALTHCHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    # A half-open TCP connection never fires the termination listener
+                    await conn.execute("SELECT 1", timeout=10)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError,
+                asyncpg.InterfaceError) as e:
+            logger.warning(f"Invalidation listener lost: {e}")
+        finally:
+            conn.terminate()
+        _flush_all()
+
+
+async def start_listener() -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_listen_forever(), name="cache-invalidation")
+
+
+async def stop_listener() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
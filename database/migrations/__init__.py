@@ -0,0 +1,127 @@
+"""
+database/migrations
+
+Versioned schema migrations. Every vNNNN_<name>.py module in this package is
+one migration; they are applied in version order and recorded in the
+schema_version table.
+
+A migration module defines:
+    STATEMENTS    — list of SQL statements, executed one at a time
+    TRANSACTIONAL — set to False for statements that refuse to run inside a
+                    transaction block (CREATE INDEX CONCURRENTLY). Default True.
+
+When the schema is already current, startup costs exactly one query.
+Non-transactional migrations must be safe to re-run (IF NOT EXISTS), because
+a crash half-way leaves the earlier statements applied but no version row.
+A CREATE INDEX CONCURRENTLY that failed leaves an INVALID index behind,
+which IF NOT EXISTS would then skip forever — so before each such statement
+an invalid index of that name is dropped and built again.
+"""
+from __future__ import annotations
+
+import asyncio
+import importlib
+import pkgutil
+import re
+from types import ModuleType
+
+import asyncpg
+from loguru import logger
+
+# Arbitrary constant — serialises migrations when several bot processes
+# start against the same database.
+_LOCK_KEY = 7_265_110
+_LOCK_POLL = 0.5
+
+_NAME_RE = re.compile(r"^v(\d{4})_\w+$")
+_CONCURRENT_INDEX_RE = re.compile(
+    r"^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.I)
+
+
+def _discover() -> list[tuple[int, str, ModuleType]]:
+    found = []
+    for info in pkgutil.iter_modules(__path__):
+        m = _NAME_RE.match(info.name)
+        if not m:
+            continue
+        module = importlib.import_module(f"{__name__}.{info.name}")
+        found.append((int(m.group(1)), info.name, module))
+    found.sort(key=lambda x: x[0])
+    return found
+
+
+async def _current_version(conn: asyncpg.Connection) -> int:
+    try:
+        return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def _apply(conn: asyncpg.Connection, version: int, name: str, module: ModuleType) -> None:
+    record = "INSERT INTO schema_version (version, name) VALUES ($1, $2)"
+    if getattr(module, "TRANSACTIONAL", True):
+        async with conn.transaction():
+            for sql in module.STATEMENTS:
+                await conn.execute(sql)
+            await conn.execute(record, version, name)
+    else:
+        for sql in module.STATEMENTS:
+            if m := _CONCURRENT_INDEX_RE.match(sql):
+                await _drop_if_invalid(conn, m.group(1))
+            await conn.execute(sql)
+        await conn.execute(record, version, name)
+
+
+async def _drop_if_invalid(conn: asyncpg.Connection, index: str) -> None:
+    """Drop `index` if an earlier concurrent build of it failed half-way."""
+    invalid = await conn.fetchval(
+        """SELECT NOT i.indisvalid FROM pg_index i
+           JOIN pg_class c ON c.oid = i.indexrelid
+           WHERE c.relname = $1 AND pg_table_is_visible(c.oid)""",
+        index.lower()
+    )
+    if invalid:
+        logger.warning(f"Rebuilding invalid index {index}")
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+
+
+async def _lock(conn: asyncpg.Connection) -> None:
+    """
+    Take the migration lock by polling, never by blocking in pg_advisory_lock():
+    a session waiting inside that call holds a snapshot, and the holder's
+    CREATE INDEX CONCURRENTLY waits for every older snapshot — each would
+    wait on the other. Between tries this connection is idle.
+    """
+    while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", _LOCK_KEY):
+        await asyncio.sleep(_LOCK_POLL)
+
+
+async def migrate(conn: asyncpg.Connection) -> int:
+    """Bring the schema up to date. Returns the resulting schema version."""
+    migrations = _discover()
+    latest = migrations[-1][0] if migrations else 0
+
+    current = await _current_version(conn)
+    if current >= latest:
+        return current
+
+    await _lock(conn)
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version    INTEGER PRIMARY KEY,
+                name       TEXT    NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """)
+        # Another process may have migrated while we waited for the lock
+        current = await _current_version(conn)
+        for version, name, module in migrations:
+            if version <= current:
+                continue
+            logger.info(f"⏫ Applying migration {name}")
+            await _apply(conn, version, name, module)
+            current = version
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", _LOCK_KEY)
+    return current
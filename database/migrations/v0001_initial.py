@@ -0,0 +1,76 @@
+"""Base tables."""
+
+STATEMENTS = [
+    """
+        CREATE TABLE IF NOT EXISTS users (
+            id          BIGSERIAL PRIMARY KEY,
+            telegram_id BIGINT    UNIQUE NOT NULL,
+            full_name   TEXT      NOT NULL,
+            shop_name   TEXT      NOT NULL,
+            address     TEXT      NOT NULL,
+            phone       TEXT      NOT NULL,
+            is_active   BOOLEAN   NOT NULL DEFAULT FALSE,
+            created_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS tools (
+            id          BIGSERIAL PRIMARY KEY,
+            user_id     BIGINT    NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            name        TEXT      NOT NULL,
+            quantity    INTEGER   NOT NULL DEFAULT 0 CHECK (quantity >= 0),
+            daily_price NUMERIC(14,2) NOT NULL DEFAULT 0,
+            created_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            UNIQUE (user_id, name)
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS rentals (
+            id               BIGSERIAL PRIMARY KEY,
+            user_id          BIGINT   NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            customer_name    TEXT     NOT NULL,
+            customer_address TEXT     NOT NULL,
+            customer_phone   TEXT     NOT NULL,
+            status           TEXT     NOT NULL DEFAULT 'active',
+            rental_date      TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS rental_items (
+            id                BIGSERIAL PRIMARY KEY,
+            rental_id         BIGINT   NOT NULL REFERENCES rentals(id) ON DELETE CASCADE,
+            tool_id           BIGINT   NOT NULL REFERENCES tools(id),
+            quantity          INTEGER  NOT NULL,
+            daily_price       NUMERIC(14,2) NOT NULL,
+            returned_quantity INTEGER  NOT NULL DEFAULT 0
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS payments (
+            id           BIGSERIAL PRIMARY KEY,
+            rental_id    BIGINT   REFERENCES rentals(id),
+            user_id      BIGINT   NOT NULL REFERENCES users(id),
+            amount       NUMERIC(14,2) NOT NULL,
+            payment_date TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS debts (
+            id             BIGSERIAL PRIMARY KEY,
+            user_id        BIGINT   NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            customer_name  TEXT     NOT NULL,
+            customer_phone TEXT     NOT NULL,
+            amount         NUMERIC(14,2) NOT NULL DEFAULT 0,
+            rental_id      BIGINT   REFERENCES rentals(id),
+            created_at     TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS user_sub_accounts (
+            id          BIGSERIAL PRIMARY KEY,
+            user_id     BIGINT    NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            telegram_id BIGINT    NOT NULL UNIQUE,
+            added_at    TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """,
+]
@@ -0,0 +1,13 @@
+"""Indexes for fast lookups. Built CONCURRENTLY so live tables stay writable."""
+
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_tgid    ON users(telegram_id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_sub_accounts  ON user_sub_accounts(telegram_id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tools_user    ON tools(user_id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rentals_user  ON rentals(user_id, status)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ritems_rental ON rental_items(rental_id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_rent ON payments(rental_id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_debts_user    ON debts(user_id)",
+]
@@ -0,0 +1,9 @@
+"""Indexes matching the keyset sort keys of the paginated list views."""
+
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rentals_user_date ON rentals(user_id, rental_date, id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_debts_user_created ON debts(user_id, created_at, id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_created ON users(created_at, id)",
+]
@@ -0,0 +1,26 @@
+"""
+pg_trgm GIN indexes for services/search.py.
+Phone indexes are on the digits-only expression used by digits_expr().
+"""
+
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rentals_name_trgm
+       ON rentals USING gin (customer_name gin_trgm_ops) WHERE status = 'active'""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rentals_phone_trgm
+       ON rentals USING gin (regexp_replace(customer_phone, '[^0-9]', '', 'g') gin_trgm_ops)
+       WHERE status = 'active'""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_debts_name_trgm
+       ON debts USING gin (customer_name gin_trgm_ops) WHERE amount > 0""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_debts_phone_trgm
+       ON debts USING gin (regexp_replace(customer_phone, '[^0-9]', '', 'g') gin_trgm_ops)
+       WHERE amount > 0""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tools_name_trgm
+       ON tools USING gin (name gin_trgm_ops)""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_name_trgm
+       ON users USING gin (full_name gin_trgm_ops, shop_name gin_trgm_ops)""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_phone_trgm
+       ON users USING gin (regexp_replace(phone, '[^0-9]', '', 'g') gin_trgm_ops)""",
+]
@@ -0,0 +1,26 @@
+"""
+Normalized +998XXXXXXXXX phone columns next to the phones as typed.
+New rows are filled by the services (utils.normalize_phone); the UPDATEs
+below backfill existing rows with the same rules expressed in SQL.
+"""
+
+_PREFIXES = "(90|91|93|94|95|97|98|99|33|50|55|70|71|77|88)"
+
+
+def _normalize(col: str) -> str:
+    d = f"regexp_replace({col}, '[^0-9]', '', 'g')"
+    return f"""CASE
+        WHEN {d} ~ '^{_PREFIXES}[0-9]{{7}}$'    THEN '+998' || {d}
+        WHEN {d} ~ '^0{_PREFIXES}[0-9]{{7}}$'   THEN '+998' || substr({d}, 2)
+        WHEN {d} ~ '^998{_PREFIXES}[0-9]{{7}}$' THEN '+' || {d}
+    END"""
+
+
+STATEMENTS = [
+    "ALTER TABLE rentals ADD COLUMN IF NOT EXISTS customer_phone_norm TEXT",
+    "ALTER TABLE debts   ADD COLUMN IF NOT EXISTS customer_phone_norm TEXT",
+    "ALTER TABLE users   ADD COLUMN IF NOT EXISTS phone_norm TEXT",
+    f"UPDATE rentals SET customer_phone_norm = {_normalize('customer_phone')} WHERE customer_phone_norm IS NULL",
+    f"UPDATE debts   SET customer_phone_norm = {_normalize('customer_phone')} WHERE customer_phone_norm IS NULL",
+    f"UPDATE users   SET phone_norm = {_normalize('phone')} WHERE phone_norm IS NULL",
+]
@@ -0,0 +1,22 @@
+"""
+Exact-match and digit-suffix indexes on the normalized phones.
+The suffix indexes are on reverse(phone) with text_pattern_ops, so "4567"
+becomes a B-tree range scan over '7654' ≤ x < '7655'.
+"""
+
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rentals_phone_norm
+       ON rentals(user_id, customer_phone_norm)""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rentals_phone_suffix
+       ON rentals(user_id, reverse(customer_phone_norm) text_pattern_ops)""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_debts_phone_norm
+       ON debts(user_id, customer_phone_norm)""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_debts_phone_suffix
+       ON debts(user_id, reverse(customer_phone_norm) text_pattern_ops)""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_phone_norm
+       ON users(phone_norm)""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_phone_suffix
+       ON users(reverse(phone_norm) text_pattern_ops)""",
+]
@@ -0,0 +1,31 @@
+"""
+Partial / covering indexes for the hot predicates. Closed rentals, paid-off
+debts and fully returned items are the vast majority of rows, so indexing
+only the live ones keeps these indexes small and the scans short.
+
+Predicates are written exactly as the queries spell them — the planner only
+uses a partial index when it can prove the query implies its WHERE clause.
+The v0003 keyset indexes are superseded by the first two and dropped.
+"""
+
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    # get_active_rentals / count_active_rentals
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rentals_active
+       ON rentals(user_id, rental_date DESC, id DESC) WHERE status = 'active'""",
+    # get_debts / count_debts / get_total_debt (amount covered → index-only SUM)
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_debts_open
+       ON debts(user_id, created_at DESC, id DESC) INCLUDE (amount) WHERE amount > 0""",
+    # add_debt: open debt of a rental
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_debts_open_rental
+       ON debts(rental_id) WHERE amount > 0""",
+    # get_unreturned_items
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ritems_outstanding
+       ON rental_items(rental_id) WHERE (quantity - returned_quantity) > 0""",
+    # delete_tool: is the tool still out on some rental?
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ritems_tool_outstanding
+       ON rental_items(tool_id) WHERE (quantity - returned_quantity) > 0""",
+    "DROP INDEX CONCURRENTLY IF EXISTS idx_rentals_user_date",
+    "DROP INDEX CONCURRENTLY IF EXISTS idx_debts_user_created",
+]
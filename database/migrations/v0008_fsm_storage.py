@@ -0,0 +1,15 @@
+"""
+Table behind database.fsm_storage.PgStorage: one row per FSM key with the
+current state and data. Rows idle longer than FSM_TTL are ignored on read
+and swept by the storage; the updated_at index keeps the sweep cheap.
+"""
+
+STATEMENTS = [
+    """CREATE TABLE IF NOT EXISTS fsm_storage (
+           key        TEXT PRIMARY KEY,
+           state      TEXT,
+           data       JSONB NOT NULL DEFAULT '{}',
+           updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+       )""",
+    "CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage(updated_at)",
+]
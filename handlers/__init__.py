@@ -5,13 +5,18 @@ from .tools import router as tools_router
 from .rentals import router as rentals_router
 from .debts import router as debts_router
 from .sub_accounts import router as sub_accounts_router
+from .buttons import button_router
+from .callbacks import callback_router
+
+_routers = [common_router, admin_router, tools_router, rentals_router, debts_router,
+            sub_accounts_router]
 
 main_router = Router()
-main_router.include_router(common_router)
-main_router.include_router(admin_router)
-main_router.include_router(tools_router)
-main_router.include_router(rentals_router)
-main_router.include_router(debts_router)
-main_router.include_router(sub_accounts_router)
+# Menu buttons and inline callbacks first, by dict lookup; everything else
+# walks the routers below
+main_router.include_router(button_router(_routers))
+main_router.include_router(callback_router(_routers))
+for _router in _routers:
+    main_router.include_router(_router)
 
 __all__ = ["main_router"]
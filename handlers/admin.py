@@ -3,16 +3,25 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from handlers.states import AddUserFSM, SearchUserFSM, EditUserFSM
+from handlers.buttons import Button
 from services.user_service import (
-    create_user, get_all_users, search_users, get_user_by_id,
+    create_user, get_all_users, count_users, search_users, get_user_by_id,
     activate_user, deactivate_user, delete_user, update_user
 )
 from utils.texts import *
 from utils.keyboards import (
     admin_main_menu, back_keyboard, cancel_keyboard,
-    admin_user_actions, confirm_delete_keyboard, pagination_keyboard
+    admin_user_actions, confirm_delete_keyboard, pagination_row, offset_pagination_row,
+    numbered_list_keyboard
 )
 from utils.helpers import validate_phone, validate_positive_int
+from utils.callback_data import (
+    UsersPage, UserSearchPage, UserView, UserAction, UserOp, UserDelete,
+)
+from utils.outbox import Outbox
+from middlewares.role_middleware import _invalidate, _invalidate_user
+from database import get_ro_db
+from services.search import SEARCH_LIMIT
 from loguru import logger
 
 router = Router()
@@ -25,27 +34,27 @@ def is_admin(is_super_admin: bool):
 
 # ===== MAIN MENU NAVIGATION =====
 
-@router.message(F.text == BTN_ADD_USER)
+@router.message(Button(BTN_ADD_USER))
 async def add_user_start(message: Message, state: FSMContext, is_super_admin: bool):
     if not is_admin(is_super_admin):
         return
     await state.set_state(AddUserFSM.full_name)
-    await message.answer(MSG_ADD_USER_NAME, reply_markup=cancel_keyboard())
+    return message.answer(MSG_ADD_USER_NAME, reply_markup=cancel_keyboard())
 
 
-@router.message(F.text == BTN_USER_LIST)
+@router.message(Button(BTN_USER_LIST))
 async def user_list(message: Message, is_super_admin: bool):
     if not is_admin(is_super_admin):
         return
-    await show_user_list(message, page=1)
+    await show_user_list(message)
 
 
-@router.message(F.text == BTN_SEARCH_USER)
+@router.message(Button(BTN_SEARCH_USER))
 async def search_user_start(message: Message, state: FSMContext, is_super_admin: bool):
     if not is_admin(is_super_admin):
         return
     await state.set_state(SearchUserFSM.query)
-    await message.answer(MSG_SEARCH_PROMPT, reply_markup=cancel_keyboard())
+    return message.answer(MSG_SEARCH_PROMPT, reply_markup=cancel_keyboard())
 
 
 # ===== ADD USER FSM =====
@@ -119,6 +128,8 @@ async def add_user_tg_id(message: Message, state: FSMContext):
     )
     await state.clear()
     if success:
+        # Drop a cached "unknown user" entry so the new shop resolves immediately
+        _invalidate(tg_id)
         await message.answer(
             MSG_USER_CREATED.format(
                 name=data["full_name"],
@@ -134,116 +145,191 @@ async def add_user_tg_id(message: Message, state: FSMContext):
 
 # ===== USER LIST =====
 
-async def show_user_list(message: Message, page: int = 1):
-    offset = (page - 1) * PAGE_SIZE
-    users, total = await get_all_users(offset=offset, limit=PAGE_SIZE)
-    if not users:
+def _user_text(u) -> str:
+    status = "✅ Faol" if u["is_active"] else "🚫 Nofaol"
+    return (f"👤 <b>{u['full_name']}</b>\n"
+            f"🏪 {u['shop_name']}\n"
+            f"📍 {u['address']}\n"
+            f"📞 {u['phone']}\n"
+            f"🆔 TG: {u['telegram_id']}\n"
+            f"Status: {status}")
+
+
+def _user_lines(users, start: int) -> str:
+    lines = []
+    for n, u in enumerate(users, start):
+        status = "✅ Faol" if u["is_active"] else "🚫 Faol emas"
+        lines.append(f"{n}. 👤 {u['full_name']} | 🏪 {u['shop_name']} | {status}\n")
+    return "".join(lines)
+
+
+async def _users_page(page_no: int, total: int, after: int = None, before: int = None,
+                      conn=None):
+    """Text + inline keyboard for one page of users, or None if empty."""
+    async with get_ro_db(conn, snapshot=True) as conn:
+        page = await get_all_users(after=after, before=before, limit=PAGE_SIZE, conn=conn)
+        if not page.rows and (after or before):
+            # Anchor user was deleted meanwhile — start over from the first page
+            page_no, total = 1, await count_users(conn=conn)
+            page = await get_all_users(limit=PAGE_SIZE, conn=conn)
+    if not page.rows:
+        return None
+    total_pages = max(math.ceil(total / PAGE_SIZE), 1)
+    start = (page_no - 1) * PAGE_SIZE + 1
+    text = f"📋 Foydalanuvchilar ro'yxati (sahifa {page_no}/{total_pages}):\n\n"
+    text += _user_lines(page.rows, start)
+    nav = pagination_row(UsersPage, page_no, total, page.rows[0]["id"], page.rows[-1]["id"],
+                         page.has_prev, page.has_next)
+    return text, numbered_list_keyboard(page.rows, start, UserView, nav)
+
+
+async def show_user_list(message: Message):
+    async with get_ro_db(snapshot=True) as conn:   # count and page agree
+        total = await count_users(conn=conn)
+        rendered = await _users_page(1, total, conn=conn)
+    if not rendered:
         await message.answer(MSG_USER_LIST_EMPTY, reply_markup=admin_main_menu())
         return
-    total_pages = math.ceil(total / PAGE_SIZE)
-    text = f"📋 Foydalanuvchilar ro'yxati (sahifa {page}/{total_pages}):\n\n"
-    for u in users:
-        status = "✅ Faol" if u["is_active"] else "🚫 Faol emas"
-        text += f"👤 {u['full_name']} | 🏪 {u['shop_name']} | {status}\n"
-    await message.answer(text, reply_markup=admin_main_menu())
-
-    # Show each user as separate message with actions for first page simplicity
-    # Use inline for each user
-    for u in users:
-        status = "✅ Faol" if u["is_active"] else "🚫 Nofaol"
-        utext = (f"👤 <b>{u['full_name']}</b>\n"
-                 f"🏪 {u['shop_name']}\n"
-                 f"📍 {u['address']}\n"
-                 f"📞 {u['phone']}\n"
-                 f"🆔 TG: {u['telegram_id']}\n"
-                 f"Status: {status}")
-        await message.answer(
-            utext,
-            reply_markup=admin_user_actions(u["id"], bool(u["is_active"])),
-            parse_mode="HTML"
-        )
+    text, markup = rendered
+    await message.answer(text, reply_markup=markup)
+
+
+@router.callback_query(UsersPage.filter())
+async def cb_users_page(callback: CallbackQuery, callback_data: UsersPage, is_super_admin: bool):
+    if not is_admin(is_super_admin):
+        return await callback.answer()
+    nav = callback_data
+    rendered = await _users_page(
+        nav.page, nav.total,
+        after=nav.anchor if nav.forward else None,
+        before=None if nav.forward else nav.anchor,
+    )
+    if rendered:
+        text, markup = rendered
+        await callback.message.edit_text(text, reply_markup=markup)
+    else:
+        await callback.message.edit_text(MSG_USER_LIST_EMPTY)
+    await callback.answer()
+
+
+@router.callback_query(UserView.filter())
+async def cb_user_view(callback: CallbackQuery, callback_data: UserView, is_super_admin: bool):
+    if not is_admin(is_super_admin):
+        return await callback.answer()
+    u = await get_user_by_id(callback_data.id)
+    if not u:
+        return await callback.answer("Topilmadi")
+    await callback.message.answer(
+        _user_text(u),
+        reply_markup=admin_user_actions(u["id"], bool(u["is_active"])),
+        parse_mode="HTML"
+    )
+    await callback.answer()
 
 
 # ===== SEARCH USER =====
 
+def _search_page(page, offset: int):
+    """Text + inline keyboard for one page of user search hits."""
+    text = MSG_SEARCH_PAGE.format(page=offset // SEARCH_LIMIT + 1) + "\n\n"
+    text += _user_lines(page.rows, offset + 1)
+    nav = offset_pagination_row(UserSearchPage, offset, SEARCH_LIMIT, page.has_prev, page.has_next)
+    return text, numbered_list_keyboard(page.rows, offset + 1, UserView, nav)
+
+
 @router.message(SearchUserFSM.query)
-async def search_user_result(message: Message, state: FSMContext, is_super_admin: bool):
+async def search_user_result(message: Message, state: FSMContext, is_super_admin: bool,
+                             outbox: Outbox):
     if message.text == BTN_CANCEL:
         await state.clear()
         await message.answer(MSG_CANCELLED, reply_markup=admin_main_menu())
         return
-    users = await search_users(message.text.strip())
+    query = message.text.strip()
+    page = await search_users(query)
     await state.clear()
-    if not users:
+    if not page.rows:
         await message.answer(MSG_NOT_FOUND, reply_markup=admin_main_menu())
         return
-    for u in users:
-        status = "✅ Faol" if u["is_active"] else "🚫 Nofaol"
-        text = (f"👤 <b>{u['full_name']}</b>\n"
-                f"🏪 {u['shop_name']}\n"
-                f"📍 {u['address']}\n"
-                f"📞 {u['phone']}\n"
-                f"🆔 TG: {u['telegram_id']}\n"
-                f"Status: {status}")
-        await message.answer(
-            text,
-            reply_markup=admin_user_actions(u["id"], bool(u["is_active"])),
-            parse_mode="HTML"
-        )
-    await message.answer("✅ Qidiruv tugadi.", reply_markup=admin_main_menu())
+    if page.has_next:
+        # Keep the query (no state) so ◀️/▶️ can fetch other pages
+        await state.update_data(search_query=query)
+    # The menu comes back with the first message, the hits go in the second
+    outbox.answer(message, MSG_SEARCH_RESULTS, reply_markup=admin_main_menu())
+    text, markup = _search_page(page, 0)
+    outbox.answer(message, text, reply_markup=markup)
+
+
+@router.callback_query(UserSearchPage.filter())
+async def cb_search_user_page(callback: CallbackQuery, callback_data: UserSearchPage,
+                              state: FSMContext, is_super_admin: bool):
+    if not is_admin(is_super_admin):
+        return await callback.answer()
+    offset = callback_data.offset
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        return await callback.answer()
+    page = await search_users(query, offset=offset)
+    if page.rows:
+        text, markup = _search_page(page, offset)
+        await callback.message.edit_text(text, reply_markup=markup)
+    else:
+        await callback.message.edit_text(MSG_NOT_FOUND)
+    await callback.answer()
 
 
 # ===== USER ACTIONS (CALLBACKS) =====
 
-@router.callback_query(F.data.startswith("user:activate:"))
-async def cb_activate(callback: CallbackQuery, is_super_admin: bool):
+@router.callback_query(UserAction.filter(F.op == UserOp.activate))
+async def cb_activate(callback: CallbackQuery, callback_data: UserAction, is_super_admin: bool):
     if not is_admin(is_super_admin):
         return
-    user_id = int(callback.data.split(":")[2])
+    user_id = callback_data.id
     await activate_user(user_id)
+    _invalidate_user(user_id)
     await callback.answer(MSG_USER_ACTIVATED)
-    user = await get_user_by_id(user_id)
     await callback.message.edit_reply_markup(
         reply_markup=admin_user_actions(user_id, True)
     )
 
 
-@router.callback_query(F.data.startswith("user:deactivate:"))
-async def cb_deactivate(callback: CallbackQuery, is_super_admin: bool):
+@router.callback_query(UserAction.filter(F.op == UserOp.deactivate))
+async def cb_deactivate(callback: CallbackQuery, callback_data: UserAction, is_super_admin: bool):
     if not is_admin(is_super_admin):
         return
-    user_id = int(callback.data.split(":")[2])
+    user_id = callback_data.id
     await deactivate_user(user_id)
+    _invalidate_user(user_id)
     await callback.answer(MSG_USER_DEACTIVATED)
     await callback.message.edit_reply_markup(
         reply_markup=admin_user_actions(user_id, False)
     )
 
 
-@router.callback_query(F.data.startswith("user:delete:"))
-async def cb_delete_confirm(callback: CallbackQuery, is_super_admin: bool):
+@router.callback_query(UserAction.filter(F.op == UserOp.delete))
+async def cb_delete_confirm(callback: CallbackQuery, callback_data: UserAction, is_super_admin: bool):
     if not is_admin(is_super_admin):
         return
-    user_id = int(callback.data.split(":")[2])
+    user_id = callback_data.id
     await callback.message.edit_reply_markup(
-        reply_markup=confirm_delete_keyboard("user_del", user_id)
+        reply_markup=confirm_delete_keyboard(UserDelete, user_id)
     )
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("user_del:confirm:"))
-async def cb_delete_do(callback: CallbackQuery, is_super_admin: bool):
+@router.callback_query(UserDelete.filter(F.yes))
+async def cb_delete_do(callback: CallbackQuery, callback_data: UserDelete, is_super_admin: bool):
     if not is_admin(is_super_admin):
         return
-    user_id = int(callback.data.split(":")[2])
+    user_id = callback_data.id
     await delete_user(user_id)
+    _invalidate_user(user_id)
     await callback.message.edit_text(MSG_USER_DELETED)
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("user_del:cancel:"))
-async def cb_delete_cancel(callback: CallbackQuery):
-    user_id = int(callback.data.split(":")[2])
+@router.callback_query(UserDelete.filter(~F.yes))
+async def cb_delete_cancel(callback: CallbackQuery, callback_data: UserDelete):
+    user_id = callback_data.id
     user = await get_user_by_id(user_id)
     if user:
         await callback.message.edit_reply_markup(
@@ -252,11 +338,12 @@ async def cb_delete_cancel(callback: CallbackQuery):
     await callback.answer(MSG_CANCELLED)
 
 
-@router.callback_query(F.data.startswith("user:edit:"))
-async def cb_edit_user(callback: CallbackQuery, state: FSMContext, is_super_admin: bool):
+@router.callback_query(UserAction.filter(F.op == UserOp.edit))
+async def cb_edit_user(callback: CallbackQuery, callback_data: UserAction, state: FSMContext,
+                       is_super_admin: bool):
     if not is_admin(is_super_admin):
         return
-    user_id = int(callback.data.split(":")[2])
+    user_id = callback_data.id
     user = await get_user_by_id(user_id)
     if not user:
         await callback.answer("Topilmadi")
@@ -326,5 +413,6 @@ async def edit_user_phone(message: Message, state: FSMContext):
         address=data["address"],
         phone=message.text.strip()
     )
+    _invalidate_user(data["editing_user_id"])
     await state.clear()
     await message.answer(MSG_SUCCESS, reply_markup=admin_main_menu())
@@ -0,0 +1,96 @@
+"""
+Reply-keyboard buttons routed with one dict lookup.
+
+Without this every text message walks the whole router tree, evaluating
+each `text == BTN_*` filter and state filter until one matches — dozens of
+filter calls for a button from the last router. Handlers mark their button
+with Button(BTN_X) instead of F.text == BTN_X; button_router() reads those
+handlers out of the tree into a table {button text: handler}.
+
+The table must pick the handler the tree would have picked. A button
+handler only wins if nothing before it in tree order matches first — in
+practice, a state handler of an earlier router (typing "🔧 Asboblar" while
+the admin is mid-way through adding a user is that dialog's input). So each
+entry remembers the states handled before it, and in those states the
+message falls through to the tree as usual, as does any free text.
+"""
+from typing import Any, Iterator
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.dispatcher.event.telegram import TelegramEventObserver
+from aiogram.filters import Command, Filter, StateFilter
+from aiogram.fsm.state import State
+from aiogram.types import Message
+
+
+class Button(Filter):
+    """The message is exactly this reply-keyboard button's text."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+    async def __call__(self, message: Message) -> bool:
+        return message.text == self.text
+
+
+def _handlers(router: Router, event: str = "message") -> Iterator[tuple[Router, HandlerObject]]:
+    """Handlers of one event type in the order the dispatcher tries them."""
+    for handler in router.observers[event].handlers:
+        yield router, handler
+    for sub in router.sub_routers:
+        yield from _handlers(sub, event)
+
+
+def _bare(observer: TelegramEventObserver) -> bool:
+    """No router-level filters or middlewares that a table lookup would skip."""
+    return not (observer._handler.filters or observer.middleware or observer.outer_middleware)
+
+
+def _states(handler: HandlerObject) -> set[str | None] | None:
+    """States a state-only handler matches in, None if it has other filters."""
+    states: set[str | None] = set()
+    for f in handler.filters or ():
+        if isinstance(f.callback, State):
+            states.add(f.callback.state)
+        elif isinstance(f.callback, StateFilter):
+            states.update(s.state if isinstance(s, State) else s for s in f.callback.states)
+        else:
+            return None
+    return states or None
+
+
+class _ButtonTable(Filter):
+    def __init__(self, routers: list[Router]):
+        self.routes: dict[str, tuple[HandlerObject, frozenset[str]]] = {}
+        shadowing: set[str] = set()
+        for router in routers:
+            for owner, handler in _handlers(router):
+                if not _bare(owner.message):
+                    return   # router-level filters/middlewares: leave it all to the tree
+                callbacks = [f.callback for f in handler.filters or ()]
+                if len(callbacks) == 1 and isinstance(callbacks[0], Button):
+                    self.routes.setdefault(callbacks[0].text, (handler, frozenset(shadowing)))
+                elif callbacks and all(isinstance(c, Command) for c in callbacks):
+                    continue   # commands start with "/", buttons never do
+                elif (states := _states(handler)) is not None and not states & {"*", None}:
+                    shadowing |= states
+                else:
+                    return   # could match any text — later buttons stay in the tree
+
+    async def __call__(self, message: Message, raw_state: str | None = None) -> bool | dict[str, Any]:
+        route = self.routes.get(message.text)
+        if route is None or raw_state in route[1]:
+            return False
+        return {"handler": route[0]}   # so middlewares read its flags
+
+
+def button_router(routers: list[Router]) -> Router:
+    """Include first, ahead of `routers`, once their handlers are registered."""
+    router = Router(name="buttons")
+
+    @router.message(_ButtonTable(routers))
+    async def dispatch_button(message: Message, handler: HandlerObject, **data: Any):
+        return await handler.call(message, handler=handler, **data)
+
+    return router
@@ -0,0 +1,69 @@
+"""
+Inline-button callbacks routed by payload prefix.
+
+Every callback payload is a PackedCallbackData ("<prefix>:<fields>", see
+utils/callback_data.py) and every handler filters on exactly one of those
+classes. Walking the router tree, a tap on the last router's button still
+runs the payload filter (and state filter) of every handler before it;
+callback_router() instead indexes the handlers by prefix, so a tap only
+checks the few handlers registered for its own prefix — usually one, or a
+handful split by state or by a field (F.full / ~F.full).
+
+A handler can only ever match its own prefix, so the first handler of the
+prefix list whose filters pass is the one the tree would have picked. The
+index stops at the first handler it can't key (no packed filter, or a
+router with its own filters/middlewares); taps it doesn't resolve fall
+through to the tree as usual.
+"""
+from typing import Any
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.filters import Filter
+from aiogram.filters.callback_data import CallbackQueryFilter
+from aiogram.types import CallbackQuery
+
+from handlers.buttons import _bare, _handlers
+from utils.callback_data import PackedCallbackData, callback_prefix
+
+
+def _prefix(handler: HandlerObject) -> str | None:
+    """The packed payload prefix a handler filters on, None if it has none."""
+    prefixes = {
+        f.callback.callback_data.__prefix__
+        for f in handler.filters or ()
+        if isinstance(f.callback, CallbackQueryFilter)
+        and issubclass(f.callback.callback_data, PackedCallbackData)
+    }
+    return prefixes.pop() if len(prefixes) == 1 else None
+
+
+class _CallbackTable(Filter):
+    def __init__(self, routers: list[Router]):
+        self.routes: dict[str, list[HandlerObject]] = {}
+        for router in routers:
+            for owner, handler in _handlers(router, "callback_query"):
+                prefix = _prefix(handler)
+                if prefix is None or not _bare(owner.callback_query):
+                    return   # could match any payload — later handlers stay in the tree
+                self.routes.setdefault(prefix, []).append(handler)
+
+    async def __call__(self, query: CallbackQuery, **kwargs: Any) -> bool | dict[str, Any]:
+        if not query.data:
+            return False
+        for handler in self.routes.get(callback_prefix(query.data), ()):
+            passed, data = await handler.check(query, **kwargs)
+            if passed:
+                return {**data, "handler": handler}   # so middlewares read its flags
+        return False
+
+
+def callback_router(routers: list[Router]) -> Router:
+    """Include first, ahead of `routers`, once their handlers are registered."""
+    router = Router(name="callbacks")
+
+    @router.callback_query(_CallbackTable(routers))
+    async def dispatch_callback(query: CallbackQuery, handler: HandlerObject, **data: Any):
+        return await handler.call(query, handler=handler, **data)
+
+    return router
@@ -7,22 +7,23 @@ from utils.keyboards import admin_main_menu, user_main_menu
 
 router = Router()
 
+# Handlers whose only job is one reply *return* it instead of awaiting it.
+# In webhook mode aiogram puts that reply into the HTTP response, saving a
+# Bot API request; under polling it is sent as usual.
+
 
 @router.message(CommandStart())
 async def cmd_start(message: Message, is_super_admin: bool, db_user):
     if is_super_admin:
-        await message.answer(MSG_ADMIN_WELCOME, reply_markup=admin_main_menu())
-        return
+        return message.answer(MSG_ADMIN_WELCOME, reply_markup=admin_main_menu())
 
     if db_user is None:
-        await message.answer(MSG_NO_ACCESS)
-        return
+        return message.answer(MSG_NO_ACCESS)
 
     if not db_user["is_active"]:
-        await message.answer(MSG_INACTIVE)
-        return
+        return message.answer(MSG_INACTIVE)
 
-    await message.answer(
+    return message.answer(
         MSG_USER_WELCOME.format(shop_name=db_user["shop_name"]),
         reply_markup=user_main_menu()
     )
@@ -1,17 +1,26 @@
+import math
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from handlers.states import AddDebtFSM, SearchDebtFSM, DebtPaymentFSM
+from handlers.buttons import Button
 from services.debt_service import (
-    get_debts, search_debts, get_debt_by_id, pay_debt,
+    get_debts, count_debts, search_debts, get_debt_by_id, pay_debt,
     add_debt, get_total_debt, record_payment
 )
 from utils.texts import *
 from utils.keyboards import (
     debts_menu, cancel_keyboard, user_main_menu,
-    debt_actions_keyboard, debt_pay_type_keyboard, confirm_delete_keyboard
+    debt_actions_keyboard, debt_pay_type_keyboard, confirm_delete_keyboard,
+    pagination_row, offset_pagination_row, numbered_list_keyboard
 )
 from utils.helpers import validate_phone, validate_positive_float, format_number
+from utils.outbox import Outbox
+from utils.callback_data import (
+    DebtsPage, DebtSearchPage, DebtView, DebtAction, DebtOp, DebtPayment, DebtDelete,
+)
+from database import get_ro_db, UnitOfWork
+from services.search import SEARCH_LIMIT
 
 router = Router()
 PAGE_SIZE = 10
@@ -23,44 +32,107 @@ def check_user(db_user):
 
 # ===== NAVIGATION =====
 
-@router.message(F.text == BTN_DEBTS)
+@router.message(Button(BTN_DEBTS))
 async def debts_menu_handler(message: Message, db_user):
     if not check_user(db_user):
-        await message.answer(MSG_NO_ACCESS)
-        return
-    await message.answer(MSG_DEBTS_MENU, reply_markup=debts_menu())
+        return message.answer(MSG_NO_ACCESS)
+    return message.answer(MSG_DEBTS_MENU, reply_markup=debts_menu())
 
 
 # ===== DEBT LIST =====
 
-@router.message(F.text == BTN_DEBT_LIST)
+def _debt_text(debt) -> str:
+    rental_ref = f"\n🔗 Ijara #{debt['rental_id']}" if debt["rental_id"] else ""
+    return (
+        f"👤 {debt['customer_name']}\n"
+        f"📞 {debt['customer_phone']}\n"
+        f"💰 Qarz: {format_number(debt['amount'])} so'm"
+        f"{rental_ref}"
+    )
+
+
+def _debt_lines(debts, start: int) -> str:
+    return "".join(
+        f"{n}. " + MSG_DEBT_ITEM.format(
+            name=d["customer_name"], phone=d["customer_phone"],
+            amount=format_number(d["amount"])
+        ) + "\n"
+        for n, d in enumerate(debts, start)
+    )
+
+
+async def _debts_page(user_id: int, page_no: int, total: int,
+                      after: int = None, before: int = None, conn=None):
+    """Text + inline keyboard for one page of debtors, or None if empty."""
+    async with get_ro_db(conn, snapshot=True) as conn:
+        page = await get_debts(user_id, after=after, before=before, limit=PAGE_SIZE, conn=conn)
+        if not page.rows and (after or before):
+            # Anchor debt was paid off meanwhile — start over from the first page
+            page_no, total = 1, await count_debts(user_id, conn=conn)
+            page = await get_debts(user_id, limit=PAGE_SIZE, conn=conn)
+    if not page.rows:
+        return None
+    total_pages = max(math.ceil(total / PAGE_SIZE), 1)
+    start = (page_no - 1) * PAGE_SIZE + 1
+    text = f"💰 Qarzdorlar ({total} ta, sahifa {page_no}/{total_pages}):\n\n"
+    text += _debt_lines(page.rows, start)
+    nav = pagination_row(DebtsPage, page_no, total, page.rows[0]["id"], page.rows[-1]["id"],
+                         page.has_prev, page.has_next)
+    return text, numbered_list_keyboard(page.rows, start, DebtView, nav)
+
+
+@router.message(Button(BTN_DEBT_LIST))
 async def debt_list_handler(message: Message, db_user):
     if not check_user(db_user):
         return
-    debts, total = await get_debts(db_user["id"])
-    if not debts:
+    async with get_ro_db(snapshot=True) as conn:   # count and page agree
+        total = await count_debts(db_user["id"], conn=conn)
+        rendered = await _debts_page(db_user["id"], 1, total, conn=conn)
+    if not rendered:
         await message.answer(MSG_DEBT_LIST_EMPTY, reply_markup=debts_menu())
         return
-    await message.answer(f"💰 Qarzdorlar ({total} ta):", reply_markup=debts_menu())
-    for debt in debts:
-        rental_ref = f"\n🔗 Ijara #{debt['rental_id']}" if debt["rental_id"] else ""
-        text = (
-            f"👤 {debt['customer_name']}\n"
-            f"📞 {debt['customer_phone']}\n"
-            f"💰 Qarz: {format_number(debt['amount'])} so'm"
-            f"{rental_ref}"
-        )
-        await message.answer(text, reply_markup=debt_actions_keyboard(debt["id"]))
+    text, markup = rendered
+    await message.answer(text, reply_markup=markup)
+
+
+@router.callback_query(DebtsPage.filter())
+async def cb_debts_page(callback: CallbackQuery, callback_data: DebtsPage, db_user):
+    if not check_user(db_user):
+        return await callback.answer()
+    nav = callback_data
+    rendered = await _debts_page(
+        db_user["id"], nav.page, nav.total,
+        after=nav.anchor if nav.forward else None,
+        before=None if nav.forward else nav.anchor,
+    )
+    if rendered:
+        text, markup = rendered
+        await callback.message.edit_text(text, reply_markup=markup)
+    else:
+        await callback.message.edit_text(MSG_DEBT_LIST_EMPTY)
+    await callback.answer()
+
+
+@router.callback_query(DebtView.filter())
+async def cb_debt_view(callback: CallbackQuery, callback_data: DebtView, db_user):
+    if not check_user(db_user):
+        return await callback.answer()
+    debt = await get_debt_by_id(callback_data.id)
+    if not debt or debt["user_id"] != db_user["id"]:
+        return await callback.answer("Topilmadi")
+    await callback.message.answer(_debt_text(debt), reply_markup=debt_actions_keyboard(debt["id"]))
+    await callback.answer()
 
 
 # ===== TOTAL DEBT =====
 
-@router.message(F.text == BTN_TOTAL_DEBT)
+@router.message(Button(BTN_TOTAL_DEBT))
 async def total_debt_handler(message: Message, db_user):
     if not check_user(db_user):
         return
-    total = await get_total_debt(db_user["id"])
-    _, count = await get_debts(db_user["id"], limit=1000)
+    async with get_ro_db(snapshot=True) as conn:   # sum and count agree
+        total = await get_total_debt(db_user["id"], conn=conn)
+        count = await count_debts(db_user["id"], conn=conn)
     await message.answer(
         f"📊 Umumiy qarzdorlik\n\n"
         f"👥 Qarzdorlar soni: {count} ta\n"
@@ -71,45 +143,69 @@ async def total_debt_handler(message: Message, db_user):
 
 # ===== SEARCH DEBT =====
 
-@router.message(F.text == BTN_SEARCH_DEBT)
+@router.message(Button(BTN_SEARCH_DEBT))
 async def search_debt_start(message: Message, state: FSMContext, db_user):
     if not check_user(db_user):
         return
     await state.set_state(SearchDebtFSM.query)
-    await message.answer(MSG_SEARCH_PROMPT, reply_markup=cancel_keyboard())
+    return message.answer(MSG_SEARCH_PROMPT, reply_markup=cancel_keyboard())
+
+
+def _search_page(page, offset: int):
+    """Text + inline keyboard for one page of debt search hits."""
+    text = MSG_SEARCH_PAGE.format(page=offset // SEARCH_LIMIT + 1) + "\n\n"
+    text += _debt_lines(page.rows, offset + 1)
+    nav = offset_pagination_row(DebtSearchPage, offset, SEARCH_LIMIT, page.has_prev, page.has_next)
+    return text, numbered_list_keyboard(page.rows, offset + 1, DebtView, nav)
 
 
 @router.message(SearchDebtFSM.query)
-async def search_debt_result(message: Message, state: FSMContext, db_user):
+async def search_debt_result(message: Message, state: FSMContext, db_user, outbox: Outbox):
     if message.text == BTN_CANCEL:
         await state.clear()
         await message.answer(MSG_CANCELLED, reply_markup=debts_menu())
         return
-    debts = await search_debts(db_user["id"], message.text.strip())
+    query = message.text.strip()
+    page = await search_debts(db_user["id"], query)
     await state.clear()
-    if not debts:
+    if not page.rows:
         await message.answer(MSG_NOT_FOUND, reply_markup=debts_menu())
         return
-    for debt in debts:
-        rental_ref = f"\n🔗 Ijara #{debt['rental_id']}" if debt["rental_id"] else ""
-        text = (
-            f"👤 {debt['customer_name']}\n"
-            f"📞 {debt['customer_phone']}\n"
-            f"💰 Qarz: {format_number(debt['amount'])} so'm"
-            f"{rental_ref}"
-        )
-        await message.answer(text, reply_markup=debt_actions_keyboard(debt["id"]))
-    await message.answer("✅ Qidiruv tugadi.", reply_markup=debts_menu())
+    if page.has_next:
+        # Keep the query (no state) so ◀️/▶️ can fetch other pages
+        await state.update_data(search_query=query)
+    # The menu comes back with the first message, the hits go in the second
+    outbox.answer(message, MSG_SEARCH_RESULTS, reply_markup=debts_menu())
+    text, markup = _search_page(page, 0)
+    outbox.answer(message, text, reply_markup=markup)
+
+
+@router.callback_query(DebtSearchPage.filter())
+async def cb_search_debt_page(callback: CallbackQuery, callback_data: DebtSearchPage,
+                              state: FSMContext, db_user):
+    if not check_user(db_user):
+        return await callback.answer()
+    offset = callback_data.offset
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        return await callback.answer()
+    page = await search_debts(db_user["id"], query, offset=offset)
+    if page.rows:
+        text, markup = _search_page(page, offset)
+        await callback.message.edit_text(text, reply_markup=markup)
+    else:
+        await callback.message.edit_text(MSG_NOT_FOUND)
+    await callback.answer()
 
 
 # ===== ADD DEBT MANUALLY =====
 
-@router.message(F.text == BTN_ADD_DEBT)
+@router.message(Button(BTN_ADD_DEBT))
 async def add_debt_start(message: Message, state: FSMContext, db_user):
     if not check_user(db_user):
         return
     await state.set_state(AddDebtFSM.name)
-    await message.answer(MSG_ADD_DEBT_NAME, reply_markup=cancel_keyboard())
+    return message.answer(MSG_ADD_DEBT_NAME, reply_markup=cancel_keyboard())
 
 
 @router.message(AddDebtFSM.name)
@@ -160,9 +256,9 @@ async def add_debt_amount(message: Message, state: FSMContext, db_user):
 
 # ===== DEBT PAYMENT CALLBACK =====
 
-@router.callback_query(F.data.startswith("debt_pay:"))
-async def cb_debt_pay(callback: CallbackQuery, state: FSMContext):
-    debt_id = int(callback.data.split(":")[1])
+@router.callback_query(DebtAction.filter(F.op == DebtOp.pay))
+async def cb_debt_pay(callback: CallbackQuery, callback_data: DebtAction, state: FSMContext):
+    debt_id = callback_data.id
     debt = await get_debt_by_id(debt_id)
     if not debt:
         await callback.answer("Topilmadi")
@@ -174,10 +270,12 @@ async def cb_debt_pay(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("debt_payment:full:"))
-async def cb_debt_full_payment(callback: CallbackQuery, db_user):
-    debt_id = int(callback.data.split(":")[2])
-    debt = await get_debt_by_id(debt_id)
+@router.callback_query(DebtPayment.filter(F.full), flags={"ack": "manual"})
+async def cb_debt_full_payment(callback: CallbackQuery, callback_data: DebtPayment, db_user,
+                               uow: UnitOfWork):
+    debt_id = callback_data.id
+    conn = await uow.connection()
+    debt = await get_debt_by_id(debt_id, conn=conn)
     if not debt:
         await callback.answer("Topilmadi", show_alert=True)
         return
@@ -185,15 +283,18 @@ async def cb_debt_full_payment(callback: CallbackQuery, db_user):
     if amount <= 0:
         await callback.answer("Bu qarz allaqachon to'langan.", show_alert=True)
         return
-    await record_payment(db_user["id"], debt["rental_id"] if debt["rental_id"] else None, amount)
-    await pay_debt(debt_id, amount)
+    await record_payment(db_user["id"], debt["rental_id"] if debt["rental_id"] else None, amount,
+                         conn=conn)
+    await pay_debt(debt_id, amount, conn=conn)
+    await uow.commit()
     await callback.message.answer(MSG_DEBT_CLEARED)
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("debt_payment:partial:"))
-async def cb_debt_partial_start(callback: CallbackQuery, state: FSMContext):
-    debt_id = int(callback.data.split(":")[2])
+@router.callback_query(DebtPayment.filter(~F.full))
+async def cb_debt_partial_start(callback: CallbackQuery, callback_data: DebtPayment,
+                                state: FSMContext):
+    debt_id = callback_data.id
     debt = await get_debt_by_id(debt_id)
     await state.set_state(DebtPaymentFSM.amount)
     await state.update_data(paying_debt_id=debt_id, max_amount=debt["amount"])
@@ -205,7 +306,7 @@ async def cb_debt_partial_start(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(DebtPaymentFSM.amount)
-async def debt_partial_payment(message: Message, state: FSMContext, db_user):
+async def debt_partial_payment(message: Message, state: FSMContext, db_user, uow: UnitOfWork):
     data = await state.get_data()
     max_amount = data["max_amount"]
 
@@ -227,14 +328,17 @@ async def debt_partial_payment(message: Message, state: FSMContext, db_user):
         return
 
     debt_id = data["paying_debt_id"]
-    debt = await get_debt_by_id(debt_id)
+    conn = await uow.connection()
+    debt = await get_debt_by_id(debt_id, conn=conn)
     if not debt:
         await message.answer(MSG_ERROR, reply_markup=debts_menu())
         await state.clear()
         return
 
-    await record_payment(db_user["id"], debt["rental_id"] if debt["rental_id"] else None, amount)
-    remaining = await pay_debt(debt_id, amount)
+    await record_payment(db_user["id"], debt["rental_id"] if debt["rental_id"] else None, amount,
+                         conn=conn)
+    remaining = await pay_debt(debt_id, amount, conn=conn)
+    await uow.commit()
     await state.clear()
 
     if remaining <= 0:
@@ -249,27 +353,27 @@ async def debt_partial_payment(message: Message, state: FSMContext, db_user):
 
 # ===== DELETE DEBT =====
 
-@router.callback_query(F.data.startswith("debt_delete:"))
-async def cb_debt_delete_confirm(callback: CallbackQuery):
-    debt_id = int(callback.data.split(":")[1])
+@router.callback_query(DebtAction.filter(F.op == DebtOp.delete))
+async def cb_debt_delete_confirm(callback: CallbackQuery, callback_data: DebtAction):
+    debt_id = callback_data.id
     await callback.message.answer(
         MSG_CONFIRM_DELETE,
-        reply_markup=confirm_delete_keyboard("debt_del_final", debt_id)
+        reply_markup=confirm_delete_keyboard(DebtDelete, debt_id)
     )
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("debt_del_final:confirm:"))
-async def cb_debt_delete_do(callback: CallbackQuery):
+@router.callback_query(DebtDelete.filter(F.yes))
+async def cb_debt_delete_do(callback: CallbackQuery, callback_data: DebtDelete):
     from database import get_db
-    debt_id = int(callback.data.split(":")[2])
+    debt_id = callback_data.id
     async with get_db() as conn:
         await conn.execute("DELETE FROM debts WHERE id = $1", debt_id)
     await callback.message.edit_text("🗑 Qarz o'chirildi.")
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("debt_del_final:cancel:"))
+@router.callback_query(DebtDelete.filter(~F.yes))
 async def cb_debt_delete_cancel(callback: CallbackQuery):
     await callback.message.edit_text(MSG_CANCELLED)
     await callback.answer()
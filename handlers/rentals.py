@@ -1,30 +1,38 @@
+import math
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from handlers.states import AddRentalFSM, ReturnRentalFSM
-from services.tool_service import get_all_tools, get_tool_by_id
+from handlers.buttons import Button
+from services.tool_service import get_catalog, get_tool_by_id, InsufficientStockError
 from services.rental_service import (
-    create_rental, get_active_rentals, search_rentals,
+    create_rental, get_active_rentals, count_active_rentals, search_rentals,
     get_rental_by_id, get_rental_items, calculate_rental_cost,
     calculate_return_cost, get_already_paid, process_return,
     close_rental, is_fully_returned, get_unreturned_items
 )
 from services.debt_service import add_debt, record_payment
+from services.search import SEARCH_LIMIT
 from utils.texts import *
 from utils.keyboards import (
     rentals_menu, cancel_keyboard,
     rental_tools_selection_keyboard, rental_confirmation_keyboard,
     rental_list_keyboard, rental_return_type_keyboard,
-    payment_type_keyboard, yes_no_keyboard
+    payment_type_keyboard, yes_no_keyboard, pagination_row, offset_pagination_row
 )
 from utils.helpers import (
     validate_phone, validate_positive_int,
     validate_positive_float, format_number, format_date
 )
+from utils.callback_data import (
+    RentalsPage, RentalDetail, RentalTool, RentalConfirm, RentalConfirmOp,
+    ReturnSearchPage, ReturnRental, ReturnType, ReturnItem, MoreItems, ReturnPayment,
+)
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from database import get_db
+from database import get_ro_db, UnitOfWork
 
 router = Router()
+PAGE_SIZE = 10
 
 
 def check_user(db_user):
@@ -43,7 +51,7 @@ def _items_keyboard(items: list, staged_ids: set) -> InlineKeyboardMarkup:
             if remaining > 0:
                 builder.button(
                     text=f"🔧 {item['tool_name']}  ({remaining} dona)",
-                    callback_data=f"ri:{item['id']}"
+                    callback_data=ReturnItem(id=item["id"])
                 )
     builder.adjust(1)
     return builder.as_markup()
@@ -64,7 +72,7 @@ def _staged_ids(partial_returns: list) -> set:
 
 
 async def _go_payment(target, state: FSMContext,
-                      rental_id: int, cost: float, paid: float):
+                      rental_id: int, cost: float, paid: float, outstanding: int):
     """Set payment state and send payment summary."""
     remaining = round(max(cost - paid, 0.0), 2)
     await state.update_data(
@@ -72,6 +80,7 @@ async def _go_payment(target, state: FSMContext,
         return_cost=cost,
         already_paid=paid,
         remaining_balance=remaining,
+        outstanding=outstanding,
     )
     await state.set_state(ReturnRentalFSM.payment)
     # target can be Message or CallbackQuery.message
@@ -86,26 +95,25 @@ async def _go_payment(target, state: FSMContext,
 # NAVIGATION  (clears any stale FSM state)
 # ================================================================
 
-@router.message(F.text == BTN_RENTALS)
+@router.message(Button(BTN_RENTALS))
 async def rentals_menu_handler(message: Message, state: FSMContext, db_user):
     if not check_user(db_user):
-        await message.answer(MSG_NO_ACCESS)
-        return
+        return message.answer(MSG_NO_ACCESS)
     await state.clear()
-    await message.answer(MSG_RENTALS_MENU, reply_markup=rentals_menu())
+    return message.answer(MSG_RENTALS_MENU, reply_markup=rentals_menu())
 
 
 # ================================================================
 # ADD RENTAL
 # ================================================================
 
-@router.message(F.text == BTN_ADD_RENTAL)
+@router.message(Button(BTN_ADD_RENTAL))
 async def add_rental_start(message: Message, state: FSMContext, db_user):
     if not check_user(db_user):
         return
     await state.clear()
     await state.set_state(AddRentalFSM.customer_name)
-    await message.answer(MSG_RENTAL_CUSTOMER_NAME, reply_markup=cancel_keyboard())
+    return message.answer(MSG_RENTAL_CUSTOMER_NAME, reply_markup=cancel_keyboard())
 
 
 @router.message(AddRentalFSM.customer_name)
@@ -135,28 +143,29 @@ async def _add_rental_phone(message: Message, state: FSMContext, db_user):
         return await message.answer(MSG_CANCELLED, reply_markup=rentals_menu())
     if not validate_phone(message.text):
         return await message.answer(MSG_INVALID_PHONE)
-    tools = await get_all_tools(db_user["id"])
-    available = [t for t in tools if t["quantity"] > 0]
-    if not available:
+    catalog = await get_catalog(db_user["id"])
+    if not catalog.available:
         await state.clear()
         return await message.answer("❌ Mavjud asboblar yo'q.", reply_markup=rentals_menu())
     await state.update_data(customer_phone=message.text.strip(), selected_tools={})
     await state.set_state(AddRentalFSM.select_tools)
     await message.answer(MSG_SELECT_TOOL_FOR_RENTAL,
-                         reply_markup=rental_tools_selection_keyboard(available))
+                         reply_markup=rental_tools_selection_keyboard(
+                             catalog.available, version=catalog.version))
 
 
-@router.callback_query(AddRentalFSM.select_tools, F.data.startswith("rental_tool:"))
-async def _add_rental_tool(callback: CallbackQuery, state: FSMContext, db_user):
-    action = callback.data.split(":")[1]
-    if action == "done":
+@router.callback_query(AddRentalFSM.select_tools, RentalTool.filter(),
+                       flags={"ack": "manual"})
+async def _add_rental_tool(callback: CallbackQuery, callback_data: RentalTool,
+                           state: FSMContext, db_user):
+    tool_id = callback_data.tool_id
+    if tool_id is None:   # "done"
         data = await state.get_data()
         if not data.get("selected_tools"):
             return await callback.answer("❌ Kamida bitta asbob tanlang!", show_alert=True)
         await state.set_state(AddRentalFSM.confirm)
         await _show_summary(callback.message, data)
         return await callback.answer()
-    tool_id = int(action)
     tool = await get_tool_by_id(tool_id)
     if not tool:
         return await callback.answer("Topilmadi")
@@ -174,13 +183,12 @@ async def _add_rental_tool_qty(message: Message, state: FSMContext, db_user):
     data = await state.get_data()
     if message.text == BTN_CANCEL:
         await state.set_state(AddRentalFSM.select_tools)
-        tools = await get_all_tools(db_user["id"])
+        catalog = await get_catalog(db_user["id"])
         selected = data.get("selected_tools", {})
-        available = [t for t in tools if t["quantity"] > 0]
         return await message.answer(
             MSG_SELECT_TOOL_FOR_RENTAL,
             reply_markup=rental_tools_selection_keyboard(
-                available, list(map(int, selected.keys())))
+                catalog.available, list(map(int, selected.keys())), version=catalog.version)
         )
     tool = await get_tool_by_id(data["current_tool_id"])
     qty = validate_positive_int(message.text)
@@ -190,12 +198,11 @@ async def _add_rental_tool_qty(message: Message, state: FSMContext, db_user):
     selected[str(tool["id"])] = {"qty": qty, "name": tool["name"], "price": tool["daily_price"]}
     await state.update_data(selected_tools=selected)
     await state.set_state(AddRentalFSM.select_tools)
-    tools = await get_all_tools(db_user["id"])
-    available = [t for t in tools if t["quantity"] > 0]
+    catalog = await get_catalog(db_user["id"])
     await message.answer(
         f"✅ {tool['name']} x{qty} qo'shildi.\n\n{MSG_SELECT_TOOL_FOR_RENTAL}",
         reply_markup=rental_tools_selection_keyboard(
-            available, [int(k) for k in selected.keys()])
+            catalog.available, [int(k) for k in selected.keys()], version=catalog.version)
     )
 
 
@@ -216,37 +223,50 @@ async def _show_summary(message: Message, data: dict):
     )
 
 
-@router.callback_query(AddRentalFSM.confirm, F.data.startswith("rental_confirm:"))
-async def _add_rental_confirm(callback: CallbackQuery, state: FSMContext, db_user):
-    action = callback.data.split(":")[1]
+@router.callback_query(AddRentalFSM.confirm, RentalConfirm.filter())
+async def _add_rental_confirm(callback: CallbackQuery, callback_data: RentalConfirm,
+                              state: FSMContext, db_user):
+    action = callback_data.op
     data = await state.get_data()
-    if action == "cancel":
+    if action == RentalConfirmOp.cancel:
         await state.clear()
         await callback.message.answer(MSG_CANCELLED, reply_markup=rentals_menu())
         return await callback.answer()
-    if action == "edit":
+    if action == RentalConfirmOp.edit:
         await state.set_state(AddRentalFSM.select_tools)
-        tools = await get_all_tools(db_user["id"])
+        catalog = await get_catalog(db_user["id"])
         selected = data.get("selected_tools", {})
         await callback.message.answer(
             MSG_SELECT_TOOL_FOR_RENTAL,
             reply_markup=rental_tools_selection_keyboard(
-                [t for t in tools if t["quantity"] > 0],
-                [int(k) for k in selected.keys()])
+                catalog.available, [int(k) for k in selected.keys()], version=catalog.version)
         )
         return await callback.answer()
-    if action == "yes":
+    if action == RentalConfirmOp.yes:
         items = [
             {"tool_id": int(tid), "quantity": info["qty"], "daily_price": info["price"]}
             for tid, info in data.get("selected_tools", {}).items()
         ]
-        rental_id = await create_rental(
-            user_id=db_user["id"],
-            customer_name=data["customer_name"],
-            customer_address=data["customer_address"],
-            customer_phone=data["customer_phone"],
-            items=items
-        )
+        try:
+            rental_id = await create_rental(
+                user_id=db_user["id"],
+                customer_name=data["customer_name"],
+                customer_address=data["customer_address"],
+                customer_phone=data["customer_phone"],
+                items=items
+            )
+        except InsufficientStockError as e:
+            # Keep the session so the user can fix quantities via "edit"
+            selected = data.get("selected_tools", {})
+            lines = "\n".join(
+                f"• {selected[str(tid)]['name']} — so'ralgan {selected[str(tid)]['qty']}, mavjud {avail}"
+                for tid, avail in e.shortages.items()
+            )
+            await callback.message.answer(
+                MSG_RENTAL_STOCK_SHORT.format(tools=lines),
+                reply_markup=rental_confirmation_keyboard()
+            )
+            return await callback.answer()
         await state.clear()
         msg = MSG_RENTAL_CONFIRMED if rental_id else MSG_ERROR
         await callback.message.answer(msg, reply_markup=rentals_menu())
@@ -257,34 +277,74 @@ async def _add_rental_confirm(callback: CallbackQuery, state: FSMContext, db_use
 # VIEW ACTIVE RENTALS  (no state — plain list view)
 # ================================================================
 
-@router.message(F.text == BTN_RENTAL_LIST)
+async def _rentals_page(user_id: int, page_no: int, total: int,
+                        after: int = None, before: int = None, conn=None):
+    """Text + inline keyboard for one page of active rentals, or None if empty."""
+    async with get_ro_db(conn, snapshot=True) as conn:
+        page = await get_active_rentals(user_id, after=after, before=before, limit=PAGE_SIZE,
+                                        conn=conn)
+        if not page.rows and (after or before):
+            # Anchor rental was closed meanwhile — start over from the first page
+            page_no, total = 1, await count_active_rentals(user_id, conn=conn)
+            page = await get_active_rentals(user_id, limit=PAGE_SIZE, conn=conn)
+    if not page.rows:
+        return None
+    total_pages = max(math.ceil(total / PAGE_SIZE), 1)
+    nav = pagination_row(RentalsPage, page_no, total, page.rows[0]["id"], page.rows[-1]["id"],
+                         page.has_prev, page.has_next)
+    return (f"📋 Faol ijaralar ({total} ta, sahifa {page_no}/{total_pages}):",
+            rental_list_keyboard(page.rows, nav))
+
+
+@router.message(Button(BTN_RENTAL_LIST))
 async def rental_list_handler(message: Message, state: FSMContext, db_user):
     if not check_user(db_user):
         return
     await state.clear()
-    rentals, total = await get_active_rentals(db_user["id"])
-    if not rentals:
+    async with get_ro_db(snapshot=True) as conn:   # count and page agree
+        total = await count_active_rentals(db_user["id"], conn=conn)
+        rendered = await _rentals_page(db_user["id"], 1, total, conn=conn)
+    if not rendered:
         return await message.answer(MSG_RENTAL_LIST_EMPTY, reply_markup=rentals_menu())
-    await message.answer(
-        f"📋 Faol ijaralar ({total} ta):",
-        reply_markup=rental_list_keyboard(rentals)
+    text, markup = rendered
+    await message.answer(text, reply_markup=markup)
+
+
+@router.callback_query(RentalsPage.filter())
+async def cb_rentals_page(callback: CallbackQuery, callback_data: RentalsPage, db_user):
+    if not check_user(db_user):
+        return await callback.answer()
+    nav = callback_data
+    rendered = await _rentals_page(
+        db_user["id"], nav.page, nav.total,
+        after=nav.anchor if nav.forward else None,
+        before=None if nav.forward else nav.anchor,
     )
+    if rendered:
+        text, markup = rendered
+        await callback.message.edit_text(text, reply_markup=markup)
+    else:
+        await callback.message.edit_text(MSG_RENTAL_LIST_EMPTY)
+    await callback.answer()
 
 
 # rental_detail — only fires when NO active FSM state (i.e. from list view)
-@router.callback_query(F.data.startswith("rental_detail:"))
-async def cb_rental_detail(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(RentalDetail.filter())
+async def cb_rental_detail(callback: CallbackQuery, callback_data: RentalDetail,
+                           state: FSMContext):
     cur = await state.get_state()
     if cur is not None:
         # Some FSM is active — ignore this stray callback silently
         return await callback.answer()
 
-    rental_id = int(callback.data.split(":")[1])
-    rental = await get_rental_by_id(rental_id)
+    rental_id = callback_data.id
+    async with get_ro_db(snapshot=True) as conn:   # rental, items and cost agree
+        rental = await get_rental_by_id(rental_id, conn=conn)
+        if rental:
+            items = await get_rental_items(rental_id, conn=conn)
+            total_cost = await calculate_rental_cost(rental_id, conn=conn)
     if not rental:
         return await callback.answer("Topilmadi")
-    items = await get_rental_items(rental_id)
-    total_cost = await calculate_rental_cost(rental_id)
     tools_text = ""
     for item in items:
         rem = item["quantity"] - item["returned_quantity"]
@@ -309,11 +369,11 @@ async def cb_rental_detail(callback: CallbackQuery, state: FSMContext):
 # Flow:
 #  BTN_RETURN_RENTAL
 #    → search (text input)
-#    → select_rental (tap a rental button  "rd:<id>")
+#    → select_rental (tap a rental button  ReturnRental)
 #    → return_type  (To'liq / Qisman)
 #      FULL  → process all → payment stage
 #      PARTIAL:
-#        → select_item  (tap a tool button  "ri:<item_id>")
+#        → select_item  (tap a tool button    ReturnItem)
 #        → item_quantity (type number)
 #        → confirm_more  ("Ha, yana bor" / "Yo'q, tugatish")
 #        loop back to select_item or → finalize → payment stage
@@ -324,7 +384,7 @@ async def cb_rental_detail(callback: CallbackQuery, state: FSMContext):
 #        → record, debt if needed, done
 # ================================================================
 
-@router.message(F.text == BTN_RETURN_RENTAL)
+@router.message(Button(BTN_RETURN_RENTAL))
 async def return_start(message: Message, state: FSMContext, db_user):
     if not check_user(db_user):
         return
@@ -340,36 +400,51 @@ async def return_search(message: Message, state: FSMContext, db_user):
     if message.text == BTN_CANCEL:
         await state.clear()
         return await message.answer(MSG_CANCELLED, reply_markup=rentals_menu())
-    rentals = await search_rentals(db_user["id"], message.text.strip())
-    if not rentals:
+    query = message.text.strip()
+    page = await search_rentals(db_user["id"], query)
+    if not page.rows:
         return await message.answer(
             MSG_NOT_FOUND + "\n\nQaytadan urinib ko'ring yoki bekor qiling.",
             reply_markup=cancel_keyboard()
         )
+    await state.update_data(search_query=query)
     await state.set_state(ReturnRentalFSM.select_rental)
-    await message.answer(
-        MSG_SELECT_RENTAL,
-        reply_markup=_rentals_kb(rentals)   # uses "rd:" prefix — NO conflict
-    )
+    await message.answer(MSG_SELECT_RENTAL, reply_markup=_rental_pick_keyboard(page, 0))
 
 
-def _rentals_kb(rentals):
-    """Rental pick keyboard that uses 'rd:' prefix to avoid clashing with 'rental_detail:'."""
-    builder = InlineKeyboardBuilder()
-    for r in rentals:
-        builder.button(
+def _rental_pick_keyboard(page, offset: int) -> InlineKeyboardMarkup:
+    """Rental pick buttons (ReturnRental, not RentalDetail) for one page + ◀️/▶️."""
+    rows = [
+        [InlineKeyboardButton(
             text=f"👤 {r['customer_name']}  📞 {r['customer_phone']}",
-            callback_data=f"rd:{r['id']}"
-        )
-    builder.adjust(1)
-    return builder.as_markup()
+            callback_data=ReturnRental(id=r["id"]).pack()
+        )]
+        for r in page.rows
+    ]
+    nav = offset_pagination_row(ReturnSearchPage, offset, SEARCH_LIMIT, page.has_prev, page.has_next)
+    if nav:
+        rows.append(nav)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+@router.callback_query(ReturnRentalFSM.select_rental, ReturnSearchPage.filter())
+async def return_search_page(callback: CallbackQuery, callback_data: ReturnSearchPage,
+                             state: FSMContext, db_user):
+    offset = callback_data.offset
+    data = await state.get_data()
+    page = await search_rentals(db_user["id"], data.get("search_query", ""), offset=offset)
+    if page.rows:
+        await callback.message.edit_reply_markup(reply_markup=_rental_pick_keyboard(page, offset))
+    await callback.answer()
 
 
 # ── STEP 2 : select rental ──────────────────────────────────────
 
-@router.callback_query(ReturnRentalFSM.select_rental, F.data.startswith("rd:"))
-async def return_pick_rental(callback: CallbackQuery, state: FSMContext):
-    rental_id = int(callback.data.split(":")[1])
+@router.callback_query(ReturnRentalFSM.select_rental, ReturnRental.filter(),
+                       flags={"ack": "manual"})
+async def return_pick_rental(callback: CallbackQuery, callback_data: ReturnRental,
+                             state: FSMContext):
+    rental_id = callback_data.id
     rental = await get_rental_by_id(rental_id)
     if not rental:
         return await callback.answer("Topilmadi", show_alert=True)
@@ -391,10 +466,12 @@ async def return_pick_rental(callback: CallbackQuery, state: FSMContext):
 
 # ── STEP 3a : TO'LIQ TOPSHIRISH ─────────────────────────────────
 
-@router.callback_query(ReturnRentalFSM.return_type, F.data.startswith("return_type:full:"))
-async def return_full(callback: CallbackQuery, state: FSMContext):
-    rental_id = int(callback.data.split(":")[2])
-    items = await get_unreturned_items(rental_id)
+@router.callback_query(ReturnRentalFSM.return_type, ReturnType.filter(F.full))
+async def return_full(callback: CallbackQuery, callback_data: ReturnType,
+                      state: FSMContext, uow: UnitOfWork):
+    rental_id = callback_data.rental_id
+    conn = await uow.connection()
+    items = await get_unreturned_items(rental_id, conn=conn)
     if not items:
         await state.clear()
         await callback.message.answer(
@@ -408,20 +485,22 @@ async def return_full(callback: CallbackQuery, state: FSMContext):
          "quantity": it["quantity"] - it["returned_quantity"]}
         for it in items
     ]
-    cost = await calculate_return_cost(rental_id, returns)
-    await process_return(rental_id, returns)
-    paid = await get_already_paid(rental_id)
+    cost = await calculate_return_cost(rental_id, returns, conn=conn)
+    outstanding = await process_return(rental_id, returns, conn=conn)
+    paid = await get_already_paid(rental_id, conn=conn)
+    await uow.commit()
 
     await state.update_data(return_rental_id=rental_id)
-    await _go_payment(callback.message, state, rental_id, cost, paid)
+    await _go_payment(callback.message, state, rental_id, cost, paid, outstanding)
     await callback.answer()
 
 
 # ── STEP 3b : QISMAN TOPSHIRISH — start ─────────────────────────
 
-@router.callback_query(ReturnRentalFSM.return_type, F.data.startswith("return_type:partial:"))
-async def return_partial_start(callback: CallbackQuery, state: FSMContext):
-    rental_id = int(callback.data.split(":")[2])
+@router.callback_query(ReturnRentalFSM.return_type, ReturnType.filter(~F.full))
+async def return_partial_start(callback: CallbackQuery, callback_data: ReturnType,
+                               state: FSMContext):
+    rental_id = callback_data.rental_id
     items = await get_unreturned_items(rental_id)
     if not items:
         await state.clear()
@@ -442,11 +521,13 @@ async def return_partial_start(callback: CallbackQuery, state: FSMContext):
 
 # ── STEP 3b : select which tool ─────────────────────────────────
 
-@router.callback_query(ReturnRentalFSM.select_item, F.data.startswith("ri:"))
-async def return_pick_item(callback: CallbackQuery, state: FSMContext):
-    item_id = int(callback.data.split(":")[1])
+@router.callback_query(ReturnRentalFSM.select_item, ReturnItem.filter(),
+                       flags={"ack": "manual"})
+async def return_pick_item(callback: CallbackQuery, callback_data: ReturnItem,
+                           state: FSMContext):
+    item_id = callback_data.id
 
-    async with get_db() as conn:
+    async with get_ro_db() as conn:
         item = await conn.fetchrow(
             "SELECT ri.*, t.name AS tool_name FROM rental_items ri JOIN tools t ON t.id = ri.tool_id WHERE ri.id = $1",
             item_id
@@ -473,7 +554,7 @@ async def return_pick_item(callback: CallbackQuery, state: FSMContext):
 # ── STEP 3b : enter quantity ─────────────────────────────────────
 
 @router.message(ReturnRentalFSM.item_quantity)
-async def return_item_qty(message: Message, state: FSMContext):
+async def return_item_qty(message: Message, state: FSMContext, uow: UnitOfWork):
     data = await state.get_data()
     rental_id = data["return_rental_id"]
     item_id = data["current_return_item_id"]
@@ -491,9 +572,9 @@ async def return_item_qty(message: Message, state: FSMContext):
             )
         else:
             # nothing left to pick — finalize what's staged
-            return await _finalize(message, state, data)
+            return await _finalize(message, state, data, uow)
 
-    async with get_db() as conn:
+    async with get_ro_db() as conn:
         item = await conn.fetchrow("SELECT * FROM rental_items WHERE id = $1", item_id)
 
     if not item:
@@ -520,7 +601,7 @@ async def return_item_qty(message: Message, state: FSMContext):
     await state.set_state(ReturnRentalFSM.confirm_more)
 
     # show tool name for confirmation
-    async with get_db() as conn:
+    async with get_ro_db() as conn:
         row = await conn.fetchrow(
             "SELECT t.name FROM rental_items ri JOIN tools t ON t.id=ri.tool_id WHERE ri.id=$1",
             item_id
@@ -537,8 +618,8 @@ async def return_item_qty(message: Message, state: FSMContext):
 
 # ── STEP 3b : "Yana bor?" yes ────────────────────────────────────
 
-@router.callback_query(ReturnRentalFSM.confirm_more, F.data == "more_items:yes")
-async def return_more_yes(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(ReturnRentalFSM.confirm_more, MoreItems.filter(F.more))
+async def return_more_yes(callback: CallbackQuery, state: FSMContext, uow: UnitOfWork):
     data = await state.get_data()
     rental_id = data["return_rental_id"]
     staged = _staged_ids(data.get("partial_returns", []))
@@ -547,7 +628,7 @@ async def return_more_yes(callback: CallbackQuery, state: FSMContext):
 
     if not avail:
         await callback.message.answer("✅ Barcha mavjud asboblar tanlandi.")
-        await _finalize(callback.message, state, data)
+        await _finalize(callback.message, state, data, uow)
     else:
         await state.set_state(ReturnRentalFSM.select_item)
         await callback.message.answer(
@@ -559,43 +640,56 @@ async def return_more_yes(callback: CallbackQuery, state: FSMContext):
 
 # ── STEP 3b : "Yana bor?" no — finalize ─────────────────────────
 
-@router.callback_query(ReturnRentalFSM.confirm_more, F.data == "more_items:no")
-async def return_more_no(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(ReturnRentalFSM.confirm_more, MoreItems.filter(~F.more))
+async def return_more_no(callback: CallbackQuery, state: FSMContext, uow: UnitOfWork):
     data = await state.get_data()
-    await _finalize(callback.message, state, data)
+    await _finalize(callback.message, state, data, uow)
     await callback.answer()
 
 
-async def _finalize(msg: Message, state: FSMContext, data: dict):
+async def _finalize(msg: Message, state: FSMContext, data: dict, uow: UnitOfWork):
     """Commit staged items → payment stage."""
     partial = data.get("partial_returns", [])
     rental_id = data["return_rental_id"]
     if not partial:
         await state.clear()
         return await msg.answer("❌ Hech narsa tanlanmadi.", reply_markup=rentals_menu())
-    cost = await calculate_return_cost(rental_id, partial)
-    await process_return(rental_id, partial)
+    conn = await uow.connection()
+    cost = await calculate_return_cost(rental_id, partial, conn=conn)
+    outstanding = await process_return(rental_id, partial, conn=conn)
+    paid = await get_already_paid(rental_id, conn=conn)
+    await uow.commit()
     await state.update_data(partial_returns=[])
-    paid = await get_already_paid(rental_id)
-    await _go_payment(msg, state, rental_id, cost, paid)
+    await _go_payment(msg, state, rental_id, cost, paid, outstanding)
+
+
+async def _is_fully_returned(data: dict, rental_id: int, conn) -> bool:
+    """process_return() already told us what is outstanding — no query needed."""
+    if "outstanding" in data:
+        return data["outstanding"] <= 0
+    return await is_fully_returned(rental_id, conn=conn)
 
 
 # ================================================================
 # PAYMENT — TO'LIQ TO'LOV
 # ================================================================
 
-@router.callback_query(ReturnRentalFSM.payment, F.data.startswith("payment:full:"))
-async def payment_full(callback: CallbackQuery, state: FSMContext, db_user):
-    rental_id = int(callback.data.split(":")[2])
+@router.callback_query(ReturnRentalFSM.payment, ReturnPayment.filter(F.full))
+async def payment_full(callback: CallbackQuery, callback_data: ReturnPayment,
+                       state: FSMContext, db_user, uow: UnitOfWork):
+    rental_id = callback_data.rental_id
     data = await state.get_data()
     remaining = data.get("remaining_balance", 0.0)
 
+    conn = await uow.connection()
     if remaining > 0:
-        await record_payment(db_user["id"], rental_id, remaining)
+        await record_payment(db_user["id"], rental_id, remaining, conn=conn)
 
-    fully_returned = await is_fully_returned(rental_id)
+    fully_returned = await _is_fully_returned(data, rental_id, conn)
+    if fully_returned:
+        await close_rental(rental_id, conn=conn)
+    await uow.commit()
     if fully_returned:
-        await close_rental(rental_id)
         msg = "✅ To'lov qabul qilindi. Ijara yopildi."
     else:
         msg = "✅ To'lov qabul qilindi.\n📑 Ijara faol — asboblar hali qaytarilmagan."
@@ -609,7 +703,8 @@ async def payment_full(callback: CallbackQuery, state: FSMContext, db_user):
 # PAYMENT — QISMAN TO'LOV : ask amount
 # ================================================================
 
-@router.callback_query(ReturnRentalFSM.payment, F.data.startswith("payment:partial:"))
+@router.callback_query(ReturnRentalFSM.payment, ReturnPayment.filter(~F.full),
+                       flags={"ack": "manual"})
 async def payment_partial_start(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     remaining = data.get("remaining_balance", 0.0)
@@ -625,7 +720,8 @@ async def payment_partial_start(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(ReturnRentalFSM.partial_amount)
-async def payment_partial_amount(message: Message, state: FSMContext, db_user):
+async def payment_partial_amount(message: Message, state: FSMContext, db_user,
+                                 uow: UnitOfWork):
     data = await state.get_data()
     rental_id = data["return_rental_id"]
     remaining = data.get("remaining_balance", 0.0)
@@ -649,7 +745,8 @@ async def payment_partial_amount(message: Message, state: FSMContext, db_user):
             f"❌ Maksimal summa: {format_number(remaining)} so'm."
         )
 
-    await record_payment(db_user["id"], rental_id, amount)
+    conn = await uow.connection()
+    await record_payment(db_user["id"], rental_id, amount, conn=conn)
     debt = round(remaining - amount, 2)
 
     if debt > 0:
@@ -658,12 +755,15 @@ async def payment_partial_amount(message: Message, state: FSMContext, db_user):
             customer_name=data.get("customer_name", ""),
             customer_phone=data.get("customer_phone", ""),
             amount=debt,
-            rental_id=rental_id
+            rental_id=rental_id,
+            conn=conn
         )
 
-    fully_returned = await is_fully_returned(rental_id)
+    fully_returned = await _is_fully_returned(data, rental_id, conn)
+    if fully_returned:
+        await close_rental(rental_id, conn=conn)
+    await uow.commit()
     if fully_returned:
-        await close_rental(rental_id)
         status = "📑 Ijara yopildi."
     else:
         status = "📑 Ijara faol — asboblar hali qaytarilmagan."
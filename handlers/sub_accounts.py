@@ -4,17 +4,19 @@ handlers/sub_accounts.py
 Allows a regular user (shop owner) to manage up to 4 extra Telegram accounts
 that can access the bot under the same user/shop profile.
 """
-from aiogram import Router, F
+from aiogram import Router
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
 from handlers.states import SubAccountFSM
+from handlers.buttons import Button
 from services.user_service import (
     get_sub_accounts, add_sub_account, remove_sub_account, MAX_SUB_ACCOUNTS
 )
 from middlewares.role_middleware import _invalidate
 from utils.texts import *
 from utils.keyboards import sub_accounts_keyboard, cancel_keyboard, user_main_menu
+from utils.callback_data import SubAccountAdd, SubAccountDelete
 
 router = Router()
 
@@ -30,7 +32,7 @@ def _format_list(sub_accounts: list) -> str:
 
 # ── Main sub-accounts screen ──────────────────────────────────────────────────
 
-@router.message(F.text == BTN_SUB_ACCOUNTS)
+@router.message(Button(BTN_SUB_ACCOUNTS))
 async def sub_accounts_menu(message: Message, db_user, is_super_admin: bool):
     if is_super_admin or db_user is None or not db_user["is_active"]:
         return
@@ -53,7 +55,7 @@ async def sub_accounts_menu(message: Message, db_user, is_super_admin: bool):
         for sa in subs:
             builder.button(
                 text=f"🗑 TG ID: {sa['telegram_id']}",
-                callback_data=f"sub_del:{sa['id']}"
+                callback_data=SubAccountDelete(id=sa["id"])
             )
         builder.adjust(1)
         keyboard = builder.as_markup()
@@ -63,7 +65,7 @@ async def sub_accounts_menu(message: Message, db_user, is_super_admin: bool):
 
 # ── Add sub-account flow ──────────────────────────────────────────────────────
 
-@router.callback_query(F.data == "sub_add")
+@router.callback_query(SubAccountAdd.filter(), flags={"ack": "manual"})
 async def cb_sub_add(callback: CallbackQuery, state: FSMContext, db_user, is_super_admin: bool):
     if is_super_admin or db_user is None or not db_user["is_active"]:
         await callback.answer()
@@ -111,13 +113,14 @@ async def process_sub_tg_id(message: Message, state: FSMContext, db_user):
 
 # ── Delete sub-account ────────────────────────────────────────────────────────
 
-@router.callback_query(F.data.startswith("sub_del:"))
-async def cb_sub_delete(callback: CallbackQuery, db_user, is_super_admin: bool):
+@router.callback_query(SubAccountDelete.filter())
+async def cb_sub_delete(callback: CallbackQuery, callback_data: SubAccountDelete,
+                        db_user, is_super_admin: bool):
     if is_super_admin or db_user is None or not db_user["is_active"]:
         await callback.answer()
         return
 
-    sub_id = int(callback.data.split(":")[1])
+    sub_id = callback_data.id
 
     # Find the telegram_id before deleting so we can invalidate cache
     subs_before = await get_sub_accounts(db_user["id"])
@@ -149,7 +152,7 @@ async def cb_sub_delete(callback: CallbackQuery, db_user, is_super_admin: bool):
         for sa in subs:
             builder.button(
                 text=f"🗑 TG ID: {sa['telegram_id']}",
-                callback_data=f"sub_del:{sa['id']}"
+                callback_data=SubAccountDelete(id=sa["id"])
             )
         builder.adjust(1)
         keyboard = builder.as_markup()
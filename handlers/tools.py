@@ -3,16 +3,23 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from handlers.states import AddToolFSM, EditToolFSM, SearchToolFSM
+from handlers.buttons import Button
 from services.tool_service import (
-    get_tools, get_all_tools, search_tools, get_tool_by_id,
+    get_tools, count_tools, get_catalog, search_tools, get_tool_by_id,
     create_tool, update_tool_name, update_tool_qty, update_tool_price, delete_tool
 )
 from utils.texts import *
 from utils.keyboards import (
     tools_menu, user_main_menu, cancel_keyboard, back_keyboard,
-    tools_list_keyboard, edit_tool_fields_keyboard, confirm_delete_keyboard
+    tools_list_keyboard, edit_tool_fields_keyboard, confirm_delete_keyboard,
+    pagination_row, offset_pagination_row, pagination_keyboard
 )
 from utils.helpers import validate_positive_int, validate_positive_float, format_number
+from utils.callback_data import (
+    ToolsPage, ToolSearchPage, ToolPick, ToolPurpose, ToolEditField, ToolDelete,
+)
+from database import get_ro_db
+from services.search import SEARCH_LIMIT
 
 router = Router()
 PAGE_SIZE = 10
@@ -24,22 +31,21 @@ def check_user(db_user):
 
 # ===== NAVIGATION =====
 
-@router.message(F.text == BTN_TOOLS)
+@router.message(Button(BTN_TOOLS))
 async def tools_menu_handler(message: Message, db_user):
     if not check_user(db_user):
-        await message.answer(MSG_NO_ACCESS)
-        return
-    await message.answer(MSG_TOOLS_MENU, reply_markup=tools_menu())
+        return message.answer(MSG_NO_ACCESS)
+    return message.answer(MSG_TOOLS_MENU, reply_markup=tools_menu())
 
 
-@router.message(F.text == BTN_BACK)
+@router.message(Button(BTN_BACK))
 async def back_handler(message: Message, state: FSMContext, db_user, is_super_admin: bool):
     await state.clear()
     if is_super_admin:
         from utils.keyboards import admin_main_menu
-        await message.answer(MSG_ADMIN_WELCOME, reply_markup=admin_main_menu())
+        return message.answer(MSG_ADMIN_WELCOME, reply_markup=admin_main_menu())
     elif db_user and db_user["is_active"]:
-        await message.answer(
+        return message.answer(
             MSG_USER_WELCOME.format(shop_name=db_user["shop_name"]),
             reply_markup=user_main_menu()
         )
@@ -47,12 +53,12 @@ async def back_handler(message: Message, state: FSMContext, db_user, is_super_ad
 
 # ===== ADD TOOL =====
 
-@router.message(F.text == BTN_ADD_TOOL)
+@router.message(Button(BTN_ADD_TOOL))
 async def add_tool_start(message: Message, state: FSMContext, db_user):
     if not check_user(db_user):
         return
     await state.set_state(AddToolFSM.name)
-    await message.answer(MSG_TOOL_NAME, reply_markup=cancel_keyboard())
+    return message.answer(MSG_TOOL_NAME, reply_markup=cancel_keyboard())
 
 
 @router.message(AddToolFSM.name)
@@ -109,60 +115,129 @@ async def add_tool_price(message: Message, state: FSMContext, db_user):
 
 # ===== TOOL LIST =====
 
-@router.message(F.text == BTN_TOOL_LIST)
+async def _tools_page(user_id: int, page_no: int, total: int,
+                      after: int = None, before: int = None, conn=None):
+    """Text + inline keyboard for one page of the tool list, or None if empty."""
+    async with get_ro_db(conn, snapshot=True) as conn:
+        page = await get_tools(user_id, after=after, before=before, limit=PAGE_SIZE, conn=conn)
+        if not page.rows and (after or before):
+            # Anchor row vanished meanwhile — start over from the first page
+            page_no, total = 1, await count_tools(user_id, conn=conn)
+            page = await get_tools(user_id, limit=PAGE_SIZE, conn=conn)
+    if not page.rows:
+        return None
+    total_pages = max(math.ceil(total / PAGE_SIZE), 1)
+    text = f"🔧 Asboblar ro'yxati ({total} ta, sahifa {page_no}/{total_pages}):\n\n"
+    for t in page.rows:
+        text += f"• {t['name']} | x{t['quantity']} | {format_number(t['daily_price'])} so'm/kun\n"
+    nav = pagination_row(ToolsPage, page_no, total, page.rows[0]["id"], page.rows[-1]["id"],
+                         page.has_prev, page.has_next)
+    return text, pagination_keyboard(nav)
+
+
+@router.message(Button(BTN_TOOL_LIST))
 async def tool_list_handler(message: Message, db_user, state: FSMContext):
     if not check_user(db_user):
         return
-    await state.set_state(SearchToolFSM.query)
-    await state.update_data(list_mode=True)
-    tools, total = await get_tools(db_user["id"], limit=PAGE_SIZE)
-    if not tools:
-        await state.clear()
+    await state.clear()
+    async with get_ro_db(snapshot=True) as conn:   # count and page agree
+        total = await count_tools(db_user["id"], conn=conn)
+        rendered = await _tools_page(db_user["id"], 1, total, conn=conn)
+    if not rendered:
         await message.answer(MSG_TOOL_LIST_EMPTY, reply_markup=tools_menu())
         return
-    text = f"🔧 Asboblar ro'yxati ({total} ta):\n\n"
-    for t in tools:
-        text += f"• {t['name']} | x{t['quantity']} | {format_number(t['daily_price'])} so'm/kun\n"
-    await state.clear()
-    await message.answer(text, reply_markup=tools_menu())
+    text, markup = rendered
+    await message.answer(text, reply_markup=markup)
     await message.answer(f"🔍 Qidirish uchun nom kiriting yoki {BTN_BACK}:", reply_markup=back_keyboard())
     await state.set_state(SearchToolFSM.query)
 
 
+@router.callback_query(ToolsPage.filter())
+async def cb_tools_page(callback: CallbackQuery, callback_data: ToolsPage, db_user):
+    if not check_user(db_user):
+        return await callback.answer()
+    nav = callback_data
+    rendered = await _tools_page(
+        db_user["id"], nav.page, nav.total,
+        after=nav.anchor if nav.forward else None,
+        before=None if nav.forward else nav.anchor,
+    )
+    if rendered:
+        text, markup = rendered
+        await callback.message.edit_text(text, reply_markup=markup)
+    else:
+        await callback.message.edit_text(MSG_TOOL_LIST_EMPTY)
+    await callback.answer()
+
+
 @router.message(SearchToolFSM.query)
 async def search_tool_result(message: Message, state: FSMContext, db_user):
     if message.text == BTN_BACK:
         await state.clear()
         await message.answer(MSG_TOOLS_MENU, reply_markup=tools_menu())
         return
-    tools = await search_tools(db_user["id"], message.text.strip())
+    query = message.text.strip()
+    page = await search_tools(db_user["id"], query)
     await state.clear()
-    if not tools:
+    if not page.rows:
         await message.answer(MSG_NOT_FOUND, reply_markup=tools_menu())
         return
-    text = f"🔍 Natijalar:\n\n"
-    for t in tools:
-        text += f"• {t['name']} | x{t['quantity']} | {format_number(t['daily_price'])} so'm/kun\n"
-    await message.answer(text, reply_markup=tools_menu())
+    text, markup = _search_page(page, 0)
+    if page.has_next:
+        # Keep the query (no state) so ◀️/▶️ can fetch other pages
+        await state.update_data(search_query=query)
+        await message.answer(text, reply_markup=markup)
+    else:
+        await message.answer(text, reply_markup=tools_menu())
+
+
+def _search_page(page, offset: int):
+    """Text + ◀️/▶️ keyboard for one page of tool search hits."""
+    text = MSG_SEARCH_PAGE.format(page=offset // SEARCH_LIMIT + 1) + "\n\n"
+    text += "".join(
+        f"• {t['name']} | x{t['quantity']} | {format_number(t['daily_price'])} so'm/kun\n"
+        for t in page.rows
+    )
+    nav = offset_pagination_row(ToolSearchPage, offset, SEARCH_LIMIT, page.has_prev, page.has_next)
+    return text, pagination_keyboard(nav)
+
+
+@router.callback_query(ToolSearchPage.filter())
+async def cb_search_tool_page(callback: CallbackQuery, callback_data: ToolSearchPage,
+                              state: FSMContext, db_user):
+    if not check_user(db_user):
+        return await callback.answer()
+    offset = callback_data.offset
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        return await callback.answer()
+    page = await search_tools(db_user["id"], query, offset=offset)
+    if page.rows:
+        text, markup = _search_page(page, offset)
+        await callback.message.edit_text(text, reply_markup=markup)
+    else:
+        await callback.message.edit_text(MSG_NOT_FOUND)
+    await callback.answer()
 
 
 # ===== EDIT TOOL =====
 
-@router.message(F.text == BTN_EDIT_TOOL)
+@router.message(Button(BTN_EDIT_TOOL))
 async def edit_tool_start(message: Message, state: FSMContext, db_user):
     if not check_user(db_user):
         return
-    tools = await get_all_tools(db_user["id"])
-    if not tools:
+    catalog = await get_catalog(db_user["id"])
+    if not catalog.tools:
         await message.answer(MSG_TOOL_LIST_EMPTY, reply_markup=tools_menu())
         return
     await state.set_state(EditToolFSM.select_tool)
-    await message.answer(MSG_SELECT_TOOL, reply_markup=tools_list_keyboard(tools, "tool_edit"))
+    await message.answer(MSG_SELECT_TOOL, reply_markup=tools_list_keyboard(
+        catalog.tools, ToolPurpose.edit, version=catalog.version))
 
 
-@router.callback_query(F.data.startswith("tool_edit:"))
-async def cb_edit_tool_select(callback: CallbackQuery, state: FSMContext):
-    tool_id = int(callback.data.split(":")[1])
+@router.callback_query(ToolPick.filter(F.purpose == ToolPurpose.edit))
+async def cb_edit_tool_select(callback: CallbackQuery, callback_data: ToolPick, state: FSMContext):
+    tool_id = callback_data.id
     tool = await get_tool_by_id(tool_id)
     if not tool:
         await callback.answer("Topilmadi")
@@ -178,11 +253,11 @@ async def cb_edit_tool_select(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("tool_edit_field:"))
-async def cb_edit_tool_field(callback: CallbackQuery, state: FSMContext):
-    parts = callback.data.split(":")
-    field = parts[1]
-    tool_id = int(parts[2])
+@router.callback_query(ToolEditField.filter())
+async def cb_edit_tool_field(callback: CallbackQuery, callback_data: ToolEditField,
+                             state: FSMContext):
+    field = callback_data.field.value
+    tool_id = callback_data.id
     await state.update_data(edit_field=field, editing_tool_id=tool_id)
     await state.set_state(EditToolFSM.new_value)
     prompts = {"name": "Yangi nom kiriting:", "qty": "Yangi miqdor kiriting:", "price": "Yangi narx kiriting:"}
@@ -225,30 +300,31 @@ async def edit_tool_value(message: Message, state: FSMContext, db_user):
 
 # ===== DELETE TOOL =====
 
-@router.message(F.text == BTN_DELETE_TOOL)
+@router.message(Button(BTN_DELETE_TOOL))
 async def delete_tool_start(message: Message, state: FSMContext, db_user):
     if not check_user(db_user):
         return
-    tools = await get_all_tools(db_user["id"])
-    if not tools:
+    catalog = await get_catalog(db_user["id"])
+    if not catalog.tools:
         await message.answer(MSG_TOOL_LIST_EMPTY, reply_markup=tools_menu())
         return
-    await message.answer(MSG_SELECT_TOOL, reply_markup=tools_list_keyboard(tools, "tool_del"))
+    await message.answer(MSG_SELECT_TOOL, reply_markup=tools_list_keyboard(
+        catalog.tools, ToolPurpose.delete, version=catalog.version))
 
 
-@router.callback_query(F.data.startswith("tool_del:"))
-async def cb_delete_tool_confirm(callback: CallbackQuery):
-    tool_id = int(callback.data.split(":")[1])
+@router.callback_query(ToolPick.filter(F.purpose == ToolPurpose.delete))
+async def cb_delete_tool_confirm(callback: CallbackQuery, callback_data: ToolPick):
+    tool_id = callback_data.id
     await callback.message.answer(
         MSG_CONFIRM_DELETE,
-        reply_markup=confirm_delete_keyboard("tool_del_final", tool_id)
+        reply_markup=confirm_delete_keyboard(ToolDelete, tool_id)
     )
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("tool_del_final:confirm:"))
-async def cb_delete_tool_do(callback: CallbackQuery):
-    tool_id = int(callback.data.split(":")[2])
+@router.callback_query(ToolDelete.filter(F.yes))
+async def cb_delete_tool_do(callback: CallbackQuery, callback_data: ToolDelete):
+    tool_id = callback_data.id
     success = await delete_tool(tool_id)
     if success:
         await callback.message.edit_text(MSG_TOOL_DELETED)
@@ -257,7 +333,7 @@ async def cb_delete_tool_do(callback: CallbackQuery):
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("tool_del_final:cancel:"))
+@router.callback_query(ToolDelete.filter(~F.yes))
 async def cb_delete_tool_cancel(callback: CallbackQuery):
     await callback.message.edit_text(MSG_CANCELLED)
     await callback.answer()
@@ -2,54 +2,96 @@
 main.py — Start the bot.
 
 Just run:  python main.py
-That's it. No webhook, no Redis, no Docker needed.
+That's it. No Redis, no Docker needed.
 
-Uses PostgreSQL for concurrent-safe database access.
+BOT_MODE=polling (default) long-polls Telegram. BOT_MODE=webhook serves an
+aiohttp endpoint instead — see run_webhook(). WORKERS=N (N > 1) splits the
+work over N processes by chat — see sharding.py.
+
+Uses PostgreSQL for concurrent-safe database access and to keep FSM
+state (half-finished dialogs) across restarts.
 """
 import asyncio
 import sys
 import os
 
+from aiohttp import web
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from loguru import logger
 
-from config import BOT_TOKEN
-from database import init_db, close_db
-from handlers import main_router
-from middlewares import RoleMiddleware
+from app import (
+    ALLOWED_UPDATES, create_bot, create_dispatcher, start_services, stop_services,
+    wait_for_stop_signal,
+)
+from config import (
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_DRAIN_TIMEOUT, WORKERS,
+)
+from sharding import run_front
 
 
-async def main():
-    if not BOT_TOKEN:
-        raise ValueError("BOT_TOKEN is not set in .env file!")
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """
+    Serve updates over HTTP until SIGINT/SIGTERM.
+
+    Updates are handled inside the request, so a handler that *returns* its
+    reply (see handlers/common.py) has it sent back in the HTTP response.
+    Requests without the right secret token get 401. On shutdown the
+    listener closes first, then in-flight updates get WEBHOOK_DRAIN_TIMEOUT
+    seconds to finish before the pool and storage are closed.
 
-    # Set up database pool
-    await init_db()
-    logger.info("✅ Database ready")
+    Run one instance per bot: updates of a chat are serialized in-process
+    (ChatIsolation), so two instances behind one URL could run a double tap
+    twice. Scale with WORKERS=N instead.
+    """
+    if not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET is not set in .env file!")
 
-    # Bot + Dispatcher
-    bot = Bot(
-        token=BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-    )
-    dp = Dispatcher(storage=MemoryStorage())
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, SimpleRequestHandler(
+        dp, bot, handle_in_background=False, secret_token=WEBHOOK_SECRET))
+    setup_application(app, dp, bot=bot)
 
-    # Middleware
-    dp.message.middleware(RoleMiddleware())
-    dp.callback_query.middleware(RoleMiddleware())
+    runner = web.AppRunner(app, shutdown_timeout=WEBHOOK_DRAIN_TIMEOUT)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                              secret_token=WEBHOOK_SECRET, allowed_updates=ALLOWED_UPDATES)
+    logger.info(f"🤖 Bot started (webhook on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH})")
+
+    try:
+        await wait_for_stop_signal()
+    finally:
+        # The webhook stays registered: Telegram queues updates until we're back
+        logger.info("Draining in-flight updates…")
+        await runner.cleanup()
+
+
+async def main():
+    bot = create_bot()
 
-    # Routers
-    dp.include_router(main_router)
+    if WORKERS > 1:
+        try:
+            await run_front(bot, WORKERS)
+        finally:
+            await bot.session.close()
+            logger.info("Bot stopped.")
+        return
 
-    logger.info("🤖 Bot started (polling)")
+    await start_services()
+    dp = create_dispatcher()
     try:
-        await dp.start_polling(bot, allowed_updates=["message", "callback_query"])
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            logger.info("🤖 Bot started (polling)")
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=ALLOWED_UPDATES)
     finally:
+        await stop_services(dp)
         await bot.session.close()
-        await close_db()
         logger.info("Bot stopped.")
 
 
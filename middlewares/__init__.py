@@ -1,3 +1,10 @@
 from .role_middleware import RoleMiddleware
+from .db_middleware import DbSessionMiddleware
+from .session_middleware import SessionExpiryMiddleware
+from .execution_middleware import ChatIsolation, DeadlineMiddleware
+from .ack_middleware import CallbackAckMiddleware
 
-__all__ = ["RoleMiddleware"]
+__all__ = [
+    "RoleMiddleware", "DbSessionMiddleware", "SessionExpiryMiddleware",
+    "ChatIsolation", "DeadlineMiddleware", "CallbackAckMiddleware",
+]
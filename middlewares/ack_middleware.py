@@ -0,0 +1,125 @@
+"""
+Answer callback queries right away instead of after the handler's DB work.
+
+Until a callback query is answered the user's button shows a spinner, and
+people re-tap — each tap is another update. CallbackAckMiddleware gives the
+handler a short grace window: if it answers within it (a quick "Topilmadi",
+an alert), that answer goes out as usual; otherwise the middleware answers
+with nothing and lets the handler carry on. Any answer the handler sends
+after that is dropped — a query can only be answered once.
+
+Handlers that may end in an alert after slow work opt out of the early
+answer with a flag; they are still answered when they return without
+having done so:
+
+    @router.callback_query(SomeData.filter(), flags={"ack": "manual"})
+
+Answers are seen on the way out through a bot session middleware, which
+install() registers on dispatcher startup.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Awaitable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import NextRequestMiddlewareType
+from aiogram.dispatcher.flags import get_flag
+from aiogram.methods import AnswerCallbackQuery, TelegramMethod
+from aiogram.types import TelegramObject, CallbackQuery
+from loguru import logger
+
+_RECENT = 1000   # latencies kept for the percentiles
+
+
+class CallbackAckMiddleware(BaseMiddleware):
+    """
+    Register as the first inner middleware of dp.callback_query, so the
+    measured latency includes the user lookup and the other middlewares.
+    """
+
+    def __init__(self, grace: float):
+        self.grace = grace
+        self._open: dict[str, float] = {}      # query id → received at
+        self._answered: set[str] = set()
+        self._timers: set[asyncio.Task] = set()
+        self.callbacks = 0
+        self.auto = 0
+        self.late = 0
+        self._latencies: deque[float] = deque(maxlen=_RECENT)
+        self._latency_max = 0.0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: dict[str, Any],
+    ) -> Any:
+        bot: Bot = data["bot"]
+        self.callbacks += 1
+        self._open[event.id] = time.monotonic()
+        timer = None
+        if get_flag(data, "ack") != "manual":
+            timer = asyncio.get_running_loop().call_later(
+                self.grace, self._ack_in_background, bot, event.id)
+        try:
+            return await handler(event, data)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            # The handler never answered (or failed) — don't leave it spinning
+            await self._ack(bot, event.id)
+            self._open.pop(event.id, None)
+            self._answered.discard(event.id)
+
+    def _ack_in_background(self, bot: Bot, query_id: str) -> None:
+        task = asyncio.create_task(self._ack(bot, query_id))
+        self._timers.add(task)
+        task.add_done_callback(self._timers.discard)
+
+    async def _ack(self, bot: Bot, query_id: str) -> None:
+        if query_id in self._answered or query_id not in self._open:
+            return
+        self.auto += 1
+        try:
+            await bot(AnswerCallbackQuery(callback_query_id=query_id))
+        except Exception as e:
+            # Too old (the update sat in a queue) — nothing left to stop spinning
+            logger.debug(f"Callback {query_id} not acknowledged: {e}")
+
+    async def install(self, bot: Bot) -> None:
+        """Startup hook: watch this bot's answerCallbackQuery calls."""
+        bot.session.middleware(self._on_request)
+
+    async def _on_request(
+        self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod
+    ) -> Any:
+        if isinstance(method, AnswerCallbackQuery):
+            query_id = method.callback_query_id
+            received = self._open.get(query_id)
+            if received is not None:
+                if query_id in self._answered:
+                    self.late += 1
+                    if method.text:
+                        logger.debug(f"Callback {query_id}: late answer {method.text!r} dropped")
+                    return True
+                self._answered.add(query_id)
+                latency = time.monotonic() - received
+                self._latencies.append(latency)
+                self._latency_max = max(self._latency_max, latency)
+        return await make_request(bot, method)
+
+    def stats(self) -> dict[str, Any]:
+        recent = sorted(self._latencies)
+
+        def pct(p: float) -> float:
+            return round(recent[min(int(len(recent) * p), len(recent) - 1)] * 1000, 1) if recent else 0.0
+
+        return {
+            "callbacks": self.callbacks,
+            "auto_answered": self.auto,
+            "late_dropped": self.late,
+            "latency_p50_ms": pct(0.5),
+            "latency_p95_ms": pct(0.95),
+            "latency_max_ms": round(self._latency_max * 1000, 1),
+        }
@@ -0,0 +1,29 @@
+from typing import Any, Callable, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from database import UnitOfWork
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Puts a lazy UnitOfWork into handler data as `uow`.
+    Register on dp.update so every middleware and handler of one update
+    shares the same connection and transaction.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        uow = UnitOfWork()
+        data["uow"] = uow
+        try:
+            result = await handler(event, data)
+        except BaseException:
+            await uow.rollback()
+            raise
+        await uow.commit()
+        return result
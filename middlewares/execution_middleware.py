@@ -0,0 +1,129 @@
+"""
+Per-chat serialized, cross-chat parallel update execution.
+
+ChatIsolation plugs into aiogram's FSM middleware (Dispatcher(events_isolation=…)),
+which takes the lock *before* loading the chat's state. So a double tap on
+"confirm" runs after the first tap has finished and sees the state it left
+behind, instead of both passing the same state filter and creating two
+rentals / returns / payments. Different chats never wait for each other,
+except for the global limit on how many updates run at once.
+
+DeadlineMiddleware cancels an update whose handlers run too long; the unit
+of work rolls back as usual. The final COMMIT is outside the deadline, and
+a COMMIT a handler has started always completes (UnitOfWork.commit).
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Awaitable, Callable, Hashable
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+from aiogram.types import TelegramObject, Update
+from loguru import logger
+
+
+class _ChatLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0   # holders + waiters; the entry is dropped at zero
+
+
+class ChatIsolation(BaseEventIsolation):
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+        self._locks: dict[Hashable, _ChatLock] = {}
+        self.running = 0
+        self.waiting_chat = 0     # queued behind an earlier update of the same chat
+        self.waiting_slot = 0     # queued for a global slot
+        self.max_waiting = 0
+        self.total = 0
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = _ChatLock()
+        entry.users += 1
+        try:
+            # Chat first, then a global slot — updates queued behind their own
+            # chat must not sit on slots other chats could use
+            self.waiting_chat += 1
+            self._note_depth()
+            try:
+                await entry.lock.acquire()
+            finally:
+                self.waiting_chat -= 1
+            try:
+                self.waiting_slot += 1
+                self._note_depth()
+                try:
+                    await self._slots.acquire()
+                finally:
+                    self.waiting_slot -= 1
+                self.running += 1
+                self.total += 1
+                try:
+                    yield
+                finally:
+                    self.running -= 1
+                    self._slots.release()
+            finally:
+                entry.lock.release()
+        finally:
+            entry.users -= 1
+            if entry.users == 0:
+                del self._locks[key]
+
+    def _note_depth(self) -> None:
+        depth = self.waiting_chat + self.waiting_slot
+        if depth > self.max_waiting:
+            self.max_waiting = depth
+
+    async def close(self) -> None:
+        self._locks.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "waiting_chat": self.waiting_chat,
+            "waiting_slot": self.waiting_slot,
+            "max_waiting": self.max_waiting,
+            "chats": len(self._locks),
+            "total": self.total,
+        }
+
+
+class DeadlineMiddleware(BaseMiddleware):
+    """
+    Register on dp.update (outer) after DbSessionMiddleware: the deadline
+    covers the handlers but not the commit that follows them, so work the
+    user was already told about is never rolled back by a late timeout.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.timeouts = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        started = time.monotonic()
+        try:
+            async with asyncio.timeout(self.seconds):
+                return await handler(event, data)
+        except TimeoutError:
+            self.timeouts += 1
+            update_id = event.update_id if isinstance(event, Update) else None
+            logger.warning(
+                f"Update {update_id} cancelled after {time.monotonic() - started:.1f}s "
+                f"(deadline {self.seconds}s), not applied"
+            )
+            raise
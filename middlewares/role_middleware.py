@@ -1,22 +1,70 @@
-import time
 from typing import Any, Callable, Awaitable
 
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject, Message, CallbackQuery
-from config import SUPER_ADMIN_ID
-from services.user_service import get_user_by_telegram_id, get_user_by_sub_telegram_id
+from config import SUPER_ADMIN_ID, ROLE_CACHE_MAX, ROLE_CACHE_TTL, ROLE_CACHE_NEGATIVE_TTL
+from database.invalidation import subscribe
+from services.user_service import resolve_principal
+from utils.cache import TTLCache, MISSING
+from utils.singleflight import SingleFlight
 from loguru import logger
 
-# Simple in-memory cache: {telegram_id: (db_user, expire_timestamp)}
+# Bounded LRU cache: {telegram_id: db_user or None}
 # Avoids a DB query on every single message/callback.
-# TTL = 30 seconds — user data (name, active status) rarely changes.
-_cache: dict[int, tuple] = {}
-_CACHE_TTL = 30  # seconds
+# Unknown telegram ids (None) expire sooner so they don't crowd out shops.
+_cache = TTLCache(ROLE_CACHE_MAX, ROLE_CACHE_TTL, negative_ttl=ROLE_CACHE_NEGATIVE_TTL)
+# Concurrent misses for one telegram_id share a single DB lookup
+_flight = SingleFlight("users")
+# Bumped on every invalidation so a lookup that started before it
+# doesn't put the stale row back into the cache
+_generation = 0
 
 
 def _invalidate(telegram_id: int):
-    """Call this after activate/deactivate so the cache is cleared immediately."""
-    _cache.pop(telegram_id, None)
+    """Call this after adding/removing a sub-account so the cache is cleared immediately."""
+    global _generation
+    _generation += 1
+    _cache.pop(telegram_id)
+    _flight.forget(telegram_id)
+
+
+def _invalidate_user(user_id: int):
+    """Call this after any write to a users row — drops the owner and all sub-accounts."""
+    global _generation
+    _generation += 1
+    _cache.pop_where(lambda u: u is not None and u["id"] == user_id)
+    # A lookup in flight is for a telegram id that isn't cached, so there's no
+    # telling whose it is — any of them may be carrying this user's old row
+    _flight.forget_all()
+
+
+def _invalidate_all():
+    global _generation
+    _generation += 1
+    _cache.clear()
+    _flight.forget_all()
+
+
+# Writes made by other bot processes arrive over LISTEN/NOTIFY
+subscribe("tg", lambda key: _invalidate(int(key)) if key is not None else _invalidate_all())
+subscribe("user", lambda key: _invalidate_user(int(key)) if key is not None else _invalidate_all())
+
+
+def cache_stats() -> dict:
+    return {**_cache.stats(), **_flight.stats()}
+
+
+async def _load(telegram_id: int):
+    generation = _generation
+    # Primary account or sub-account — one round trip either way
+    db_user = await resolve_principal(telegram_id)
+    if generation == _generation:
+        _cache.set(telegram_id, db_user)
+    logger.debug(
+        f"User {telegram_id} fetched from DB | role={db_user['role'] if db_user else None} "
+        f"active={db_user['is_active'] if db_user else False}"
+    )
+    return db_user
 
 
 class RoleMiddleware(BaseMiddleware):
@@ -37,15 +85,11 @@ class RoleMiddleware(BaseMiddleware):
             data["is_super_admin"] = (tg_id == SUPER_ADMIN_ID)
 
             cached = _cache.get(tg_id)
-            if cached and time.monotonic() < cached[1]:
-                data["db_user"] = cached[0]
+            if cached is not MISSING:
+                data["db_user"] = cached
             else:
-                db_user = await get_user_by_telegram_id(tg_id)
-                # If not found as primary, check sub-accounts
-                if db_user is None:
-                    db_user = await get_user_by_sub_telegram_id(tg_id)
-                _cache[tg_id] = (db_user, time.monotonic() + _CACHE_TTL)
-                data["db_user"] = db_user
-                logger.debug(f"User {tg_id} fetched from DB | active={db_user['is_active'] if db_user else False}")
+                # Own pooled connection: the lookup may be shared by other
+                # updates, so it must not ride on this update's transaction
+                data["db_user"] = await _flight.do(tg_id, lambda: _load(tg_id))
 
         return await handler(event, data)
@@ -0,0 +1,33 @@
+from typing import Any, Callable, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.types import TelegramObject, Message, CallbackQuery
+
+from utils.session_expiry import IdleExpiryStorage
+from utils.texts import MSG_SESSION_EXPIRED
+
+
+class SessionExpiryMiddleware(BaseMiddleware):
+    """
+    Tells the user, once, that their half-finished flow was dropped for
+    being idle — otherwise their next reply (a quantity, a phone…) just
+    silently matches nothing.
+    """
+
+    def __init__(self, storage: IdleExpiryStorage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        state: FSMContext | None = data.get("state")
+        if state is not None and self.storage.pop_expired(state.key):
+            if isinstance(event, Message):
+                await event.answer(MSG_SESSION_EXPIRED)
+            elif isinstance(event, CallbackQuery) and event.message:
+                await event.message.answer(MSG_SESSION_EXPIRED)
+        return await handler(event, data)
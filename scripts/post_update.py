@@ -0,0 +1,50 @@
+"""
+scripts/post_update.py
+
+POST recorded Telegram updates to a locally running webhook (BOT_MODE=webhook,
+WEBHOOK_URL empty) and print what the bot answered inline.
+
+    python -m scripts.post_update updates/start.json
+    python -m scripts.post_update --url http://127.0.0.1:8080/webhook a.json b.json
+
+Each file holds one update object or a list of them, e.g. from getUpdates
+or the bot log:
+
+    {"update_id": 1, "message": {"message_id": 1, "date": 0,
+     "chat": {"id": 804705356, "type": "private"},
+     "from": {"id": 804705356, "is_bot": false, "first_name": "Test"},
+     "text": "/start"}}
+
+Replies the handler sent with an API call go to the real chat as usual;
+only a returned reply shows up in the HTTP response printed here.
+"""
+import argparse
+import asyncio
+import json
+
+import aiohttp
+
+from config import WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET
+
+
+async def main(url: str, secret: str, paths: list[str]) -> None:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret}
+    async with aiohttp.ClientSession(headers=headers) as session:
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                updates = json.load(f)
+            for update in updates if isinstance(updates, list) else [updates]:
+                async with session.post(url, json=update) as resp:
+                    body = await resp.text()
+                print(f"── update {update.get('update_id')} → HTTP {resp.status}")
+                if body.strip():
+                    print(body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("files", nargs="+", help="JSON files with recorded updates")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.secret, args.files))
@@ -1,10 +1,14 @@
-from database import get_db
-from utils import now_utc
+import asyncpg
+from database import get_db, get_ro_db
+from services.pagination import Page, keyset_page
+from services.search import SEARCH_LIMIT, ranked_search
+from utils import now_utc, normalize_phone
 
 
 async def add_debt(user_id: int, customer_name: str, customer_phone: str,
-                   amount: float, rental_id: int = None):
-    async with get_db() as conn:
+                   amount: float, rental_id: int = None,
+                   conn: asyncpg.Connection | None = None):
+    async with get_db(conn) as conn:
         if rental_id is not None:
             existing = await conn.fetchrow(
                 "SELECT id, amount FROM debts WHERE user_id=$1 AND rental_id=$2 AND amount > 0",
@@ -13,48 +17,60 @@ async def add_debt(user_id: int, customer_name: str, customer_phone: str,
             if existing:
                 new_amount = round(float(existing["amount"]) + amount, 2)
                 await conn.execute(
-                    "UPDATE debts SET amount=$1, customer_name=$2, customer_phone=$3 WHERE id=$4",
-                    new_amount, customer_name, customer_phone, existing["id"]
+                    """UPDATE debts SET amount=$1, customer_name=$2, customer_phone=$3,
+                                         customer_phone_norm=$4 WHERE id=$5""",
+                    new_amount, customer_name, customer_phone,
+                    normalize_phone(customer_phone), existing["id"]
                 )
                 return
 
         await conn.execute(
-            """INSERT INTO debts (user_id, customer_name, customer_phone, amount, rental_id)
-               VALUES ($1,$2,$3,$4,$5)""",
-            user_id, customer_name, customer_phone, round(amount, 2), rental_id
+            """INSERT INTO debts (user_id, customer_name, customer_phone, customer_phone_norm,
+                                 amount, rental_id)
+               VALUES ($1,$2,$3,$4,$5,$6)""",
+            user_id, customer_name, customer_phone, normalize_phone(customer_phone),
+            round(amount, 2), rental_id
         )
 
 
-async def get_debts(user_id: int, offset: int = 0, limit: int = 10):
-    async with get_db() as conn:
-        rows  = await conn.fetch(
-            """SELECT * FROM debts WHERE user_id=$1 AND amount > 0
-               ORDER BY created_at DESC LIMIT $2 OFFSET $3""",
-            user_id, limit, offset
+async def get_debts(user_id: int, after: int | None = None, before: int | None = None,
+                    limit: int = 10, conn: asyncpg.Connection | None = None) -> Page:
+    """One page of open debts, newest first — ordered by (created_at, id)."""
+    async with get_ro_db(conn) as conn:
+        return await keyset_page(
+            conn, table="debts", where="user_id=$1 AND amount > 0", args=(user_id,),
+            key=("created_at", "id"), descending=True,
+            after=after, before=before, limit=limit
         )
-        count = await conn.fetchval(
+
+
+async def count_debts(user_id: int, conn: asyncpg.Connection | None = None) -> int:
+    async with get_ro_db(conn) as conn:
+        return await conn.fetchval(
             "SELECT COUNT(*) FROM debts WHERE user_id=$1 AND amount > 0", user_id
         )
-        return rows, count
 
 
-async def search_debts(user_id: int, query: str):
-    async with get_db() as conn:
-        q = f"%{query}%"
-        return await conn.fetch(
-            """SELECT * FROM debts WHERE user_id=$1 AND amount > 0
-               AND (customer_name ILIKE $2 OR customer_phone ILIKE $3)""",
-            user_id, q, q
+async def search_debts(user_id: int, query: str, offset: int = 0, limit: int = SEARCH_LIMIT,
+                       conn: asyncpg.Connection | None = None) -> Page:
+    """Open debts by customer name (ranked) or phone digits."""
+    async with get_ro_db(conn) as conn:
+        return await ranked_search(
+            conn, table="debts", where="user_id=$1 AND amount > 0", args=(user_id,),
+            text_cols=("customer_name",), phone_col="customer_phone",
+            norm_col="customer_phone_norm",
+            query=query, order="created_at DESC, id DESC", offset=offset, limit=limit
         )
 
 
-async def get_debt_by_id(debt_id: int):
-    async with get_db() as conn:
+async def get_debt_by_id(debt_id: int, conn: asyncpg.Connection | None = None):
+    async with get_ro_db(conn) as conn:
         return await conn.fetchrow("SELECT * FROM debts WHERE id=$1", debt_id)
 
 
-async def pay_debt(debt_id: int, amount: float) -> float:
-    async with get_db() as conn:
+async def pay_debt(debt_id: int, amount: float,
+                   conn: asyncpg.Connection | None = None) -> float:
+    async with get_db(conn) as conn:
         row = await conn.fetchrow(
             "SELECT amount FROM debts WHERE id=$1 FOR UPDATE", debt_id
         )
@@ -70,8 +86,8 @@ async def pay_debt(debt_id: int, amount: float) -> float:
         return remaining
 
 
-async def get_total_debt(user_id: int) -> float:
-    async with get_db() as conn:
+async def get_total_debt(user_id: int, conn: asyncpg.Connection | None = None) -> float:
+    async with get_ro_db(conn) as conn:
         val = await conn.fetchval(
             "SELECT COALESCE(SUM(amount), 0) FROM debts WHERE user_id=$1 AND amount > 0",
             user_id
@@ -79,8 +95,9 @@ async def get_total_debt(user_id: int) -> float:
         return round(float(val or 0), 2)
 
 
-async def record_payment(user_id: int, rental_id, amount: float):
-    async with get_db() as conn:
+async def record_payment(user_id: int, rental_id, amount: float,
+                         conn: asyncpg.Connection | None = None):
+    async with get_db(conn) as conn:
         await conn.execute(
             "INSERT INTO payments (user_id, rental_id, amount) VALUES ($1,$2,$3)",
             user_id, rental_id, round(amount, 2)
@@ -0,0 +1,50 @@
+"""
+Keyset (cursor) pagination shared by the list views.
+
+The cursor is just the id of the first/last row on the current page; its
+sort key is looked up in a sub-select, so callback data stays tiny and the
+query never scans skipped rows the way OFFSET does.
+"""
+from typing import NamedTuple
+
+import asyncpg
+
+
+class Page(NamedTuple):
+    rows: list
+    has_prev: bool
+    has_next: bool
+
+
+async def keyset_page(conn: asyncpg.Connection, *, table: str, where: str, args: tuple,
+                      key: tuple[str, ...], descending: bool,
+                      after: int | None = None, before: int | None = None,
+                      limit: int = 10) -> Page:
+    """
+    Fetch one page of `table` ordered by `key` (which must end with id).
+    after  — id of the last row of the previous page  → next page
+    before — id of the first row of the next page     → previous page
+    """
+    cols = ", ".join(key)
+    backwards = before is not None
+    anchor = before if backwards else after
+    # Walking backwards flips both the comparison and the sort direction
+    desc = descending != backwards
+    op = "<" if desc else ">"
+    order = ", ".join(f"{c} {'DESC' if desc else 'ASC'}" for c in key)
+
+    params = list(args)
+    sql = f"SELECT * FROM {table} WHERE {where}"
+    if anchor is not None:
+        params.append(anchor)
+        sql += f" AND ({cols}) {op} (SELECT {cols} FROM {table} WHERE id = ${len(params)})"
+    params.append(limit + 1)
+    sql += f" ORDER BY {order} LIMIT ${len(params)}"
+
+    rows = await conn.fetch(sql, *params)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+        return Page(rows, more, True)
+    return Page(rows, after is not None, more)
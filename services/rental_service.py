@@ -1,61 +1,88 @@
-from database import get_db
-from utils import now_utc, days_since
-from services.tool_service import decrease_tool_stock, increase_tool_stock
+import asyncpg
+from database import get_db, get_ro_db
+from services.pagination import Page, keyset_page
+from services.search import SEARCH_LIMIT, ranked_search
+from utils import now_utc, days_since, normalize_phone
+from database.invalidation import CHANNEL
+from services.tool_service import reserve_tool_stock, catalog_changed, InsufficientStockError
 
 
 async def create_rental(user_id: int, customer_name: str, customer_address: str,
-                        customer_phone: str, items: list[dict]) -> int | None:
+                        customer_phone: str, items: list[dict],
+                        conn: asyncpg.Connection | None = None) -> int | None:
+    """
+    Reserve stock for all items, then insert the rental and its items.
+    Two statements in total regardless of how many tools are rented; the
+    second one also NOTIFYs the shop's new catalog version.
+    Raises InsufficientStockError if any tool is short; returns None on
+    other DB failures.
+    """
     try:
-        async with get_db() as conn:
+        async with get_db(conn, savepoint=True) as conn:
+            await reserve_tool_stock(conn, items)
             rental_id = await conn.fetchval(
-                """INSERT INTO rentals (user_id, customer_name, customer_address, customer_phone)
-                   VALUES ($1,$2,$3,$4) RETURNING id""",
-                user_id, customer_name, customer_address, customer_phone
+                """WITH r AS (
+                       INSERT INTO rentals (user_id, customer_name, customer_address,
+                                            customer_phone, customer_phone_norm)
+                       VALUES ($1,$2,$3,$4,$8) RETURNING id
+                   ),
+                   i AS (
+                       INSERT INTO rental_items (rental_id, tool_id, quantity, daily_price)
+                       SELECT r.id, x.tool_id, x.qty, x.price
+                       FROM r, unnest($5::bigint[], $6::int[], $7::numeric[]) AS x(tool_id, qty, price)
+                   )
+                   SELECT id FROM r, pg_notify($9, $10)""",
+                user_id, customer_name, customer_address, customer_phone,
+                [i["tool_id"] for i in items],
+                [i["quantity"] for i in items],
+                [i["daily_price"] for i in items],
+                normalize_phone(customer_phone), CHANNEL, f"tools:{user_id}"
             )
-            for item in items:
-                ok = await decrease_tool_stock(conn, item["tool_id"], item["quantity"])
-                if not ok:
-                    raise ValueError(f"Not enough stock for tool {item['tool_id']}")
-                await conn.execute(
-                    """INSERT INTO rental_items (rental_id, tool_id, quantity, daily_price)
-                       VALUES ($1,$2,$3,$4)""",
-                    rental_id, item["tool_id"], item["quantity"], item["daily_price"]
-                )
-        return rental_id
+            catalog_changed(user_id)
+            return rental_id
+    except InsufficientStockError:
+        raise
     except Exception:
         return None
 
 
-async def get_active_rentals(user_id: int, offset: int = 0, limit: int = 10):
-    async with get_db() as conn:
-        rows  = await conn.fetch(
-            """SELECT * FROM rentals WHERE user_id=$1 AND status='active'
-               ORDER BY rental_date DESC LIMIT $2 OFFSET $3""",
-            user_id, limit, offset
+async def get_active_rentals(user_id: int, after: int | None = None, before: int | None = None,
+                             limit: int = 10, conn: asyncpg.Connection | None = None) -> Page:
+    """One page of active rentals, newest first — ordered by (rental_date, id)."""
+    async with get_ro_db(conn) as conn:
+        return await keyset_page(
+            conn, table="rentals", where="user_id=$1 AND status='active'", args=(user_id,),
+            key=("rental_date", "id"), descending=True,
+            after=after, before=before, limit=limit
         )
-        count = await conn.fetchval(
+
+
+async def count_active_rentals(user_id: int, conn: asyncpg.Connection | None = None) -> int:
+    async with get_ro_db(conn) as conn:
+        return await conn.fetchval(
             "SELECT COUNT(*) FROM rentals WHERE user_id=$1 AND status='active'", user_id
         )
-        return rows, count
 
 
-async def search_rentals(user_id: int, query: str):
-    async with get_db() as conn:
-        q = f"%{query}%"
-        return await conn.fetch(
-            """SELECT * FROM rentals WHERE user_id=$1 AND status='active'
-               AND (customer_name ILIKE $2 OR customer_phone ILIKE $3)""",
-            user_id, q, q
+async def search_rentals(user_id: int, query: str, offset: int = 0, limit: int = SEARCH_LIMIT,
+                         conn: asyncpg.Connection | None = None) -> Page:
+    """Active rentals by customer name (ranked) or phone digits."""
+    async with get_ro_db(conn) as conn:
+        return await ranked_search(
+            conn, table="rentals", where="user_id=$1 AND status='active'", args=(user_id,),
+            text_cols=("customer_name",), phone_col="customer_phone",
+            norm_col="customer_phone_norm",
+            query=query, order="rental_date DESC, id DESC", offset=offset, limit=limit
         )
 
 
-async def get_rental_by_id(rental_id: int):
-    async with get_db() as conn:
+async def get_rental_by_id(rental_id: int, conn: asyncpg.Connection | None = None):
+    async with get_ro_db(conn) as conn:
         return await conn.fetchrow("SELECT * FROM rentals WHERE id=$1", rental_id)
 
 
-async def get_rental_items(rental_id: int):
-    async with get_db() as conn:
+async def get_rental_items(rental_id: int, conn: asyncpg.Connection | None = None):
+    async with get_ro_db(conn) as conn:
         return await conn.fetch(
             """SELECT ri.*, t.name AS tool_name, t.quantity AS stock
                FROM rental_items ri JOIN tools t ON t.id = ri.tool_id
@@ -64,8 +91,9 @@ async def get_rental_items(rental_id: int):
         )
 
 
-async def calculate_rental_cost(rental_id: int) -> float:
-    async with get_db() as conn:
+async def calculate_rental_cost(rental_id: int,
+                                conn: asyncpg.Connection | None = None) -> float:
+    async with get_ro_db(conn) as conn:
         rental = await conn.fetchrow("SELECT rental_date FROM rentals WHERE id=$1", rental_id)
         if not rental:
             return 0.0
@@ -81,14 +109,15 @@ async def calculate_rental_cost(rental_id: int) -> float:
         return round(total, 2)
 
 
-async def calculate_return_cost(rental_id: int, returns: list[dict]) -> float:
+async def calculate_return_cost(rental_id: int, returns: list[dict],
+                                conn: asyncpg.Connection | None = None) -> float:
     """
     Fixed: was doing 1 DB query per item (N+1 problem).
     Now fetches all items in a single query using ANY($1).
     """
     if not returns:
         return 0.0
-    async with get_db() as conn:
+    async with get_ro_db(conn) as conn:
         rental = await conn.fetchrow("SELECT rental_date FROM rentals WHERE id=$1", rental_id)
         if not rental:
             return 0.0
@@ -105,61 +134,89 @@ async def calculate_return_cost(rental_id: int, returns: list[dict]) -> float:
         return round(total, 2)
 
 
-async def get_already_paid(rental_id: int) -> float:
-    async with get_db() as conn:
+async def get_already_paid(rental_id: int, conn: asyncpg.Connection | None = None) -> float:
+    async with get_ro_db(conn) as conn:
         val = await conn.fetchval(
             "SELECT COALESCE(SUM(amount), 0) FROM payments WHERE rental_id=$1", rental_id
         )
         return round(float(val or 0), 2)
 
 
-async def process_return(rental_id: int, returns: list[dict]) -> None:
+async def process_return(rental_id: int, returns: list[dict],
+                         conn: asyncpg.Connection | None = None) -> int:
     """
-    Fixed: was doing 1 DB query per item to fetch before update (N+1 problem).
-    Now locks all rows at once with ANY($1) FOR UPDATE, then updates each.
+    Apply a whole return in ONE statement: lock the items (id order), bump
+    returned_quantity, put the stock back per tool and mark the rental
+    'returned' when nothing is left outstanding.
+    Returns the rental's outstanding quantity after the return.
     """
-    async with get_db() as conn:
-        # Lock all rows in one query
-        item_ids = [ret["item_id"] for ret in returns]
-        items = await conn.fetch(
-            "SELECT * FROM rental_items WHERE id = ANY($1::bigint[]) FOR UPDATE",
-            item_ids
+    async with get_db(conn) as conn:
+        row = await conn.fetchrow(
+            """WITH req AS (
+                   SELECT item_id, SUM(qty)::int AS qty
+                   FROM unnest($2::bigint[], $3::int[]) AS r(item_id, qty)
+                   GROUP BY item_id
+               ),
+               locked AS (
+                   SELECT ri.id, ri.tool_id,
+                          ri.quantity - ri.returned_quantity AS outstanding,
+                          LEAST(req.qty, ri.quantity - ri.returned_quantity) AS qty
+                   FROM rental_items ri JOIN req ON req.item_id = ri.id
+                   WHERE ri.rental_id = $1
+                   ORDER BY ri.id
+                   FOR UPDATE OF ri
+               ),
+               items AS (
+                   UPDATE rental_items ri SET returned_quantity = ri.returned_quantity + l.qty
+                   FROM locked l
+                   WHERE ri.id = l.id AND l.qty > 0
+                   RETURNING ri.id, ri.tool_id, l.qty
+               ),
+               stock AS (
+                   UPDATE tools t SET quantity = t.quantity + s.qty
+                   FROM (SELECT tool_id, SUM(qty) AS qty FROM items GROUP BY tool_id) s
+                   WHERE t.id = s.tool_id
+               ),
+               remaining AS (
+                   -- the statement snapshot can't see its own updates, so
+                   -- subtract what this return applied from the locked rows
+                   SELECT COALESCE(SUM(CASE
+                              WHEN l.id IS NULL THEN ri.quantity - ri.returned_quantity
+                              ELSE l.outstanding - GREATEST(l.qty, 0)
+                          END), 0)::int AS qty
+                   FROM rental_items ri LEFT JOIN locked l ON l.id = ri.id
+                   WHERE ri.rental_id = $1
+               ),
+               status AS (
+                   UPDATE rentals SET status='returned'
+                   WHERE id=$1 AND (SELECT qty FROM remaining) <= 0
+               ),
+               shop AS (
+                   -- stock changed → new catalog version for the shop
+                   SELECT r.user_id, pg_notify($4, 'tools:' || r.user_id) AS notified
+                   FROM rentals r WHERE r.id=$1 AND EXISTS (SELECT 1 FROM items)
+               )
+               SELECT remaining.qty, shop.user_id
+               FROM remaining LEFT JOIN shop ON TRUE""",
+            rental_id,
+            [ret["item_id"] for ret in returns],
+            [ret["quantity"] for ret in returns],
+            CHANNEL
         )
-        items_map = {item["id"]: item for item in items}
-
-        for ret in returns:
-            item = items_map.get(ret["item_id"])
-            if not item:
-                continue
-            qty = min(ret["quantity"], item["quantity"] - item["returned_quantity"])
-            if qty <= 0:
-                continue
-            await conn.execute(
-                "UPDATE rental_items SET returned_quantity = returned_quantity + $1 WHERE id=$2",
-                qty, ret["item_id"]
-            )
-            await increase_tool_stock(conn, ret["tool_id"], qty)
-
-        remaining = await conn.fetchval(
-            """SELECT COALESCE(SUM(quantity - returned_quantity), 0)
-               FROM rental_items WHERE rental_id=$1""",
-            rental_id
-        )
-        if (remaining or 0) <= 0:
-            await conn.execute(
-                "UPDATE rentals SET status='returned' WHERE id=$1", rental_id
-            )
+        if row["user_id"] is not None:
+            catalog_changed(row["user_id"])
+        return row["qty"] or 0
 
 
-async def close_rental(rental_id: int):
-    async with get_db() as conn:
+async def close_rental(rental_id: int, conn: asyncpg.Connection | None = None):
+    async with get_db(conn) as conn:
         await conn.execute(
             "UPDATE rentals SET status='closed' WHERE id=$1", rental_id
         )
 
 
-async def is_fully_returned(rental_id: int) -> bool:
-    async with get_db() as conn:
+async def is_fully_returned(rental_id: int, conn: asyncpg.Connection | None = None) -> bool:
+    async with get_ro_db(conn) as conn:
         remaining = await conn.fetchval(
             """SELECT COALESCE(SUM(quantity - returned_quantity), 0)
                FROM rental_items WHERE rental_id=$1""",
@@ -168,8 +225,8 @@ async def is_fully_returned(rental_id: int) -> bool:
         return (remaining or 0) <= 0
 
 
-async def get_unreturned_items(rental_id: int):
-    async with get_db() as conn:
+async def get_unreturned_items(rental_id: int, conn: asyncpg.Connection | None = None):
+    async with get_ro_db(conn) as conn:
         return await conn.fetch(
             """SELECT ri.*, t.name AS tool_name
                FROM rental_items ri JOIN tools t ON t.id = ri.tool_id
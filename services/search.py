@@ -0,0 +1,99 @@
+"""
+Ranked, bounded text search backed by pg_trgm GIN indexes.
+
+Letters → substring (ILIKE) or fuzzy word match (<%) on the text columns,
+          best word_similarity first.
+Digits  → a full number is an exact match on the normalized phone column;
+          4–7 digits are a suffix lookup ("4567" → …4567) on its reversed
+          index. When either finds nothing — a fragment from the middle of
+          the number, or rows whose normalized phone is NULL — and for any
+          other digit count, it is a substring match on the phone with
+          everything but digits stripped, so "90 123" finds "+998 90 123-45-67".
+
+Served by the indexes from migrations v0004 and v0006; the expressions
+below must stay byte-identical to the indexed ones.
+"""
+import re
+
+import asyncpg
+
+from services.pagination import Page
+from utils import normalize_phone
+
+SEARCH_LIMIT = 10
+
+
+def digits_expr(col: str) -> str:
+    return f"regexp_replace({col}, '[^0-9]', '', 'g')"
+
+
+def phone_digits(query: str) -> str | None:
+    """Digits of `query` if it looks like (part of) a phone number, else None."""
+    if not re.fullmatch(r"[\d\s()+\-]+", query):
+        return None
+    digits = re.sub(r"\D", "", query)
+    return digits if len(digits) >= 3 else None
+
+
+def _like_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def ranked_search(conn: asyncpg.Connection, *, table: str, where: str, args: tuple,
+                        text_cols: tuple[str, ...], phone_col: str | None,
+                        query: str, order: str, norm_col: str | None = None, offset: int = 0,
+                        limit: int = SEARCH_LIMIT) -> Page:
+    """
+    One page of search hits. `order` breaks ties (phone hits use it alone).
+    has_prev/has_next tell the handler whether to offer "show more".
+
+    A phone-like query finds every row whose phone contains its digits in
+    order ("90 123" → "+998 90 123-45-67"); the exact and suffix lookups on
+    `norm_col` are only shortcuts, tried first and dropped when they find
+    nothing.
+    """
+    digits = phone_digits(query) if phone_col else None
+    full = normalize_phone(digits) if digits and norm_col else None
+    if full or (digits and norm_col and 4 <= len(digits) <= 7):
+        params = list(args)
+        if full:
+            params.append(full)
+            sql = (f"SELECT * FROM {table} WHERE {where} "
+                   f"AND {norm_col} = ${len(params)} ORDER BY {order}")
+        else:
+            rev = digits[::-1]
+            params += [rev, rev[:-1] + chr(ord(rev[-1]) + 1)]
+            sql = (f"SELECT * FROM {table} WHERE {where} "
+                   f"AND reverse({norm_col}) ~>=~ ${len(params) - 1} "
+                   f"AND reverse({norm_col}) ~<~ ${len(params)} ORDER BY {order}")
+        page = await _fetch_page(conn, sql, params, offset, limit)
+        if page.rows:
+            return page
+        # Nothing on the index: a middle fragment, or a NULL normalized phone
+
+    params = list(args)
+    if digits:
+        params.append(f"%{digits}%")
+        sql = (f"SELECT * FROM {table} WHERE {where} "
+               f"AND {digits_expr(phone_col)} LIKE ${len(params)} "
+               f"ORDER BY {order}")
+    else:
+        params.append(query)
+        q = len(params)
+        params.append(f"%{_like_escape(query)}%")
+        pat = len(params)
+        match = " OR ".join(f"{c} ILIKE ${pat} OR ${q} <% {c}" for c in text_cols)
+        score = ", ".join(f"word_similarity(${q}, {c})" for c in text_cols)
+        if len(text_cols) > 1:
+            score = f"GREATEST({score})"
+        sql = (f"SELECT * FROM {table} WHERE {where} AND ({match}) "
+               f"ORDER BY {score} DESC, {order}")
+    return await _fetch_page(conn, sql, params, offset, limit)
+
+
+async def _fetch_page(conn: asyncpg.Connection, sql: str, params: list,
+                      offset: int, limit: int) -> Page:
+    params = [*params, limit + 1, offset]
+    sql += f" LIMIT ${len(params) - 1} OFFSET ${len(params)}"
+    rows = await conn.fetch(sql, *params)
+    return Page(rows[:limit], offset > 0, len(rows) > limit)
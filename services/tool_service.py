@@ -1,79 +1,186 @@
+from typing import NamedTuple
+
 import asyncpg
-from database import get_db
+from config import TOOL_CACHE_MAX, TOOL_CACHE_TTL
+from database import get_db, get_ro_db
+from database.invalidation import publish, subscribe
+from services.pagination import Page, keyset_page
+from services.search import SEARCH_LIMIT, ranked_search
+from utils.cache import TTLCache, MISSING
+from utils.singleflight import SingleFlight
+
+
+class InsufficientStockError(Exception):
+    """Raised by reserve_tool_stock(). `shortages` maps tool_id → units available."""
+
+    def __init__(self, shortages: dict[int, int]):
+        super().__init__(f"Not enough stock for tools {sorted(shortages)}")
+        self.shortages = shortages
+
+
+# ── Per-shop catalog cache ────────────────────────────────────────────────────
+# The add-rental flow re-renders the whole catalog after every step, so each
+# shop's tool list is cached against a catalog version. Every write to a
+# shop's tools bumps the version (here and, via NOTIFY, in other processes)
+# and an entry loaded under an older version is never served.
+
+class Catalog(NamedTuple):
+    version: tuple[int, int, int]   # (shop, epoch, counter) — also a memo key
+    tools: tuple        # Records with only id, name, quantity, daily_price
+    available: tuple    # the subset with quantity > 0
+
+
+_catalogs = TTLCache(TOOL_CACHE_MAX, TOOL_CACHE_TTL)
+_catalog_flight = SingleFlight("tools")
+_catalog_versions: dict[int, int] = {}
+_catalog_epoch = 0      # bumped when every catalog must go (listener reconnect)
+
+
+def _catalog_version(user_id: int) -> tuple[int, int, int]:
+    return user_id, _catalog_epoch, _catalog_versions.get(user_id, 0)
+
+
+def catalog_changed(user_id: int) -> None:
+    """Bump the shop's catalog version; writers also publish "tools:<user_id>"."""
+    _catalog_versions[user_id] = _catalog_versions.get(user_id, 0) + 1
+    _catalogs.pop(user_id)
+    _catalog_flight.forget(user_id)
+
+
+def _all_catalogs_changed() -> None:
+    global _catalog_epoch
+    _catalog_epoch += 1
+    _catalogs.clear()
 
 
-async def get_tools(user_id: int, offset: int = 0, limit: int = 10):
-    async with get_db() as conn:
-        rows  = await conn.fetch(
-            "SELECT * FROM tools WHERE user_id=$1 ORDER BY name LIMIT $2 OFFSET $3",
-            user_id, limit, offset
+subscribe("tools", lambda key: catalog_changed(int(key)) if key is not None
+          else _all_catalogs_changed())
+
+
+def catalog_stats() -> dict:
+    return {**_catalogs.stats(), **_catalog_flight.stats()}
+
+
+async def _load_catalog(user_id: int) -> Catalog:
+    version = _catalog_version(user_id)
+    async with get_ro_db() as conn:
+        rows = await conn.fetch(
+            "SELECT id, name, quantity, daily_price FROM tools WHERE user_id=$1 ORDER BY name",
+            user_id
         )
-        count = await conn.fetchval(
-            "SELECT COUNT(*) FROM tools WHERE user_id=$1", user_id
+    catalog = Catalog(version, tuple(rows), tuple(t for t in rows if t["quantity"] > 0))
+    if version == _catalog_version(user_id):
+        _catalogs.set(user_id, catalog)
+    return catalog
+
+
+async def get_tools(user_id: int, after: int | None = None, before: int | None = None,
+                    limit: int = 10, conn: asyncpg.Connection | None = None) -> Page:
+    """One page of tools ordered by (name, id)."""
+    async with get_ro_db(conn) as conn:
+        return await keyset_page(
+            conn, table="tools", where="user_id=$1", args=(user_id,),
+            key=("name", "id"), descending=False,
+            after=after, before=before, limit=limit
         )
-        return rows, count
 
 
-async def get_all_tools(user_id: int):
-    async with get_db() as conn:
-        return await conn.fetch(
-            "SELECT * FROM tools WHERE user_id=$1 ORDER BY name", user_id
+async def count_tools(user_id: int, conn: asyncpg.Connection | None = None) -> int:
+    async with get_ro_db(conn) as conn:
+        return await conn.fetchval("SELECT COUNT(*) FROM tools WHERE user_id=$1", user_id)
+
+
+async def get_all_tools(user_id: int, available_only: bool = False,
+                        conn: asyncpg.Connection | None = None):
+    """
+    The shop's whole catalog ordered by name (id, name, quantity, daily_price),
+    or only tools in stock. Served from the catalog cache unless `conn` is
+    given — then it is read inside the caller's transaction.
+    """
+    if conn is not None:
+        rows = await conn.fetch(
+            "SELECT id, name, quantity, daily_price FROM tools WHERE user_id=$1 ORDER BY name",
+            user_id
         )
+        return [t for t in rows if t["quantity"] > 0] if available_only else rows
+    catalog = await get_catalog(user_id)
+    return catalog.available if available_only else catalog.tools
 
 
-async def search_tools(user_id: int, query: str):
-    async with get_db() as conn:
-        return await conn.fetch(
-            "SELECT * FROM tools WHERE user_id=$1 AND name ILIKE $2",
-            user_id, f"%{query}%"
+async def get_catalog(user_id: int) -> Catalog:
+    """Cached catalog with its version, for callers that memoize on it."""
+    catalog = _catalogs.get(user_id)
+    if catalog is MISSING or catalog.version != _catalog_version(user_id):
+        catalog = await _catalog_flight.do(user_id, lambda: _load_catalog(user_id))
+    return catalog
+
+
+async def search_tools(user_id: int, query: str, offset: int = 0, limit: int = SEARCH_LIMIT,
+                       conn: asyncpg.Connection | None = None) -> Page:
+    """Tools by name, best match first."""
+    async with get_ro_db(conn) as conn:
+        return await ranked_search(
+            conn, table="tools", where="user_id=$1", args=(user_id,),
+            text_cols=("name",), phone_col=None,
+            query=query, order="name, id", offset=offset, limit=limit
         )
 
 
-async def get_tool_by_id(tool_id: int):
-    async with get_db() as conn:
+async def get_tool_by_id(tool_id: int, conn: asyncpg.Connection | None = None):
+    async with get_ro_db(conn) as conn:
         return await conn.fetchrow("SELECT * FROM tools WHERE id=$1", tool_id)
 
 
-async def create_tool(user_id: int, name: str, quantity: int, daily_price: float) -> bool:
+async def create_tool(user_id: int, name: str, quantity: int, daily_price: float,
+                      conn: asyncpg.Connection | None = None) -> bool:
     try:
-        async with get_db() as conn:
+        async with get_db(conn, savepoint=True) as conn:
             await conn.execute(
                 "INSERT INTO tools (user_id, name, quantity, daily_price) VALUES ($1,$2,$3,$4)",
                 user_id, name, quantity, daily_price
             )
+            await publish(conn, "tools", user_id)
+        catalog_changed(user_id)
         return True
     except asyncpg.UniqueViolationError:
         return False
 
 
-async def update_tool_name(tool_id: int, name: str, user_id: int) -> bool:
+async def update_tool_name(tool_id: int, name: str, user_id: int,
+                           conn: asyncpg.Connection | None = None) -> bool:
     try:
-        async with get_db() as conn:
+        async with get_db(conn, savepoint=True) as conn:
             await conn.execute(
                 "UPDATE tools SET name=$1 WHERE id=$2 AND user_id=$3",
                 name, tool_id, user_id
             )
+            await publish(conn, "tools", user_id)
+        catalog_changed(user_id)
         return True
     except asyncpg.UniqueViolationError:
         return False
 
 
-async def update_tool_qty(tool_id: int, quantity: int):
-    async with get_db() as conn:
-        await conn.execute(
-            "UPDATE tools SET quantity=$1 WHERE id=$2", quantity, tool_id
+async def update_tool_qty(tool_id: int, quantity: int,
+                          conn: asyncpg.Connection | None = None):
+    async with get_db(conn) as conn:
+        user_id = await conn.fetchval(
+            "UPDATE tools SET quantity=$1 WHERE id=$2 RETURNING user_id", quantity, tool_id
         )
+        await _tools_written(conn, user_id)
 
 
-async def update_tool_price(tool_id: int, price: float):
-    async with get_db() as conn:
-        await conn.execute(
-            "UPDATE tools SET daily_price=$1 WHERE id=$2", price, tool_id
+async def update_tool_price(tool_id: int, price: float,
+                            conn: asyncpg.Connection | None = None):
+    async with get_db(conn) as conn:
+        user_id = await conn.fetchval(
+            "UPDATE tools SET daily_price=$1 WHERE id=$2 RETURNING user_id", price, tool_id
         )
+        await _tools_written(conn, user_id)
 
 
-async def delete_tool(tool_id: int) -> bool:
-    async with get_db() as conn:
+async def delete_tool(tool_id: int, conn: asyncpg.Connection | None = None) -> bool:
+    async with get_db(conn) as conn:
         in_use = await conn.fetchval(
             """SELECT COUNT(*) FROM rental_items ri
                JOIN rentals r ON r.id = ri.rental_id
@@ -83,10 +190,18 @@ async def delete_tool(tool_id: int) -> bool:
         )
         if in_use:
             return False
-        await conn.execute("DELETE FROM tools WHERE id=$1", tool_id)
+        user_id = await conn.fetchval("DELETE FROM tools WHERE id=$1 RETURNING user_id", tool_id)
+        await _tools_written(conn, user_id)
     return True
 
 
+async def _tools_written(conn: asyncpg.Connection, user_id: int | None) -> None:
+    """Invalidate the shop's catalog after a write that found its row."""
+    if user_id is not None:
+        await publish(conn, "tools", user_id)
+        catalog_changed(user_id)
+
+
 async def decrease_tool_stock(conn: asyncpg.Connection, tool_id: int, amount: int) -> bool:
     """Atomically decrease stock. Uses FOR UPDATE to prevent race conditions."""
     row = await conn.fetchrow(
@@ -94,13 +209,53 @@ async def decrease_tool_stock(conn: asyncpg.Connection, tool_id: int, amount: in
     )
     if not row or row["quantity"] < amount:
         return False
-    await conn.execute(
-        "UPDATE tools SET quantity = quantity - $1 WHERE id=$2", amount, tool_id
+    user_id = await conn.fetchval(
+        "UPDATE tools SET quantity = quantity - $1 WHERE id=$2 RETURNING user_id", amount, tool_id
     )
+    await _tools_written(conn, user_id)
     return True
 
 
 async def increase_tool_stock(conn: asyncpg.Connection, tool_id: int, amount: int):
-    await conn.execute(
-        "UPDATE tools SET quantity = quantity + $1 WHERE id=$2", amount, tool_id
+    user_id = await conn.fetchval(
+        "UPDATE tools SET quantity = quantity + $1 WHERE id=$2 RETURNING user_id", amount, tool_id
+    )
+    await _tools_written(conn, user_id)
+
+
+async def reserve_tool_stock(conn: asyncpg.Connection, items: list[dict]) -> None:
+    """
+    Decrease stock for many tools in ONE round trip, all-or-nothing.
+    Rows are locked in tool-id order so concurrent rentals cannot deadlock.
+    Raises InsufficientStockError listing every tool that lacked stock.
+    The caller invalidates the shop's catalog (create_rental folds the
+    NOTIFY into its insert).
+    """
+    rows = await conn.fetch(
+        """WITH req AS (
+               SELECT tool_id, SUM(qty)::int AS qty
+               FROM unnest($1::bigint[], $2::int[]) AS r(tool_id, qty)
+               GROUP BY tool_id
+           ),
+           locked AS (
+               SELECT t.id, t.quantity
+               FROM tools t JOIN req ON req.tool_id = t.id
+               ORDER BY t.id
+               FOR UPDATE OF t
+           ),
+           short AS (
+               SELECT req.tool_id, COALESCE(l.quantity, 0) AS available
+               FROM req LEFT JOIN locked l ON l.id = req.tool_id
+               WHERE l.id IS NULL OR l.quantity < req.qty
+           ),
+           upd AS (
+               UPDATE tools t SET quantity = t.quantity - req.qty
+               FROM req
+               WHERE t.id = req.tool_id AND NOT EXISTS (SELECT 1 FROM short)
+               RETURNING t.id
+           )
+           SELECT tool_id, available FROM short""",
+        [i["tool_id"] for i in items], [i["quantity"] for i in items]
     )
+    if rows:
+        raise InsufficientStockError({r["tool_id"]: r["available"] for r in rows})
@@ -1,71 +1,94 @@
-from database import get_db
+import asyncpg
+from database import get_db, get_ro_db
+from database.invalidation import publish
+from services.pagination import Page, keyset_page
+from services.search import SEARCH_LIMIT, ranked_search
+from utils import normalize_phone
 
 
-async def get_user_by_telegram_id(telegram_id: int):
-    async with get_db() as conn:
+async def get_user_by_telegram_id(telegram_id: int, conn: asyncpg.Connection | None = None):
+    async with get_ro_db(conn) as conn:
         return await conn.fetchrow(
             "SELECT * FROM users WHERE telegram_id = $1", telegram_id
         )
 
 
-async def get_user_by_id(user_id: int):
-    async with get_db() as conn:
+async def get_user_by_id(user_id: int, conn: asyncpg.Connection | None = None):
+    async with get_ro_db(conn) as conn:
         return await conn.fetchrow("SELECT * FROM users WHERE id = $1", user_id)
 
 
 async def create_user(full_name: str, shop_name: str, address: str,
-                      phone: str, telegram_id: int) -> bool:
+                      phone: str, telegram_id: int,
+                      conn: asyncpg.Connection | None = None) -> bool:
     try:
-        async with get_db() as conn:
+        async with get_db(conn, savepoint=True) as conn:
             await conn.execute(
-                """INSERT INTO users (full_name, shop_name, address, phone, telegram_id)
-                   VALUES ($1, $2, $3, $4, $5)""",
-                full_name, shop_name, address, phone, telegram_id
+                """INSERT INTO users (full_name, shop_name, address, phone, phone_norm, telegram_id)
+                   VALUES ($1, $2, $3, $4, $5, $6)""",
+                full_name, shop_name, address, phone, normalize_phone(phone), telegram_id
             )
+            # A cached "unknown user" entry for this account is now wrong
+            await publish(conn, "tg", telegram_id)
         return True
     except Exception:
         return False
 
 
-async def get_all_users(offset: int = 0, limit: int = 10):
-    async with get_db() as conn:
-        rows  = await conn.fetch(
-            "SELECT * FROM users ORDER BY id DESC LIMIT $1 OFFSET $2", limit, offset
+async def get_all_users(after: int | None = None, before: int | None = None,
+                        limit: int = 10, conn: asyncpg.Connection | None = None) -> Page:
+    """One page of users, newest first — ordered by (created_at, id)."""
+    async with get_ro_db(conn) as conn:
+        return await keyset_page(
+            conn, table="users", where="TRUE", args=(),
+            key=("created_at", "id"), descending=True,
+            after=after, before=before, limit=limit
         )
-        count = await conn.fetchval("SELECT COUNT(*) FROM users")
-        return rows, count
 
 
-async def search_users(query: str):
-    async with get_db() as conn:
-        q = f"%{query}%"
-        return await conn.fetch(
-            "SELECT * FROM users WHERE full_name ILIKE $1 OR phone ILIKE $2", q, q
+async def count_users(conn: asyncpg.Connection | None = None) -> int:
+    async with get_ro_db(conn) as conn:
+        return await conn.fetchval("SELECT COUNT(*) FROM users")
+
+
+async def search_users(query: str, offset: int = 0, limit: int = SEARCH_LIMIT,
+                       conn: asyncpg.Connection | None = None) -> Page:
+    """Users by owner/shop name (ranked) or phone digits."""
+    async with get_ro_db(conn) as conn:
+        return await ranked_search(
+            conn, table="users", where="TRUE", args=(),
+            text_cols=("full_name", "shop_name"), phone_col="phone", norm_col="phone_norm",
+            query=query, order="created_at DESC, id DESC", offset=offset, limit=limit
         )
 
 
-async def activate_user(user_id: int):
-    async with get_db() as conn:
+async def activate_user(user_id: int, conn: asyncpg.Connection | None = None):
+    async with get_db(conn) as conn:
         await conn.execute("UPDATE users SET is_active = TRUE  WHERE id = $1", user_id)
+        await publish(conn, "user", user_id)
 
 
-async def deactivate_user(user_id: int):
-    async with get_db() as conn:
+async def deactivate_user(user_id: int, conn: asyncpg.Connection | None = None):
+    async with get_db(conn) as conn:
         await conn.execute("UPDATE users SET is_active = FALSE WHERE id = $1", user_id)
+        await publish(conn, "user", user_id)
 
 
-async def delete_user(user_id: int):
-    async with get_db() as conn:
+async def delete_user(user_id: int, conn: asyncpg.Connection | None = None):
+    async with get_db(conn) as conn:
         await conn.execute("DELETE FROM users WHERE id = $1", user_id)
+        await publish(conn, "user", user_id)
 
 
 async def update_user(user_id: int, full_name: str, shop_name: str,
-                      address: str, phone: str):
-    async with get_db() as conn:
+                      address: str, phone: str, conn: asyncpg.Connection | None = None):
+    async with get_db(conn) as conn:
         await conn.execute(
-            "UPDATE users SET full_name=$1, shop_name=$2, address=$3, phone=$4 WHERE id=$5",
-            full_name, shop_name, address, phone, user_id
+            """UPDATE users SET full_name=$1, shop_name=$2, address=$3, phone=$4, phone_norm=$5
+               WHERE id=$6""",
+            full_name, shop_name, address, phone, normalize_phone(phone), user_id
         )
+        await publish(conn, "user", user_id)
 
 
 # ── Sub-account management ────────────────────────────────────────────────────
@@ -73,65 +96,92 @@ async def update_user(user_id: int, full_name: str, shop_name: str,
 MAX_SUB_ACCOUNTS = 4
 
 
-async def get_sub_accounts(user_id: int):
+async def get_sub_accounts(user_id: int, conn: asyncpg.Connection | None = None):
     """Return all sub-accounts for a given user."""
-    async with get_db() as conn:
+    async with get_ro_db(conn) as conn:
         return await conn.fetch(
             "SELECT * FROM user_sub_accounts WHERE user_id = $1 ORDER BY added_at", user_id
         )
 
 
-async def count_sub_accounts(user_id: int) -> int:
-    async with get_db() as conn:
+async def count_sub_accounts(user_id: int, conn: asyncpg.Connection | None = None) -> int:
+    async with get_ro_db(conn) as conn:
         return await conn.fetchval(
             "SELECT COUNT(*) FROM user_sub_accounts WHERE user_id = $1", user_id
         )
 
 
-async def add_sub_account(user_id: int, telegram_id: int) -> str:
+async def add_sub_account(user_id: int, telegram_id: int,
+                          conn: asyncpg.Connection | None = None) -> str:
     """
     Add a sub-account TG ID to a user.
     Returns 'ok', 'limit', 'duplicate', or 'main_account'.
     """
     # Cannot add the user's own primary TG ID
-    owner = await get_user_by_id(user_id)
+    owner = await get_user_by_id(user_id, conn=conn)
     if owner and owner["telegram_id"] == telegram_id:
         return "main_account"
 
     # Check if this TG ID is already a primary account
-    existing_primary = await get_user_by_telegram_id(telegram_id)
+    existing_primary = await get_user_by_telegram_id(telegram_id, conn=conn)
     if existing_primary:
         return "duplicate"
 
-    count = await count_sub_accounts(user_id)
+    count = await count_sub_accounts(user_id, conn=conn)
     if count >= MAX_SUB_ACCOUNTS:
         return "limit"
 
     try:
-        async with get_db() as conn:
+        async with get_db(conn, savepoint=True) as conn:
             await conn.execute(
                 "INSERT INTO user_sub_accounts (user_id, telegram_id) VALUES ($1, $2)",
                 user_id, telegram_id
             )
+            await publish(conn, "tg", telegram_id)
         return "ok"
     except Exception:
         return "duplicate"
 
 
-async def remove_sub_account(user_id: int, sub_account_id: int):
-    async with get_db() as conn:
-        await conn.execute(
-            "DELETE FROM user_sub_accounts WHERE id = $1 AND user_id = $2",
+async def remove_sub_account(user_id: int, sub_account_id: int,
+                             conn: asyncpg.Connection | None = None):
+    async with get_db(conn) as conn:
+        telegram_id = await conn.fetchval(
+            "DELETE FROM user_sub_accounts WHERE id = $1 AND user_id = $2 RETURNING telegram_id",
             sub_account_id, user_id
         )
+        if telegram_id is not None:
+            await publish(conn, "tg", telegram_id)
 
 
-async def get_user_by_sub_telegram_id(telegram_id: int):
+async def get_user_by_sub_telegram_id(telegram_id: int,
+                                      conn: asyncpg.Connection | None = None):
     """If telegram_id belongs to a sub-account, return the parent users row."""
-    async with get_db() as conn:
+    async with get_ro_db(conn) as conn:
         row = await conn.fetchrow(
             "SELECT user_id FROM user_sub_accounts WHERE telegram_id = $1", telegram_id
         )
         if row:
             return await conn.fetchrow("SELECT * FROM users WHERE id = $1", row["user_id"])
         return None
+
+
+async def resolve_principal(telegram_id: int, conn: asyncpg.Connection | None = None):
+    """
+    The shop (users row) a Telegram account acts for, in ONE query, plus a
+    `role` column: 'owner' for the primary account, 'sub_account' otherwise.
+    An account that is both resolves as the owner. Returns None for unknown
+    accounts.
+    """
+    async with get_ro_db(conn) as conn:
+        return await conn.fetchrow(
+            """SELECT u.*, 'owner' AS role, 0 AS precedence
+               FROM users u WHERE u.telegram_id = $1
+               UNION ALL
+               SELECT u.*, 'sub_account' AS role, 1 AS precedence
+               FROM user_sub_accounts s JOIN users u ON u.id = s.user_id
+               WHERE s.telegram_id = $1
+               ORDER BY precedence
+               LIMIT 1""",
+            telegram_id
+        )
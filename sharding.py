@@ -0,0 +1,236 @@
+"""
+sharding.py — one intake process + N shard worker processes.
+
+    WORKERS=4 python main.py
+
+The front process only talks to Telegram: it long-polls (or, with
+BOT_MODE=webhook, serves the webhook) and forwards every raw update to
+worker `chat id % N` over a socketpair, one JSON line per update. Its only
+database work is applying pending migrations over a single connection
+before the workers start, so exactly one process ever migrates; workers
+open their pools with migrate=False.
+
+Each worker is a complete bot (app.create_dispatcher) with its own pool,
+FSM storage and caches. A chat always lands on the same worker, so its FSM
+state and cached rows stay shard-local; writes still reach the other
+shards through the LISTEN/NOTIFY invalidation bus. Size DB_POOL_MAX per
+worker — the database sees WORKERS × DB_POOL_MAX connections at most.
+
+Inside a worker, updates of one chat run strictly in arrival order while
+different chats run concurrently, up to SHARD_MAX_INFLIGHT at once; an
+update waiting for its chat's previous one holds no slot, so one user
+tapping fast can't starve the others. Once SHARD_MAX_CHATS chats have
+updates pending, the worker stops reading its socket; the buffer fills,
+the front's drain() blocks and the front stops fetching updates (or
+answering webhook requests). A slow shard pushes back on the intake
+instead of queueing without bound.
+"""
+import asyncio
+import hmac
+import json
+import multiprocessing
+import os
+import signal
+import socket
+from typing import Any
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.methods import TelegramMethod
+from loguru import logger
+
+from app import (
+    ALLOWED_UPDATES, create_bot, create_dispatcher, start_services, stop_services,
+    wait_for_stop_signal,
+)
+from config import (
+    BOT_MODE, SHARD_MAX_INFLIGHT, SHARD_MAX_CHATS, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_DRAIN_TIMEOUT,
+)
+from database import migrate_db
+
+_LINE_LIMIT = 4 * 1024 * 1024   # one update per line; Telegram's are far smaller
+
+
+def chat_key(update: dict[str, Any]) -> int:
+    """The chat an update belongs to — FSM keys and ordering are per chat."""
+    message = update.get("message") or update.get("edited_message")
+    if message:
+        return message["chat"]["id"]
+    callback = update.get("callback_query")
+    if callback:
+        chat = (callback.get("message") or {}).get("chat")
+        return chat["id"] if chat else callback["from"]["id"]
+    return update["update_id"]
+
+
+# ── Worker ────────────────────────────────────────────────────────────────────
+
+def worker_main(index: int, sock: socket.socket) -> None:
+    """Process entry point (spawned)."""
+    # Ctrl+C reaches the whole process group; the front decides when we stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.makedirs("logs", exist_ok=True)
+    logger.add(f"logs/shard-{index}.log", rotation="10 MB", retention="7 days", level="INFO")
+    asyncio.run(_worker(index, sock))
+
+
+async def _worker(index: int, sock: socket.socket) -> None:
+    await start_services(migrate=False)   # the front migrated before spawning us
+    bot = create_bot()
+    dp = create_dispatcher(shard_worker=True)
+    await dp.emit_startup(bot=bot)
+    reader, _ = await asyncio.open_connection(sock=sock, limit=_LINE_LIMIT)
+    slots = asyncio.Semaphore(SHARD_MAX_INFLIGHT)
+    tails: dict[int, asyncio.Task] = {}   # chat → its most recent update
+    room = asyncio.Event()                # set when a chat's queue empties
+    logger.info(f"Shard {index} ready (pid {os.getpid()})")
+
+    async def run(update: dict, previous: asyncio.Task | None) -> None:
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            async with slots:
+                result = await dp.feed_raw_update(bot, update)
+                if isinstance(result, TelegramMethod):
+                    await dp.silent_call_request(bot, result)
+        except Exception:
+            logger.exception(f"Shard {index}: update {update.get('update_id')} failed")
+
+    def done(task: asyncio.Task, key: int) -> None:
+        if tails.get(key) is task:
+            del tails[key]
+            room.set()
+
+    try:
+        while line := await reader.readline():
+            update = json.loads(line)
+            key = chat_key(update)
+            while key not in tails and len(tails) >= SHARD_MAX_CHATS:
+                room.clear()
+                await room.wait()   # full → stop reading → front blocks
+            task = asyncio.create_task(run(update, tails.get(key)))
+            tails[key] = task
+            task.add_done_callback(lambda t, k=key: done(t, k))
+        # Front closed the socket: finish what was handed to us, then stop
+        if tails:
+            await asyncio.wait(list(tails.values()))
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await stop_services(dp)
+        await bot.session.close()
+        logger.info(f"Shard {index} stopped.")
+
+
+# ── Front ─────────────────────────────────────────────────────────────────────
+
+class _Shards:
+    def __init__(self) -> None:
+        self.processes: list[multiprocessing.Process] = []
+        self.writers: list[asyncio.StreamWriter] = []
+        self.forwarded = 0
+
+    async def start(self, n: int) -> None:
+        ctx = multiprocessing.get_context("spawn")
+        for i in range(n):
+            front_sock, worker_sock = socket.socketpair()
+            proc = ctx.Process(target=worker_main, args=(i, worker_sock), name=f"shard-{i}")
+            proc.start()
+            worker_sock.close()
+            _, writer = await asyncio.open_connection(sock=front_sock)
+            self.processes.append(proc)
+            self.writers.append(writer)
+        logger.info(f"🤖 Started {n} shard workers")
+
+    async def forward(self, update: dict) -> None:
+        writer = self.writers[chat_key(update) % len(self.writers)]
+        writer.write(json.dumps(update, ensure_ascii=False, separators=(",", ":")).encode() + b"\n")
+        await writer.drain()
+        self.forwarded += 1
+
+    async def watch(self) -> None:
+        """Return as soon as any worker dies — the supervisor restarts us all."""
+        while all(p.is_alive() for p in self.processes):
+            await asyncio.sleep(1)
+        dead = [p.name for p in self.processes if not p.is_alive()]
+        logger.error(f"Shard worker(s) exited: {dead}")
+
+    async def stop(self, timeout: float) -> None:
+        """EOF to every worker; they drain their in-flight updates and exit."""
+        for writer in self.writers:
+            writer.close()
+        loop = asyncio.get_running_loop()
+        for proc in self.processes:
+            await loop.run_in_executor(None, proc.join, timeout)
+            if proc.is_alive():
+                logger.warning(f"{proc.name} did not stop in {timeout}s, terminating")
+                proc.terminate()
+        logger.info(f"Front stopped after forwarding {self.forwarded} updates")
+
+
+async def _poll(bot: Bot, shards: _Shards) -> None:
+    await bot.delete_webhook()
+    offset, backoff = None, 1
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30,
+                                            allowed_updates=ALLOWED_UPDATES)
+        except Exception as e:
+            logger.warning(f"get_updates failed ({e}), retry in {backoff}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        backoff = 1
+        for update in updates:
+            await shards.forward(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+            offset = update.update_id + 1
+
+
+async def _serve_webhook(bot: Bot, shards: _Shards) -> web.AppRunner:
+    if not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET is not set in .env file!")
+    secret = WEBHOOK_SECRET.encode()
+
+    async def handle(request: web.Request) -> web.Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode()
+        if not hmac.compare_digest(token, secret):
+            return web.Response(body="Unauthorized", status=401)
+        # Answered once the shard has taken it — a full shard slows Telegram down
+        await shards.forward(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app, shutdown_timeout=WEBHOOK_DRAIN_TIMEOUT)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                              secret_token=WEBHOOK_SECRET, allowed_updates=ALLOWED_UPDATES)
+    logger.info(f"Front serving webhook on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    return runner
+
+
+async def run_front(bot: Bot, workers: int) -> None:
+    await migrate_db()
+    shards = _Shards()
+    await shards.start(workers)
+    runner = None
+    try:
+        if BOT_MODE == "webhook":
+            runner = await _serve_webhook(bot, shards)
+            intake = asyncio.create_task(wait_for_stop_signal())
+        else:
+            logger.info("Front polling")
+            intake = asyncio.create_task(_poll(bot, shards))
+        watch = asyncio.create_task(shards.watch())
+        try:
+            await asyncio.wait([intake, watch], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (intake, watch):
+                task.cancel()
+            await asyncio.gather(intake, watch, return_exceptions=True)
+    finally:
+        if runner is not None:
+            await runner.cleanup()   # stop accepting, let open requests hand off
+        await shards.stop(WEBHOOK_DRAIN_TIMEOUT)
@@ -0,0 +1,126 @@
+import base64
+from enum import Enum
+from typing import Optional
+
+import pytest
+from aiogram.filters.callback_data import MAX_CALLBACK_LENGTH
+
+from utils.callback_data import (
+    PackedCallbackData, RentalDetail, RentalTool, ReturnType, UserAction, UserOp,
+    callback_prefix,
+)
+
+
+class Color(str, Enum):
+    red = "red"
+    green = "green"
+    blue = "blue"
+
+
+class Sample(PackedCallbackData, prefix="t~s"):
+    n: int
+    flag: bool
+    color: Color
+    ids: list[int]
+    label: str
+    maybe: Optional[int] = None
+
+
+class Label(PackedCallbackData, prefix="t~l"):
+    text: str
+
+
+def _body(packed: str) -> bytes:
+    body = packed.partition(":")[2]
+    return base64.urlsafe_b64decode(body + "=" * (-len(body) % 4))
+
+
+def _repack(prefix: str, raw: bytes) -> str:
+    return f"{prefix}:{base64.urlsafe_b64encode(raw).rstrip(b'=').decode()}"
+
+
+@pytest.mark.parametrize("n", [0, 1, -1, 63, -64, 64, -65, 2**31, -(2**31), 2**63, -(2**63)])
+def test_zigzag_round_trip(n):
+    packed = Sample(n=n, flag=False, color=Color.red, ids=[], label="").pack()
+    assert Sample.unpack(packed).n == n
+
+
+def test_small_negatives_stay_short():
+    assert len(_body(Sample(n=-1, flag=False, color=Color.red, ids=[], label="").pack())) == 6   # -1 is one byte
+
+
+@pytest.mark.parametrize("maybe", [None, 0, 7, -3])
+def test_all_field_kinds_round_trip(maybe):
+    sample = Sample(n=-42, flag=True, color=Color.blue, ids=[1, 0, -5, 1_000_000],
+                    label="Bolg'a ✓", maybe=maybe)
+    assert Sample.unpack(sample.pack()) == sample
+
+
+def test_schema_classes_round_trip():
+    for data in (RentalDetail(id=4821), RentalTool(), RentalTool(tool_id=3),
+                 ReturnType(full=False, rental_id=99), UserAction(op=UserOp.delete, id=1)):
+        assert type(data).unpack(data.pack()) == data
+
+
+def test_packed_form():
+    assert RentalDetail(id=4821).pack() == "rv:qks"
+    assert callback_prefix("rv:qks") == "rv"
+
+
+def test_prefix_mismatch():
+    with pytest.raises(ValueError):
+        RentalDetail.unpack(ReturnType(full=True, rental_id=1).pack())
+
+
+@pytest.mark.parametrize("body", ["a", "q@s", "qk s", "$$$$"])
+def test_malformed_base64(body):
+    with pytest.raises(ValueError):
+        RentalDetail.unpack(f"rv:{body}")
+
+
+def test_truncated():
+    raw = _body(Sample(n=300, flag=True, color=Color.green, ids=[1, 2], label="abc").pack())
+    for cut in range(len(raw)):
+        with pytest.raises(ValueError):
+            Sample.unpack(_repack("t~s", raw[:cut]))
+
+
+def test_truncated_varint():
+    with pytest.raises(ValueError):
+        RentalDetail.unpack(_repack("rv", b"\x80"))
+
+
+def test_trailing_bytes():
+    raw = _body(RentalDetail(id=4821).pack())
+    with pytest.raises(ValueError):
+        RentalDetail.unpack(_repack("rv", raw + b"\x00"))
+
+
+def test_unknown_enum_index():
+    with pytest.raises(ValueError):
+        Sample.unpack(_repack("t~s", b"\x00\x00\x09\x00\x00\x00"))
+
+
+def test_64_byte_limit():
+    room = MAX_CALLBACK_LENGTH - len("t~l:")
+    fits = (room * 3 // 4) - 1   # one length byte
+    assert len(Label(text="x" * fits).pack()) <= MAX_CALLBACK_LENGTH
+    with pytest.raises(ValueError):
+        Label(text="x" * (fits + 1)).pack()
+
+
+def test_batch_of_ids_fits():
+    ids = list(range(999_990, 1_000_000))   # 3 bytes each
+    assert len(Sample(n=0, flag=True, color=Color.red, ids=ids, label="").pack()) <= MAX_CALLBACK_LENGTH
+
+
+def test_duplicate_prefix_rejected():
+    with pytest.raises(ValueError):
+        class Clash(PackedCallbackData, prefix="rv"):
+            id: int
+
+
+def test_unsupported_field_type():
+    with pytest.raises(TypeError):
+        class Floaty(PackedCallbackData, prefix="t~f"):
+            x: float
@@ -0,0 +1,169 @@
+"""
+The button and callback tables must pick exactly the handler the router
+tree would: for every button text / payload and every FSM state, whatever
+the table resolves has to be the tree's first matching handler.
+"""
+import asyncio
+import itertools
+import types
+from enum import Enum
+from typing import Union, get_args, get_origin
+
+import pytest
+from aiogram import Bot, Router
+from aiogram.fsm.state import StatesGroup
+from aiogram.types import CallbackQuery, Chat, Message, User
+
+from handlers import _routers, main_router, states
+from utils import texts
+from utils.callback_data import _prefixes
+
+STATES = [None] + sorted(
+    s.state
+    for group in vars(states).values()
+    if isinstance(group, type) and issubclass(group, StatesGroup) and group is not StatesGroup
+    for s in group.__all_states__
+)
+USER = User(id=1, is_bot=False, first_name="Test")
+CHAT = Chat(id=1, type="private")
+
+
+def _table(name: str, event: str):
+    (router,) = [r for r in main_router.sub_routers if r.name == name]
+    return router.observers[event].handlers[0].filters[0].callback
+
+
+async def _tree_pick(routers: list[Router], event: str, obj, **kwargs):
+    """First handler the dispatcher would run, walking the routers in order."""
+    for router in routers:
+        observer = router.observers[event]
+        if not await observer.check_root_filters(obj, **kwargs):
+            continue
+        for handler in observer.handlers:
+            passed, _ = await handler.check(obj, **kwargs)
+            if passed:
+                return handler
+        found = await _tree_pick(router.sub_routers, event, obj, **kwargs)
+        if found is not None:
+            return found
+    return None
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture(scope="module")
+def bot():
+    bot = Bot("42:TEST")
+    yield bot
+    _run(bot.session.close())
+
+
+def _message(text: str) -> Message:
+    return Message(message_id=1, date=0, chat=CHAT, from_user=USER, text=text)
+
+
+def _query(data: str) -> CallbackQuery:
+    return CallbackQuery(id="1", from_user=USER, chat_instance="1", data=data,
+                         message=_message("..."))
+
+
+# ── Buttons ───────────────────────────────────────────────────────────────────
+
+BUTTON_TEXTS = sorted({v for k, v in vars(texts).items() if k.startswith("BTN_")}
+                      | {"salom", "/start"})
+
+
+def test_table_routes_are_menu_buttons():
+    routes = _table("buttons", "message").routes
+    assert {v for k, v in vars(texts).items() if k.startswith("BTN_")} >= set(routes)
+    assert routes, "no button made it into the table"
+
+
+@pytest.mark.parametrize("state", STATES)
+def test_button_table_matches_tree(bot, state):
+    table = _table("buttons", "message")
+
+    async def check():
+        mismatches = []
+        for text in BUTTON_TEXTS:
+            message = _message(text)
+            kwargs = {"bot": bot, "raw_state": state}
+            picked = await table(message, raw_state=state)
+            if not picked:
+                continue   # falls through to the tree itself
+            expected = await _tree_pick(_routers, "message", message, **kwargs)
+            if picked["handler"] is not expected:
+                mismatches.append((text, picked["handler"].callback.__name__,
+                                   expected and expected.callback.__name__))
+        return mismatches
+
+    assert _run(check()) == []
+
+
+def test_buttons_route_by_table_outside_dialogs():
+    table = _table("buttons", "message")
+    missed = [text for text in table.routes
+              if not _run(table(_message(text), raw_state=None))]
+    assert missed == []
+
+
+# ── Callbacks ─────────────────────────────────────────────────────────────────
+
+def _samples(annotation) -> list:
+    origin, args = get_origin(annotation), get_args(annotation)
+    if origin in (Union, types.UnionType):
+        return [None] + _samples(next(a for a in args if a is not type(None)))
+    if origin in (list, tuple):
+        return [[1, 2]]
+    if annotation is bool:
+        return [True, False]
+    if annotation is int:
+        return [1]
+    if annotation is str:
+        return ["x"]
+    if isinstance(annotation, type) and issubclass(annotation, Enum):
+        return list(annotation)
+    raise TypeError(annotation)
+
+
+def _payloads() -> list[str]:
+    """Every packed payload class × every combination of sample field values."""
+    payloads = []
+    for prefix, cls in _prefixes.items():
+        if prefix.startswith(("~", "t~")):
+            continue   # abstract bases and test-only classes
+        fields = cls.model_fields
+        for values in itertools.product(*(_samples(f.annotation) for f in fields.values())):
+            payloads.append(cls(**dict(zip(fields, values))).pack())
+    return payloads
+
+
+def test_every_prefix_is_in_the_table():
+    routes = _table("callbacks", "callback_query").routes
+    schema = {p for p in _prefixes if not p.startswith(("~", "t~"))}
+    assert set(routes) == schema
+
+
+@pytest.mark.parametrize("state", STATES)
+def test_callback_table_matches_tree(bot, state):
+    table = _table("callbacks", "callback_query")
+
+    async def check():
+        mismatches = []
+        for data in _payloads() + ["legacy:1", "zz:AA"]:
+            query = _query(data)
+            kwargs = {"bot": bot, "raw_state": state}
+            picked = await table(query, **kwargs)
+            expected = await _tree_pick(_routers, "callback_query", query, **kwargs)
+            got = picked["handler"] if picked else None
+            if picked and got is not expected:
+                mismatches.append((data, got.callback.__name__,
+                                   expected and expected.callback.__name__))
+            # Every handler is indexed, so what the table can't resolve nothing handles
+            if not picked and expected is not None:
+                mismatches.append((data, None, expected.callback.__name__))
+        return mismatches
+
+    assert _run(check()) == []
@@ -0,0 +1,65 @@
+import asyncio
+import re
+
+import pytest
+
+from services.search import ranked_search
+
+ROWS = [
+    {"id": 1, "phone": "+998 90 123-45-67", "phone_norm": "+998901234567"},
+    {"id": 2, "phone": "+998 91 765-43-21", "phone_norm": "+998917654321"},
+    {"id": 3, "phone": "90 555 12 34", "phone_norm": None},   # never normalized
+]
+
+
+class FakeConn:
+    """Answers ranked_search's phone queries from ROWS, logging which path ran."""
+
+    def __init__(self):
+        self.paths = []
+
+    async def fetch(self, sql: str, *params):
+        *args, limit, offset = params
+        if "reverse(phone_norm)" in sql:
+            self.paths.append("suffix")
+            suffix = args[0][::-1]
+            hits = [r for r in ROWS if r["phone_norm"] and r["phone_norm"].endswith(suffix)]
+        elif "phone_norm =" in sql:
+            self.paths.append("exact")
+            hits = [r for r in ROWS if r["phone_norm"] == args[0]]
+        elif "LIKE" in sql:
+            self.paths.append("substring")
+            hits = [r for r in ROWS if args[0].strip("%") in re.sub(r"\D", "", r["phone"])]
+        else:
+            raise AssertionError(sql)
+        return hits[offset:offset + limit]
+
+
+def _search(query: str):
+    conn = FakeConn()
+    page = asyncio.run(ranked_search(
+        conn, table="users", where="TRUE", args=(), text_cols=("full_name",),
+        phone_col="phone", norm_col="phone_norm", query=query, order="id"))
+    return [r["id"] for r in page.rows], conn.paths
+
+
+def test_full_number_is_exact():
+    assert _search("90 123 45 67") == ([1], ["exact"])
+
+
+def test_suffix_uses_the_index():
+    assert _search("4567") == ([1], ["suffix"])
+
+
+@pytest.mark.parametrize("query", ["90 123", "(90) 1234"])
+def test_middle_fragment_falls_back_to_substring(query):
+    assert _search(query) == ([1], ["suffix", "substring"])
+
+
+def test_null_normalized_phone_still_found():
+    assert _search("555 12 34") == ([3], ["suffix", "substring"])
+
+
+def test_short_and_long_fragments_are_substring():
+    assert _search("765") == ([2], ["substring"])
+    assert _search("99890123") == ([1], ["substring"])
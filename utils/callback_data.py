@@ -0,0 +1,352 @@
+"""
+Typed inline-button payloads, packed small.
+
+Every callback payload is a PackedCallbackData subclass: a short prefix that
+names the action plus typed fields, packed as
+
+    "<prefix>:<base64url of the fields>"      e.g. RentalDetail(id=4821) → "rv:qks"
+
+Fields are encoded in declaration order without names: ints as zigzag
+varints (ids under a million take 3 bytes), bools as one byte, enums by
+member index, str with a length, list[int] with a count — so a batch button
+can carry several ids well under Telegram's 64-byte limit. Optional fields
+cost one byte when absent.
+
+Handlers filter with the class and get the decoded object:
+
+    @router.callback_query(RentalDetail.filter())
+    async def cb_rental_detail(callback: CallbackQuery, callback_data: RentalDetail): ...
+
+The prefix is also what handlers/callbacks.py routes on, so each one is
+registered once. New enum members go at the end — the index is what is
+stored in buttons already sent.
+"""
+import base64
+import types
+from enum import Enum
+from typing import Any, ClassVar, Optional, Union, get_args, get_origin
+
+from aiogram.filters.callback_data import CallbackData, MAX_CALLBACK_LENGTH
+
+_prefixes: dict[str, type] = {}
+
+
+# ── Encoding ──────────────────────────────────────────────────────────────────
+
+def _put_varint(out: bytearray, n: int) -> None:
+    n = n * 2 if n >= 0 else -n * 2 - 1   # zigzag: small negatives stay short
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+class _Reader:
+    __slots__ = ("data", "pos")
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def varint(self) -> int:
+        n = shift = 0
+        while True:
+            if self.pos >= len(self.data):
+                raise ValueError("Truncated callback data")
+            byte = self.data[self.pos]
+            self.pos += 1
+            n |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return n // 2 if n % 2 == 0 else -(n + 1) // 2
+            shift += 7
+
+    def bytes(self, size: int) -> bytes:
+        if size < 0 or self.pos + size > len(self.data):
+            raise ValueError("Truncated callback data")
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return chunk
+
+
+def _codec(annotation: Any) -> tuple:
+    """(encode(out, value), decode(reader)) for one field type."""
+    origin, args = get_origin(annotation), get_args(annotation)
+    if origin in (Union, types.UnionType) and type(None) in args:
+        (inner,) = [a for a in args if a is not type(None)]
+        put, get = _codec(inner)
+
+        def put_optional(out: bytearray, value: Any) -> None:
+            out.append(value is not None)
+            if value is not None:
+                put(out, value)
+
+        def get_optional(reader: _Reader) -> Any:
+            return get(reader) if reader.bytes(1)[0] else None
+
+        return put_optional, get_optional
+    if origin in (list, tuple) and args and args[0] is int:
+        def put_ints(out: bytearray, values) -> None:
+            _put_varint(out, len(values))
+            for v in values:
+                _put_varint(out, v)
+
+        return put_ints, lambda reader: [reader.varint() for _ in range(reader.varint())]
+    if annotation is bool:
+        return (lambda out, value: out.append(value),
+                lambda reader: bool(reader.bytes(1)[0]))
+    if annotation is int:
+        return _put_varint, _Reader.varint
+    if annotation is str:
+        def put_str(out: bytearray, value: str) -> None:
+            raw = value.encode()
+            _put_varint(out, len(raw))
+            out += raw
+
+        return put_str, lambda reader: reader.bytes(reader.varint()).decode()
+    if isinstance(annotation, type) and issubclass(annotation, Enum):
+        members = list(annotation)
+        index = {m: i for i, m in enumerate(members)}
+
+        def get_member(reader: _Reader) -> Enum:
+            i = reader.varint()
+            if not 0 <= i < len(members):
+                raise ValueError(f"Unknown {annotation.__name__} #{i}")
+            return members[i]
+
+        return (lambda out, value: _put_varint(out, index[value])), get_member
+    raise TypeError(f"Can't pack {annotation!r} into callback data")
+
+
+# ── Base class ────────────────────────────────────────────────────────────────
+
+class PackedCallbackData(CallbackData, prefix="~"):
+    __packing__: ClassVar[list[tuple[str, Any, Any]]] = []
+
+    @classmethod
+    def __pydantic_init_subclass__(cls, **kwargs: Any) -> None:
+        super().__pydantic_init_subclass__(**kwargs)
+        owner = _prefixes.setdefault(cls.__prefix__, cls)
+        if owner is not cls:
+            raise ValueError(f"Callback prefix {cls.__prefix__!r} is taken by {owner.__name__}")
+        cls.__packing__ = [(name, *_codec(field.annotation))
+                           for name, field in cls.model_fields.items()]
+
+    def pack(self) -> str:
+        out = bytearray()
+        for name, put, _ in self.__packing__:
+            put(out, getattr(self, name))
+        packed = f"{self.__prefix__}:{base64.urlsafe_b64encode(out).rstrip(b'=').decode()}"
+        if len(packed.encode()) > MAX_CALLBACK_LENGTH:
+            raise ValueError(f"Callback data too long: {packed!r}")
+        return packed
+
+    @classmethod
+    def unpack(cls, value: str) -> "PackedCallbackData":
+        prefix, _, body = value.partition(":")
+        if prefix != cls.__prefix__:
+            raise ValueError(f"Bad prefix ({prefix!r} != {cls.__prefix__!r})")
+        try:
+            raw = base64.b64decode(body + "=" * (-len(body) % 4), altchars=b"-_", validate=True)
+        except ValueError:
+            raise ValueError(f"Bad callback payload {value!r}") from None
+        reader = _Reader(raw)
+        values = {name: get(reader) for name, _, get in cls.__packing__}
+        if reader.pos != len(reader.data):
+            raise ValueError(f"Trailing bytes in callback data {value!r}")
+        return cls(**values)
+
+
+def callback_prefix(data: str) -> str:
+    """The routing key of a packed payload (see handlers/callbacks.py)."""
+    return data.partition(":")[0]
+
+
+# ── Schema ────────────────────────────────────────────────────────────────────
+# Two-letter prefixes, first letter per area: u = users, t = tools,
+# r = rentals/returns, d = debts, s = sub-accounts.
+
+class Id(PackedCallbackData, prefix="~id"):
+    """Base for payloads that are just a row id."""
+    id: int
+
+
+class Confirm(PackedCallbackData, prefix="~yn"):
+    """Base for "are you sure?" answers — see confirm_delete_keyboard()."""
+    id: int
+    yes: bool
+
+
+class KeysetPage(PackedCallbackData, prefix="~kp"):
+    """
+    ◀️/▶️ of a keyset-paginated list — see pagination_row(). The row count
+    rides along so later pages never re-run COUNT(*).
+    """
+    forward: bool
+    page: int       # target page number
+    total: int
+    anchor: int     # id of the first (◀️) or last (▶️) row shown
+
+
+class OffsetPage(PackedCallbackData, prefix="~op"):
+    """Next/previous batch of ranked search hits."""
+    offset: int
+
+
+# Users (super admin)
+
+class UsersPage(KeysetPage, prefix="ul"):
+    pass
+
+
+class UserSearchPage(OffsetPage, prefix="us"):
+    pass
+
+
+class UserView(Id, prefix="uv"):
+    pass
+
+
+class UserOp(str, Enum):
+    activate = "activate"
+    deactivate = "deactivate"
+    edit = "edit"
+    delete = "delete"
+
+
+class UserAction(PackedCallbackData, prefix="ua"):
+    op: UserOp
+    id: int
+
+
+class UserDelete(Confirm, prefix="ux"):
+    pass
+
+
+# Tools
+
+class ToolsPage(KeysetPage, prefix="tl"):
+    pass
+
+
+class ToolSearchPage(OffsetPage, prefix="ts"):
+    pass
+
+
+class ToolPurpose(str, Enum):
+    select = "select"
+    edit = "edit"
+    delete = "delete"
+
+
+class ToolPick(PackedCallbackData, prefix="tp"):
+    purpose: ToolPurpose
+    id: int
+
+
+class ToolField(str, Enum):
+    name = "name"
+    qty = "qty"
+    price = "price"
+
+
+class ToolEditField(PackedCallbackData, prefix="tf"):
+    field: ToolField
+    id: int
+
+
+class ToolDelete(Confirm, prefix="tx"):
+    pass
+
+
+# Rentals and returns
+
+class RentalsPage(KeysetPage, prefix="rl"):
+    pass
+
+
+class RentalDetail(Id, prefix="rv"):
+    pass
+
+
+class RentalTool(PackedCallbackData, prefix="rt"):
+    """A tool toggled in the new-rental picker; no id = "done"."""
+    tool_id: Optional[int] = None
+
+
+class RentalConfirmOp(str, Enum):
+    yes = "yes"
+    edit = "edit"
+    cancel = "cancel"
+
+
+class RentalConfirm(PackedCallbackData, prefix="rc"):
+    op: RentalConfirmOp
+
+
+class ReturnSearchPage(OffsetPage, prefix="rm"):
+    pass
+
+
+class ReturnRental(Id, prefix="rr"):
+    pass
+
+
+class ReturnType(PackedCallbackData, prefix="ry"):
+    full: bool
+    rental_id: int
+
+
+class ReturnItem(Id, prefix="ri"):
+    pass
+
+
+class MoreItems(PackedCallbackData, prefix="rn"):
+    more: bool
+
+
+class ReturnPayment(PackedCallbackData, prefix="rp"):
+    full: bool
+    rental_id: int
+
+
+# Debts
+
+class DebtsPage(KeysetPage, prefix="dl"):
+    pass
+
+
+class DebtSearchPage(OffsetPage, prefix="ds"):
+    pass
+
+
+class DebtView(Id, prefix="dv"):
+    pass
+
+
+class DebtOp(str, Enum):
+    pay = "pay"
+    delete = "delete"
+
+
+class DebtAction(PackedCallbackData, prefix="da"):
+    op: DebtOp
+    id: int
+
+
+class DebtPayment(PackedCallbackData, prefix="dp"):
+    full: bool
+    id: int
+
+
+class DebtDelete(Confirm, prefix="dx"):
+    pass
+
+
+# Sub-accounts
+
+class SubAccountAdd(PackedCallbackData, prefix="sa"):
+    pass
+
+
+class SubAccountDelete(Id, prefix="sd"):
+    pass
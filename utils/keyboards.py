@@ -1,27 +1,72 @@
+"""
+Keyboards. Markups are immutable once built, so they are shared instead of
+rebuilt: menus with no arguments are built once (@cache), and the big
+dynamic ones are memoized under a key that captures everything they show —
+the shop's catalog version, the selected ids, the page. Callers must never
+mutate a returned markup.
+"""
+from functools import cache
+from typing import Callable, Hashable
+
 from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
+from utils.cache import TTLCache, MISSING
+from utils.callback_data import (
+    Id, Confirm, KeysetPage, OffsetPage, UserAction, UserOp,
+    ToolPick, ToolPurpose, ToolEditField, ToolField,
+    RentalTool, RentalConfirm, RentalConfirmOp, RentalDetail, ReturnType, ReturnPayment, MoreItems,
+    DebtAction, DebtOp, DebtPayment, SubAccountAdd, SubAccountDelete,
+)
 from utils.texts import *
 
+_markups = TTLCache(maxsize=4096, ttl=3600)
+
+
+def _memoized(key: Hashable, build: Callable[[], InlineKeyboardMarkup]) -> InlineKeyboardMarkup:
+    markup = _markups.get(key)
+    if markup is MISSING:
+        markup = build()
+        _markups.set(key, markup)
+    return markup
+
+
+def keyboard_cache_stats() -> dict:
+    return _markups.stats()
+
+
+def _column(buttons: list[InlineKeyboardButton],
+            *tail: list[InlineKeyboardButton]) -> InlineKeyboardMarkup:
+    """
+    One button per row, then the `tail` rows. Built directly: the builder
+    re-validates the whole markup on every button, which is quadratic and
+    dominates for catalogs with hundreds of tools.
+    """
+    return InlineKeyboardMarkup(inline_keyboard=[[b] for b in buttons] + [t for t in tail if t])
+
 
+@cache
 def remove_keyboard():
     return ReplyKeyboardRemove()
 
 
+@cache
 def back_keyboard():
     builder = ReplyKeyboardBuilder()
     builder.button(text=BTN_BACK)
     return builder.as_markup(resize_keyboard=True)
 
 
+@cache
 def cancel_keyboard():
     builder = ReplyKeyboardBuilder()
     builder.button(text=BTN_CANCEL)
     return builder.as_markup(resize_keyboard=True)
 
 
+@cache
 def back_cancel_keyboard():
     builder = ReplyKeyboardBuilder()
     builder.button(text=BTN_BACK)
@@ -32,6 +77,7 @@ def back_cancel_keyboard():
 
 # ===================== SUPER ADMIN =====================
 
+@cache
 def admin_main_menu():
     builder = ReplyKeyboardBuilder()
     builder.button(text=BTN_ADD_USER)
@@ -44,34 +90,71 @@ def admin_main_menu():
 def admin_user_actions(user_id: int, is_active: bool):
     builder = InlineKeyboardBuilder()
     if is_active:
-        builder.button(text=BTN_DEACTIVATE, callback_data=f"user:deactivate:{user_id}")
+        builder.button(text=BTN_DEACTIVATE, callback_data=UserAction(op=UserOp.deactivate, id=user_id))
     else:
-        builder.button(text=BTN_ACTIVATE, callback_data=f"user:activate:{user_id}")
-    builder.button(text=BTN_EDIT_USER, callback_data=f"user:edit:{user_id}")
-    builder.button(text=BTN_DELETE_USER, callback_data=f"user:delete:{user_id}")
+        builder.button(text=BTN_ACTIVATE, callback_data=UserAction(op=UserOp.activate, id=user_id))
+    builder.button(text=BTN_EDIT_USER, callback_data=UserAction(op=UserOp.edit, id=user_id))
+    builder.button(text=BTN_DELETE_USER, callback_data=UserAction(op=UserOp.delete, id=user_id))
     builder.adjust(2)
     return builder.as_markup()
 
 
-def confirm_delete_keyboard(callback_prefix: str, item_id: int):
+def confirm_delete_keyboard(answer: type[Confirm], item_id: int):
     builder = InlineKeyboardBuilder()
-    builder.button(text=BTN_YES, callback_data=f"{callback_prefix}:confirm:{item_id}")
-    builder.button(text=BTN_NO, callback_data=f"{callback_prefix}:cancel:{item_id}")
+    builder.button(text=BTN_YES, callback_data=answer(id=item_id, yes=True))
+    builder.button(text=BTN_NO, callback_data=answer(id=item_id, yes=False))
     builder.adjust(2)
     return builder.as_markup()
 
 
-def pagination_keyboard(current: int, total_pages: int, prefix: str):
+def pagination_row(page_type: type[KeysetPage], page: int, total: int, first_id: int, last_id: int,
+                   has_prev: bool, has_next: bool) -> list[InlineKeyboardButton]:
+    """◀️/▶️ buttons for a keyset-paginated list (see KeysetPage)."""
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(text=BTN_PREV, callback_data=page_type(
+            forward=False, page=page - 1, total=total, anchor=first_id).pack()))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text=BTN_NEXT, callback_data=page_type(
+            forward=True, page=page + 1, total=total, anchor=last_id).pack()))
+    return buttons
+
+
+def offset_pagination_row(page_type: type[OffsetPage], offset: int, limit: int,
+                          has_prev: bool, has_next: bool) -> list[InlineKeyboardButton]:
+    """◀️/▶️ buttons for search results, which are ranked and so paged by offset."""
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(
+            text=BTN_PREV, callback_data=page_type(offset=max(offset - limit, 0)).pack()))
+    if has_next:
+        buttons.append(InlineKeyboardButton(
+            text=BTN_NEXT, callback_data=page_type(offset=offset + limit).pack()))
+    return buttons
+
+
+def pagination_keyboard(nav: list[InlineKeyboardButton]):
     builder = InlineKeyboardBuilder()
-    if current > 1:
-        builder.button(text=BTN_PREV, callback_data=f"{prefix}:page:{current - 1}")
-    if current < total_pages:
-        builder.button(text=BTN_NEXT, callback_data=f"{prefix}:page:{current + 1}")
+    if nav:
+        builder.row(*nav)
+    return builder.as_markup()
+
+
+def numbered_list_keyboard(rows: list, start: int, view: type[Id],
+                           nav: list[InlineKeyboardButton] = None):
+    """Buttons "1", "2", … opening each entry of a paginated text list."""
+    builder = InlineKeyboardBuilder()
+    for n, row in enumerate(rows, start):
+        builder.button(text=str(n), callback_data=view(id=row["id"]))
+    builder.adjust(5)
+    if nav:
+        builder.row(*nav)
     return builder.as_markup()
 
 
 # ===================== USER / SHOP OWNER =====================
 
+@cache
 def user_main_menu():
     builder = ReplyKeyboardBuilder()
     builder.button(text=BTN_TOOLS)
@@ -84,6 +167,7 @@ def user_main_menu():
 
 # ---- TOOLS ----
 
+@cache
 def tools_menu():
     builder = ReplyKeyboardBuilder()
     builder.button(text=BTN_ADD_TOOL)
@@ -95,28 +179,31 @@ def tools_menu():
     return builder.as_markup(resize_keyboard=True)
 
 
-def tools_list_keyboard(tools: list, prefix: str = "tool_select"):
-    builder = InlineKeyboardBuilder()
-    for tool in tools:
-        builder.button(
-            text=f"🔧 {tool['name']} (x{tool['quantity']})",
-            callback_data=f"{prefix}:{tool['id']}"
-        )
-    builder.adjust(1)
-    return builder.as_markup()
+def tools_list_keyboard(tools: list, purpose: ToolPurpose = ToolPurpose.select,
+                        version: Hashable = None):
+    """`version` — the shop's catalog version; when given the markup is memoized."""
+    if version is not None:
+        return _memoized(("tools", version, purpose),
+                         lambda: tools_list_keyboard(tools, purpose))
+    return _column([
+        InlineKeyboardButton(text=f"🔧 {tool['name']} (x{tool['quantity']})",
+                             callback_data=ToolPick(purpose=purpose, id=tool["id"]).pack())
+        for tool in tools
+    ])
 
 
 def edit_tool_fields_keyboard(tool_id: int):
     builder = InlineKeyboardBuilder()
-    builder.button(text=BTN_EDIT_NAME, callback_data=f"tool_edit_field:name:{tool_id}")
-    builder.button(text=BTN_EDIT_QTY, callback_data=f"tool_edit_field:qty:{tool_id}")
-    builder.button(text=BTN_EDIT_PRICE, callback_data=f"tool_edit_field:price:{tool_id}")
+    builder.button(text=BTN_EDIT_NAME, callback_data=ToolEditField(field=ToolField.name, id=tool_id))
+    builder.button(text=BTN_EDIT_QTY, callback_data=ToolEditField(field=ToolField.qty, id=tool_id))
+    builder.button(text=BTN_EDIT_PRICE, callback_data=ToolEditField(field=ToolField.price, id=tool_id))
     builder.adjust(1)
     return builder.as_markup()
 
 
 # ---- RENTALS ----
 
+@cache
 def rentals_menu():
     builder = ReplyKeyboardBuilder()
     builder.button(text=BTN_ADD_RENTAL)
@@ -127,72 +214,69 @@ def rentals_menu():
     return builder.as_markup(resize_keyboard=True)
 
 
-def rental_tools_selection_keyboard(tools: list, selected_ids: list[int] = None):
+def rental_tools_selection_keyboard(tools: list, selected_ids: list[int] = None,
+                                    version: Hashable = None):
+    """`version` — the shop's catalog version; when given the markup is memoized."""
     selected_ids = selected_ids or []
-    builder = InlineKeyboardBuilder()
-    for tool in tools:
-        if tool["quantity"] > 0:
-            check = "✅ " if tool["id"] in selected_ids else ""
-            builder.button(
-                text=f"{check}🔧 {tool['name']} (x{tool['quantity']}) - {tool['daily_price']:,.0f} so'm",
-                callback_data=f"rental_tool:{tool['id']}"
-            )
-    builder.button(text=BTN_FINISH_TOOLS, callback_data="rental_tool:done")
-    builder.adjust(1)
-    return builder.as_markup()
+    if version is not None:
+        return _memoized(("rental_tools", version, frozenset(selected_ids)),
+                         lambda: rental_tools_selection_keyboard(tools, selected_ids))
+    selected_ids = set(selected_ids)
+    return _column([
+        InlineKeyboardButton(
+            text=f"{'✅ ' if tool['id'] in selected_ids else ''}🔧 {tool['name']} "
+                 f"(x{tool['quantity']}) - {tool['daily_price']:,.0f} so'm",
+            callback_data=RentalTool(tool_id=tool["id"]).pack()
+        )
+        for tool in tools if tool["quantity"] > 0
+    ], [InlineKeyboardButton(text=BTN_FINISH_TOOLS, callback_data=RentalTool().pack())])
 
 
+@cache
 def rental_confirmation_keyboard():
     builder = InlineKeyboardBuilder()
-    builder.button(text=BTN_CONFIRM, callback_data="rental_confirm:yes")
-    builder.button(text=BTN_EDIT, callback_data="rental_confirm:edit")
-    builder.button(text=BTN_DELETE, callback_data="rental_confirm:cancel")
+    builder.button(text=BTN_CONFIRM, callback_data=RentalConfirm(op=RentalConfirmOp.yes))
+    builder.button(text=BTN_EDIT, callback_data=RentalConfirm(op=RentalConfirmOp.edit))
+    builder.button(text=BTN_DELETE, callback_data=RentalConfirm(op=RentalConfirmOp.cancel))
     builder.adjust(2)
     return builder.as_markup()
 
 
-def rental_list_keyboard(rentals: list):
-    builder = InlineKeyboardBuilder()
-    for r in rentals:
-        builder.button(
-            text=f"👤 {r['customer_name']} | 📞 {r['customer_phone']}",
-            callback_data=f"rental_detail:{r['id']}"
-        )
-    builder.adjust(1)
-    return builder.as_markup()
+def rental_list_keyboard(rentals: list, nav: list[InlineKeyboardButton] = None):
+    # No version for rentals — the page is keyed on exactly what it shows
+    key = ("rentals",
+           tuple((r["id"], r["customer_name"], r["customer_phone"]) for r in rentals),
+           tuple(b.callback_data for b in nav or ()))
+    return _memoized(key, lambda: _rental_list_keyboard(rentals, nav))
 
 
-def rental_return_type_keyboard(rental_id: int):
-    builder = InlineKeyboardBuilder()
-    builder.button(text=BTN_FULL_RETURN, callback_data=f"return_type:full:{rental_id}")
-    builder.button(text=BTN_PARTIAL_RETURN, callback_data=f"return_type:partial:{rental_id}")
-    builder.adjust(1)
-    return builder.as_markup()
+def _rental_list_keyboard(rentals: list, nav: list[InlineKeyboardButton] = None):
+    return _column([
+        InlineKeyboardButton(text=f"👤 {r['customer_name']} | 📞 {r['customer_phone']}",
+                             callback_data=RentalDetail(id=r["id"]).pack())
+        for r in rentals
+    ], nav)
 
 
-def unreturned_items_keyboard(items: list):
+def rental_return_type_keyboard(rental_id: int):
     builder = InlineKeyboardBuilder()
-    for item in items:
-        remaining = item["quantity"] - item["returned_quantity"]
-        builder.button(
-            text=f"🔧 {item['tool_name']} (qaytarilmagan: {remaining})",
-            callback_data=f"return_item:{item['id']}"
-        )
-    builder.button(text=BTN_FINISH_RETURN, callback_data="return_item:done")
+    builder.button(text=BTN_FULL_RETURN, callback_data=ReturnType(full=True, rental_id=rental_id))
+    builder.button(text=BTN_PARTIAL_RETURN, callback_data=ReturnType(full=False, rental_id=rental_id))
     builder.adjust(1)
     return builder.as_markup()
 
 
 def payment_type_keyboard(rental_id: int):
     builder = InlineKeyboardBuilder()
-    builder.button(text=BTN_FULL_PAYMENT, callback_data=f"payment:full:{rental_id}")
-    builder.button(text=BTN_PARTIAL_PAYMENT, callback_data=f"payment:partial:{rental_id}")
+    builder.button(text=BTN_FULL_PAYMENT, callback_data=ReturnPayment(full=True, rental_id=rental_id))
+    builder.button(text=BTN_PARTIAL_PAYMENT, callback_data=ReturnPayment(full=False, rental_id=rental_id))
     builder.adjust(1)
     return builder.as_markup()
 
 
 # ---- DEBTS ----
 
+@cache
 def debts_menu():
     builder = ReplyKeyboardBuilder()
     builder.button(text=BTN_DEBT_LIST)
@@ -206,25 +290,26 @@ def debts_menu():
 
 def debt_actions_keyboard(debt_id: int):
     builder = InlineKeyboardBuilder()
-    builder.button(text=BTN_PAY_DEBT, callback_data=f"debt_pay:{debt_id}")
-    builder.button(text=BTN_DELETE, callback_data=f"debt_delete:{debt_id}")
+    builder.button(text=BTN_PAY_DEBT, callback_data=DebtAction(op=DebtOp.pay, id=debt_id))
+    builder.button(text=BTN_DELETE, callback_data=DebtAction(op=DebtOp.delete, id=debt_id))
     builder.adjust(2)
     return builder.as_markup()
 
 
 def debt_pay_type_keyboard(debt_id: int):
     builder = InlineKeyboardBuilder()
-    builder.button(text=BTN_FULL_PAYMENT, callback_data=f"debt_payment:full:{debt_id}")
-    builder.button(text=BTN_PARTIAL_PAYMENT, callback_data=f"debt_payment:partial:{debt_id}")
+    builder.button(text=BTN_FULL_PAYMENT, callback_data=DebtPayment(full=True, id=debt_id))
+    builder.button(text=BTN_PARTIAL_PAYMENT, callback_data=DebtPayment(full=False, id=debt_id))
     builder.adjust(1)
     return builder.as_markup()
 
 
+@cache
 def yes_no_keyboard():
     """Used for 'Yana bor?' prompt during partial return."""
     builder = InlineKeyboardBuilder()
-    builder.button(text="✅ Ha, yana bor", callback_data="more_items:yes")
-    builder.button(text="❌ Yo'q, tugatish", callback_data="more_items:no")
+    builder.button(text="✅ Ha, yana bor", callback_data=MoreItems(more=True))
+    builder.button(text="❌ Yo'q, tugatish", callback_data=MoreItems(more=False))
     builder.adjust(1)
     return builder.as_markup()
 
@@ -237,8 +322,8 @@ def sub_accounts_keyboard(sub_accounts: list):
     for sa in sub_accounts:
         builder.button(
             text=f"🗑 TG ID: {sa['telegram_id']}",
-            callback_data=f"sub_del:{sa['id']}"
+            callback_data=SubAccountDelete(id=sa["id"])
         )
-    builder.button(text=BTN_ADD_SUB, callback_data="sub_add")
+    builder.button(text=BTN_ADD_SUB, callback_data=SubAccountAdd())
     builder.adjust(1)
     return builder.as_markup()
@@ -0,0 +1,213 @@
+"""
+Outbound message queue that respects Telegram's flood limits.
+
+Telegram allows about 30 messages a second per bot, about one a second per
+private chat and 20 a minute per group; past that it answers 429 with a
+retry_after. A handler that awaits ten sends in a row then sits in that
+sleep while holding its chat lock and a DB connection.
+
+Handlers hand messages to the outbox instead and return at once:
+
+    outbox.answer(message, text, reply_markup=...)
+
+Each chat with pending messages gets one sender task, so a chat's messages
+go out in order and a slow chat never holds up the others. A message waits
+for a token from its chat's bucket and from the global one. A 429 pauses
+only that chat for retry_after seconds and the message is retried. Texts
+queued back to back for one chat go out as a single message when they fit
+and the earlier one has no keyboard of its own.
+
+Messages sent directly (await message.answer) don't pass through here, so
+they can overtake queued ones — use one or the other within a handler.
+
+Today only the user and debt search handlers queue here (the menu, then
+the page of hits), and one reply per update stays well inside the limits.
+The outbox is for sends that do burst — notifying other chats, broadcasts,
+anything that loops over recipients — which must go through it rather than
+await send_message in a loop.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.types import Message
+from loguru import logger
+
+from utils.cache import TTLCache, MISSING
+
+MESSAGE_LIMIT = 4096
+_SEPARATOR = "\n\n"
+_MAX_ATTEMPTS = 5
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate            # tokens per second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Hand out nothing for `seconds` and start empty afterwards."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+def _without_markup(kwargs: dict[str, Any]) -> dict[str, Any]:
+    return {k: v for k, v in kwargs.items() if k != "reply_markup"}
+
+
+class _Outgoing:
+    __slots__ = ("bot", "chat_id", "text", "kwargs", "queued_at")
+
+    def __init__(self, bot: Bot, chat_id: int, text: str, kwargs: dict[str, Any]):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.queued_at = [time.monotonic()]   # one per merged message
+
+    def absorb(self, other: "_Outgoing") -> bool:
+        """Append `other` to this message if the result is still one valid send."""
+        if self.kwargs.get("reply_markup") is not None:
+            return False   # the keyboard belongs under this text, not the next
+        if _without_markup(other.kwargs) != _without_markup(self.kwargs) or other.bot is not self.bot:
+            return False
+        if len(self.text) + len(_SEPARATOR) + len(other.text) > MESSAGE_LIMIT:
+            return False
+        self.text += _SEPARATOR + other.text
+        self.kwargs = dict(other.kwargs)
+        self.queued_at += other.queued_at
+        return True
+
+
+class Outbox:
+    def __init__(self, rate: float, chat_rate: float, chat_burst: float,
+                 group_per_minute: float):
+        self._global = TokenBucket(rate, max(rate, 1))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_minute / 60
+        # An idle chat's bucket is full again within a minute; forget it then
+        self._buckets = TTLCache(100_000, ttl=60)
+        self._queues: dict[int, deque[_Outgoing]] = {}
+        self._senders: dict[int, asyncio.Task] = {}
+        self.queued = 0
+        self.sent = 0
+        self.merged = 0
+        self.retry_after = 0
+        self.failed = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def answer(self, message: Message, text: str, **kwargs: Any) -> None:
+        """Queue a reply to message's chat — like message.answer(), minus the await."""
+        self.send(message.bot, message.chat.id, text, **kwargs)
+
+    def send(self, bot: Bot, chat_id: int, text: str, **kwargs: Any) -> None:
+        self.queued += 1
+        self._queues.setdefault(chat_id, deque()).append(_Outgoing(bot, chat_id, text, kwargs))
+        if chat_id not in self._senders:
+            self._senders[chat_id] = asyncio.create_task(
+                self._drain(chat_id), name=f"outbox-{chat_id}")
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is MISSING:
+            if chat_id < 0:   # groups and channels
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+        self._buckets.set(chat_id, bucket)   # refresh the TTL while in use
+        return bucket
+
+    async def _drain(self, chat_id: int) -> None:
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                bucket = self._bucket(chat_id)
+                await bucket.acquire()
+                await self._global.acquire()
+                # Tokens may have taken a while — merge whatever queued meanwhile
+                item = queue.popleft()
+                while queue and item.absorb(queue[0]):
+                    queue.popleft()
+                    self.merged += 1
+                await self._deliver(item, bucket)
+        finally:
+            del self._senders[chat_id]
+            if queue:   # cancelled mid-queue (shutdown)
+                self.failed += len(queue)
+            del self._queues[chat_id]
+
+    async def _deliver(self, item: _Outgoing, bucket: TokenBucket) -> None:
+        for attempt in range(1, _MAX_ATTEMPTS + 1):
+            try:
+                await item.bot.send_message(item.chat_id, item.text, **item.kwargs)
+            except TelegramRetryAfter as e:
+                self.retry_after += 1
+                logger.warning(f"Outbox: 429 for chat {item.chat_id}, retry in {e.retry_after}s")
+                bucket.pause(e.retry_after)
+                await bucket.acquire()
+                await self._global.acquire()
+            except TelegramNetworkError as e:
+                logger.warning(f"Outbox: send to {item.chat_id} failed ({e}), attempt {attempt}")
+                await asyncio.sleep(attempt)
+            except TelegramAPIError as e:
+                # Blocked by the user, chat gone, bad markup — retrying won't help
+                logger.warning(f"Outbox: dropped message to {item.chat_id}: {e}")
+                break
+            except Exception:
+                # Bad kwargs, an unexpected client error — drop it, keep draining
+                logger.exception(f"Outbox: dropped message to {item.chat_id}")
+                break
+            else:
+                now = time.monotonic()
+                for queued_at in item.queued_at:
+                    latency = now - queued_at
+                    self._latency_total += latency
+                    self._latency_max = max(self._latency_max, latency)
+                self.sent += len(item.queued_at)
+                return
+        self.failed += len(item.queued_at)
+
+    async def close(self, timeout: float) -> None:
+        """Give queued messages `timeout` seconds to go out, then drop the rest."""
+        senders = list(self._senders.values())
+        if not senders:
+            return
+        _, pending = await asyncio.wait(senders, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+            logger.warning(f"Outbox: {len(pending)} chats still had unsent messages")
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "pending": sum(len(q) for q in self._queues.values()),
+            "sent": self.sent,
+            "merged": self.merged,
+            "retry_after": self.retry_after,
+            "failed": self.failed,
+            "latency_avg_ms": round(self._latency_total / self.sent * 1000, 1) if self.sent else 0.0,
+            "latency_max_ms": round(self._latency_max * 1000, 1),
+        }
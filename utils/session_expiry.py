@@ -0,0 +1,184 @@
+"""
+Idle FSM session expiry + memory accounting, as a wrapper around any
+aiogram storage (MemoryStorage or PgStorage).
+
+A session is a key with a state or non-empty data. The wrapper remembers
+when each one was last touched and how big its data is (measured on write,
+so accounting never re-reads the storage). A sweep clears sessions idle
+longer than `idle_timeout` and remembers the key, so SessionExpiryMiddleware
+can tell the user once, on their next message, that the flow was dropped.
+Pass the dispatcher's events isolation so a sweep clears a chat only while
+holding that chat's lock — never under an update that is using the state.
+
+With MemoryStorage empty records are deleted outright — aiogram creates one
+for every chat that ever sent an update and keeps it forever, which is
+what made RSS creep.
+"""
+import asyncio
+import sys
+import time
+from contextlib import nullcontext
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from loguru import logger
+
+from utils.cache import TTLCache, MISSING
+
+
+def approx_size(obj: Any, _depth: int = 0) -> int:
+    """Rough deep sys.getsizeof of JSON-like FSM data."""
+    size = sys.getsizeof(obj)
+    if _depth > 8:
+        return size
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, _depth + 1) + approx_size(v, _depth + 1)
+                    for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(approx_size(v, _depth + 1) for v in obj)
+    return size
+
+
+class _Session:
+    __slots__ = ("touched", "has_state", "bytes")
+
+    def __init__(self):
+        self.touched = time.monotonic()
+        self.has_state = False
+        self.bytes = 0
+
+
+class IdleExpiryStorage(BaseStorage):
+    def __init__(self, inner: BaseStorage, idle_timeout: float, max_expired: int = 10000,
+                 isolation: BaseEventIsolation | None = None):
+        self.inner = inner
+        self.idle_timeout = idle_timeout
+        self.isolation = isolation
+        self._sessions: dict[StorageKey, _Session] = {}
+        # keys cleared by the sweep whose owner hasn't been told yet
+        self._expired = TTLCache(max_expired, ttl=7 * 24 * 3600)
+        self._bytes = 0
+        self._sweeper: asyncio.Task | None = None
+        self.evicted = 0
+
+    # ── BaseStorage ───────────────────────────────────────────────────────────
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self.inner.set_state(key, state)
+        session = self._touch(key, create=state is not None)
+        if session is not None:
+            session.has_state = state is not None
+            self._drop_if_empty(key, session)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state = await self.inner.get_state(key)
+        # A state we haven't seen written was restored by PgStorage after a
+        # restart — track it from now on so it can still idle out
+        session = self._touch(key, create=state is not None)
+        if session is None:
+            # MemoryStorage materializes a record on every read of a new key
+            self._discard_record(key)
+        elif state is not None:
+            session.has_state = True
+        return state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        await self.inner.set_data(key, data)
+        session = self._touch(key, create=bool(data))
+        if session is not None:
+            size = approx_size(data) if data else 0
+            self._bytes += size - session.bytes
+            session.bytes = size
+            self._drop_if_empty(key, session)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        data = await self.inner.get_data(key)
+        session = self._touch(key, create=bool(data))
+        if session is None:
+            self._discard_record(key)
+        elif data and not session.bytes:
+            session.bytes = approx_size(data)
+            self._bytes += session.bytes
+        return data
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        await self.inner.close()
+
+    # ── expiry ────────────────────────────────────────────────────────────────
+
+    def pop_expired(self, key: StorageKey) -> bool:
+        """True once if `key`'s session was dropped for being idle."""
+        if self._expired.get(key) is MISSING:
+            return False
+        self._expired.pop(key)
+        return True
+
+    async def sweep(self) -> int:
+        """Clear every session idle longer than idle_timeout. Returns how many."""
+        deadline = time.monotonic() - self.idle_timeout
+        idle = [k for k, s in self._sessions.items() if s.touched < deadline]
+        for key in idle:
+            async with self.isolation.lock(key) if self.isolation else nullcontext():
+                session = self._sessions.get(key)
+                if session is None or session.touched >= deadline:
+                    continue  # touched while we were clearing the others
+                self._forget(key, session)
+                await self.inner.set_state(key, None)
+                await self.inner.set_data(key, {})
+                self._discard_record(key)
+                self._expired.set(key, True)
+                self.evicted += 1
+        return len(idle)
+
+    def _touch(self, key: StorageKey, create: bool = False) -> _Session | None:
+        session = self._sessions.get(key)
+        if session is None:
+            if not create:
+                return None
+            session = self._sessions[key] = _Session()
+            if self._sweeper is None:
+                self._sweeper = asyncio.create_task(self._sweep_forever(), name="fsm-idle-sweep")
+        else:
+            session.touched = time.monotonic()
+        return session
+
+    def _drop_if_empty(self, key: StorageKey, session: _Session) -> None:
+        if not session.has_state and not session.bytes:
+            self._forget(key, session)
+            self._discard_record(key)
+
+    def _forget(self, key: StorageKey, session: _Session) -> None:
+        del self._sessions[key]
+        self._bytes -= session.bytes
+
+    def _discard_record(self, key: StorageKey) -> None:
+        if isinstance(self.inner, MemoryStorage):
+            self.inner.storage.pop(key, None)
+
+    async def _sweep_forever(self) -> None:
+        interval = min(max(self.idle_timeout / 4, 1), 60)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                evicted = await self.sweep()
+                if evicted:
+                    logger.info(f"FSM: dropped {evicted} idle session(s) | {self.stats()}")
+            except Exception as e:
+                logger.error(f"FSM idle sweep failed: {e}")
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "approx_bytes": self._bytes,
+            "evicted": self.evicted,
+            "pending_notices": len(self._expired),
+        }
@@ -0,0 +1,54 @@
+"""
+Request coalescing for read-through caches.
+
+When a burst of updates misses the same cache key at once, only the first
+caller (the leader) runs the loader; everyone else awaits the same task.
+The task is shielded, so a cancelled leader doesn't fail its waiters.
+
+    _flight = SingleFlight("users")
+    row = await _flight.do(tg_id, lambda: load_user(tg_id))
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, loader: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable) -> None:
+        """Let the next caller start a fresh load even if one is in flight."""
+        self._inflight.pop(key, None)
+
+    def forget_all(self) -> None:
+        """forget() every key — when a write can't be mapped to the keys it affects."""
+        self._inflight.clear()
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved — waiters already got it
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
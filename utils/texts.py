@@ -14,6 +14,7 @@ BTN_NO = "❌ Yo'q"
 MSG_SUCCESS = "✅ Muvaffaqiyatli bajarildi!"
 MSG_ERROR = "❌ Xatolik yuz berdi. Qaytadan urinib ko'ring."
 MSG_CANCELLED = "❌ Bekor qilindi."
+MSG_SESSION_EXPIRED = "⌛ Oldingi amal uzoq vaqt tugallanmagani uchun bekor qilindi. Iltimos, qaytadan boshlang."
 MSG_NOT_FOUND = "🔍 Hech narsa topilmadi."
 MSG_CONFIRM_DELETE = "🗑 Rostan ham o'chirishni xohlaysizmi?"
 
@@ -93,6 +94,7 @@ MSG_RENTAL_CUSTOMER_PHONE = "📞 Mijoz telefon raqamini kiriting:"
 MSG_SELECT_TOOL_FOR_RENTAL = "🔧 Ijara uchun asbobni tanlang (yoki 'Tugash' bosing):"
 MSG_TOOL_QTY_FOR_RENTAL = "🔢 '{name}' dan nechta ijalga berasiz? (Mavjud: {available})"
 MSG_TOOL_NOT_ENOUGH = "❌ Yetarli miqdor yo'q. Mavjud: {available}"
+MSG_RENTAL_STOCK_SHORT = "❌ Quyidagi asboblar yetarli emas:\n\n{tools}\n\nMiqdorni o'zgartirib qaytadan urinib ko'ring."
 BTN_FINISH_TOOLS = "✅ Asboblarni tugatish"
 
 MSG_RENTAL_SUMMARY = """📋 Ijara ma'lumotlari:
@@ -169,6 +171,10 @@ BTN_NEXT = "▶️ Keyingisi"
 BTN_PREV = "◀️ Oldingi"
 MSG_PAGE = "📄 Sahifa: {current}/{total}"
 
+# Search
+MSG_SEARCH_RESULTS = "🔍 Natijalar:"
+MSG_SEARCH_PAGE = "🔍 Natijalar (sahifa {page}):"
+
 # Sub-accounts
 BTN_SUB_ACCOUNTS = "👥 Qo'shimcha akkauntlar"
 MSG_SUB_ACCOUNTS_MENU = "👥 Qo'shimcha akkauntlar (maks. 4):\n\n{list}\n\nQo'shish yoki o'chirish uchun quyidagi tugmalardan foydalaning."